@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the benchmark suite.
+
+A gmagrc pointing at a scratch directory is written before gmag is
+imported and a synthetic archive is generated once per session, so the
+benchmarks never touch the network or an existing data directory.
+
+Run with
+python -m pytest benchmarks --benchmark-only
+"""
+
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+_home = tempfile.mkdtemp(prefix='gmag_bench_')
+os.makedirs(os.path.join(_home, '.gmag'), exist_ok=True)
+with open(os.path.join(_home, '.gmag', 'gmagrc'), 'w') as f:
+    f.write('[DEFAULT]\n'
+            f'data_dir = {os.path.join(_home, "data")}\n'
+            'ca_http = http://127.0.0.1:1/\n'
+            'im_http = http://127.0.0.1:1/image?\n'
+            'th_http = http://127.0.0.1:1/themis/\n')
+os.environ['HOME'] = _home
+os.environ['USERPROFILE'] = _home
+
+from gmag import synthetic  # noqa: E402
+
+# days in the synthetic archive
+NDAYS = 2
+SDATE = '2012-01-01'
+
+
+@pytest.fixture(scope='session')
+def archive():
+    """Synthetic archive for every array, written once per session."""
+    root = os.path.join(_home, 'data')
+    return synthetic.archive(root, sdate=SDATE, ndays=NDAYS)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the geoelectric field calculation.
+"""
+
+import numpy as np
+import pytest
+
+from gmag import efield
+
+res, thick = efield.get_res('GILL')
+
+
+@pytest.fixture(scope='module')
+def mag():
+    """Ten days of 1 s synthetic field."""
+    rng = np.random.default_rng(0)
+    n = 10*86400
+    return (rng.standard_normal(n).cumsum(), rng.standard_normal(n).cumsum())
+
+
+def test_calcE(benchmark, mag):
+    ex, ey = benchmark.pedantic(efield.calcE, args=(*mag, res, thick),
+                                kwargs={'dt': 1}, rounds=3)
+    assert ex.shape == mag[0].shape
+
+
+def test_calcE_chunk(benchmark, mag):
+    ex, ey = benchmark.pedantic(efield.calcE_chunk, args=(*mag, res, thick),
+                                kwargs={'dt': 1, 'mem': 2**24}, rounds=3)
+    assert ex.shape == mag[0].shape
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for extracting windows around many events.
+"""
+
+import numpy as np
+import pandas as pd
+
+from gmag import events
+
+from conftest import NDAYS, SDATE
+
+
+def test_windows(benchmark, archive):
+    rng = np.random.default_rng(0)
+    n = 200
+    epoch = pd.Timestamp(SDATE) + pd.to_timedelta(rng.uniform(2, NDAYS*24-2, n), unit='h')
+    ev = pd.DataFrame({'epoch': epoch, 'stations': [['GILL', 'ISLL', 'PINA']]*n})
+    ep, t, meta = benchmark.pedantic(events.windows, args=('carisma', ev),
+                                     kwargs={'pre': '2h', 'post': '2h', 'dl': False},
+                                     rounds=3)
+    assert ep.shape == (n, 3, len(t))
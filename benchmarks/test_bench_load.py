@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for listing, parsing, rotating and joining magnetometer files.
+"""
+
+import pytest
+
+from gmag.arrays import canopus, carisma, image, themis
+
+from conftest import NDAYS, SDATE
+
+
+def test_list_files(benchmark, archive):
+    f_df = benchmark(carisma.list_files, 'GILL', SDATE, ndays=365)
+    assert len(f_df) == 365
+
+
+@pytest.mark.parametrize('mod, site, sdate', [
+    (carisma, ['GILL'], SDATE),
+    (canopus, ['GILL'], '2001-01-01'),
+    (image, ['AND'], SDATE),
+    (themis, ['KUUJ'], SDATE)],
+    ids=['carisma', 'canopus', 'image', 'themis'])
+def test_load(benchmark, archive, mod, site, sdate):
+    dat, meta = benchmark.pedantic(mod.load, args=(site, sdate),
+                                   kwargs={'ndays': NDAYS, 'dl': False},
+                                   rounds=3)
+    assert not dat.empty
+    assert meta.shape[0] == len(site)
+
+
+def test_load_multi_station(benchmark, archive):
+    site = ['GILL', 'ISLL', 'PINA', 'FCHU', 'RABB']
+    dat, meta = benchmark.pedantic(carisma.load, args=(site, SDATE),
+                                   kwargs={'ndays': NDAYS, 'dl': False},
+                                   rounds=3)
+    assert meta.shape[0] == len(site)
+
+
+def test_load_image_stations(benchmark, archive):
+    site = ['AND', 'KEV', 'SOD', 'TRO', 'ABK', 'MUO']
+    dat, meta = benchmark.pedantic(image.load, args=(site, SDATE),
+                                   kwargs={'ndays': NDAYS, 'dl': False},
+                                   rounds=3)
+    assert meta.shape[0] == len(site)
+
+
+def test_rotate(benchmark, archive):
+    site = ['GILL', 'ISLL', 'PINA']
+    dat, meta = carisma.load(site, SDATE, ndays=NDAYS, dl=False)
+    dat = dat[[c for c in dat.columns if c.endswith(('_X', '_Y', '_Z'))]]
+
+    r_df, r_meta = benchmark(carisma.rotate, dat.copy(), site, SDATE)
+    assert 'GILL_H' in r_df.columns
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for rule based quality control.
+"""
+
+import numpy as np
+import pytest
+
+from gmag import qc
+
+
+@pytest.fixture(scope='module')
+def day():
+    # a day of 1 s data for 10 stations
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.normal(0, 0.3, (86400, 10, 3)), axis=0) + np.array([13000., 100., 56000.])
+
+
+@pytest.mark.parametrize('rule', [
+    {'rule': 'sentinel', 'value': 99999.9},
+    {'rule': 'range', 'component': 'Z', 'min': 0},
+    {'rule': 'spike'},
+    {'rule': 'step'}],
+    ids=['sentinel', 'range', 'spike', 'step'])
+def test_check(benchmark, day, rule):
+    mask = benchmark(qc.check, day, rules=[rule])
+    assert mask.shape == (86400, 10)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for batched Welch spectra.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import spectral
+
+
+@pytest.fixture(scope='module')
+def day():
+    # a day of 1 s data for 30 stations
+    rng = np.random.default_rng(0)
+    t = pd.date_range('2012-01-01', periods=86400, freq='1s')
+    return t, np.cumsum(rng.normal(0, 0.3, (86400, 30)), axis=0)
+
+
+@pytest.mark.parametrize('width', [3600, None], ids=['hourly', 'day'])
+def test_welch(benchmark, day, width):
+    t, x = day
+    tw, f, psd, n = benchmark(spectral.welch, t, x, nperseg=1800, width=width)
+    assert psd.shape[1:] == (30, 901)
+
+
+def test_stream(benchmark, day):
+    t, x = day
+
+    def run():
+        st = spectral.Stream(nperseg=1800, width=3600)
+        for i in range(0, len(t), 3600):
+            st.update(t[i:i+3600], x[i:i+3600])
+        return st.flush()
+
+    benchmark(run)
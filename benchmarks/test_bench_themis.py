@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for reading a month of THEMIS CDF files.
+"""
+
+import pytest
+
+from gmag import synthetic
+from gmag.arrays import themis
+
+# a month of files for one station
+MONTH = 31
+SITE = 'FSIM'
+
+
+@pytest.fixture(scope='module')
+def month(archive):
+    return synthetic.write_themis(SITE, '2012-01-01', ndays=MONTH)
+
+
+def test_load_month(benchmark, month):
+    dat, meta = benchmark.pedantic(themis.load, args=([SITE], '2012-01-01'),
+                                   kwargs={'ndays': MONTH, 'dl': False},
+                                   rounds=3)
+    assert len(dat) == MONTH*86400*2
+    assert meta.shape[0] == 1
+
+
+def test_load_month_trange(benchmark, month):
+    trange = ('2012-01-10 00:00', '2012-01-10 01:00')
+    dat, meta = benchmark.pedantic(themis.load, args=([SITE], '2012-01-01'),
+                                   kwargs={'ndays': MONTH, 'dl': False,
+                                           'trange': trange},
+                                   rounds=3)
+    assert len(dat) == 3601*2 - 1
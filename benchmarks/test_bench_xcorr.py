@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for pairwise cross-correlation lags.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import xcorr
+
+
+@pytest.fixture(scope='module')
+def day():
+    # a day of 1 s data for 30 stations with missing samples
+    rng = np.random.default_rng(0)
+    t = pd.date_range('2012-01-01', periods=86400, freq='1s')
+    x = np.cumsum(rng.normal(0, 0.3, (86400, 30)), axis=0)
+    x[rng.random(x.shape) < 0.01] = np.nan
+    return t, x
+
+
+def test_lags(benchmark, day):
+    t, x = day
+    tw, lag, r = benchmark.pedantic(xcorr.lags, args=(t, x),
+                                    kwargs={'width': 3600, 'step': 1800, 'max_lag': 300},
+                                    rounds=1, iterations=1)
+    assert lag.shape == (47, 30, 30)
@@ -3,6 +3,31 @@
 Tools for loading ground based magnetometer data
 """
 
+import logging
+
+# quiet by default, use gmag.log_level() or configure
+# the 'gmag' logger to see messages
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def log_level(level='INFO'):
+    """Print gmag log messages to the console.
+
+    Parameters
+    ----------
+    level : str or int, optional
+        Logging level, by default 'INFO'. Loaded and downloaded files
+        are logged at 'DEBUG'.
+    """
+    logger = logging.getLogger(__name__)
+    if not any(isinstance(h, logging.StreamHandler) and not isinstance(h, logging.NullHandler)
+               for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
 from gmag.config import load_config
 
 #Load  
@@ -0,0 +1,5 @@
+import sys
+
+from gmag.cli import main
+
+sys.exit(main())
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio support for services embedding gmag.
+
+The aload functions of the carisma, image and themis modules download
+with one aiohttp client shared by the whole process (see client), so
+concurrent requests share one connection pool, and parse files in an
+executor so the event loop is never blocked. Downloads behave as
+gmag.fetch, using its request and commit steps: streamed to a partial
+file, resumed, revalidated and verified before they are committed. File
+and index database work runs in the event loop's default thread pool.
+
+aiohttp is optional, without it downloads run gmag.fetch in the thread
+pool.
+
+Example
+-------
+
+async def handler(request):
+    dat, meta = await carisma.aload(['GILL','ISLL'], '2012-01-01', ndays=2)
+
+Close the shared client when the service shuts down
+await aio.close()
+
+A client of their own for the loads in a block, closed at the end
+async with aio.session():
+    (c_dat, c_meta), (t_dat, t_meta) = await asyncio.gather(
+        carisma.aload('GILL', '2012-01-01'), themis.aload('KUUJ', '2012-01-01'))
+
+Parse in a process pool instead of the event loop's default executor
+aio.executor = concurrent.futures.ProcessPoolExecutor(4)
+
+Attributes
+----------
+executor : concurrent.futures.Executor
+    Executor for parsing, by default None for the event loop's default
+    executor
+limit : int
+    Concurrent transfers per aload call, by default 8
+
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import importlib
+import logging
+import os
+
+from gmag import fetch
+from gmag import index
+
+logger = logging.getLogger(__name__)
+
+executor = None
+limit = 8
+
+# client of the enclosing session() block
+_session = contextvars.ContextVar('gmag_aio_session', default=None)
+# client shared by the process and its event loop
+_client = None
+
+
+def has_aiohttp():
+    """True if aiohttp is installed."""
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking function in executor.
+
+    func and its arguments must be picklable if executor is a process
+    pool.
+
+    Parameters
+    ----------
+    func : callable
+        Function to run
+    args, kwargs : optional
+        Passed to func
+
+    Returns
+    -------
+    object
+        Output of func
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def _thread(func, *args, **kwargs):
+    """Run blocking file or database work in the loop's thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def client():
+    """aiohttp.ClientSession shared by every download in the process.
+
+    Created on first use, and again if the running event loop changes.
+    Responses are not decompressed so ranges and files match the bytes
+    served. Close it with close() when the service shuts down.
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        Client of the session() block if there is one, otherwise the
+        shared client
+    """
+    global _client
+    sess = _session.get()
+    if sess is not None and not sess.closed:
+        return sess
+    loop = asyncio.get_running_loop()
+    if _client is None or _client[0].closed or _client[1] is not loop:
+        import aiohttp
+
+        _client = (aiohttp.ClientSession(auto_decompress=False), loop)
+    return _client[0]
+
+
+async def close():
+    """Close the shared client, the next download creates a new one."""
+    global _client
+    if _client is not None:
+        sess, loop = _client
+        _client = None
+        if loop is asyncio.get_running_loop():
+            await sess.close()
+
+
+@contextlib.asynccontextmanager
+async def session():
+    """aiohttp.ClientSession of the downloads in the block.
+
+    Calls inside the block, and tasks they start, use this client in
+    place of the shared one (see client), it is closed on exit. A block
+    inside another reuses the outer client.
+
+    Yields
+    ------
+    aiohttp.ClientSession
+        Client of the block
+    """
+    sess = _session.get()
+    if sess is not None and not sess.closed:
+        yield sess
+        return
+    import aiohttp
+
+    sess = aiohttp.ClientSession(auto_decompress=False)
+    token = _session.set(sess)
+    try:
+        yield sess
+    finally:
+        _session.reset(token)
+        await sess.close()
+
+
+async def afetch(url: str,
+                 fn: str,
+                 array: str = None,
+                 force: bool = False):
+    """Download a file without blocking the event loop.
+
+    Parameters and returns are the same as gmag.fetch.fetch.
+    """
+    if not has_aiohttp():
+        return await _thread(fetch.fetch, url, fn, array=array, force=force)
+    import aiohttp
+
+    if await _thread(os.path.exists, fn) and not force:
+        if array is not None:
+            await _thread(index.add, array, fn)
+        return 'exists', 0
+
+    part = fn + '.part'
+    headers, offset = await _thread(fetch.request_headers, fn)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=fetch.timeout,
+                                    sock_read=fetch.timeout)
+    nbytes = 0
+    try:
+        async with client().get(url, headers=headers, timeout=timeout) as resp:
+            if resp.status == 304:
+                logger.debug('Not modified {0}'.format(url))
+                return 'not modified', 0
+            if resp.status == 416:
+                # partial file is not a prefix of the remote file
+                await _thread(fetch._discard, part)
+                return await afetch(url, fn, array=array, force=force)
+            if resp.status >= 400:
+                logger.warning('Error in request: {0} {1}'.format(resp.status, url))
+                return 'missing', 0
+
+            etag = resp.headers.get('ETag')
+            modified = resp.headers.get('Last-Modified')
+            length = resp.headers.get('Content-Length')
+            if resp.status == 206:
+                mode = 'ab'
+                logger.debug('Resuming {0} at {1} bytes'.format(url, offset))
+            else:
+                mode = 'wb'
+            await _thread(fetch.begin, url, fn, etag, modified)
+            f = await _thread(open, part, mode)
+            try:
+                async for b in resp.content.iter_any():
+                    await _thread(f.write, b)
+                    nbytes += len(b)
+            finally:
+                await _thread(f.close)
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        logger.warning('Interrupted download {0}: {1}'.format(url, e))
+        return ('partial' if nbytes else 'missing'), nbytes
+
+    return await _thread(fetch.commit, url, fn, nbytes, length, etag, modified, array=array)
+
+
+async def adownload(array: str,
+                    site=None,
+                    sdate=None,
+                    ndays: int = 1,
+                    edate=None,
+                    gz: bool = True,
+                    force: bool = False):
+    """Download missing files for stations and a date range concurrently.
+
+    Parameters are the same as gmag.sync.sync.
+
+    Returns
+    -------
+    list
+        Status of each file, see gmag.fetch.fetch
+    """
+    from gmag import sync
+
+    f_df = sync.jobs(array, site, sdate, ndays=ndays, edate=edate, gz=gz)
+    have = await _thread(index.present, array, f_df)
+    sem = asyncio.Semaphore(max(1, limit))
+
+    async def get(url, fn, exists):
+        if exists and not force:
+            return 'skipped'
+        async with sem:
+            status, nbytes = await afetch(url, fn, array=array, force=force)
+        return status
+
+    return await asyncio.gather(*[get(u, f, e) for u, f, e in zip(f_df['url'], f_df['fn'], have)])
+
+
+async def aload(array: str,
+                site,
+                sdate,
+                ndays: int = 1,
+                edate=None,
+                gz: bool = True,
+                dl: bool = True,
+                force: bool = False,
+                **kwargs):
+    """Download asynchronously then load in executor.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'image' or 'themis'
+    site : str | list
+        Station or stations
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    gz : bool, optional
+        Gzipped files (CARISMA and IMAGE), by default True
+    dl : bool, optional
+        Download missing files, by default True
+    force : bool, optional
+        Revalidate existing files, by default False
+    kwargs : dict, optional
+        Passed to the array's load
+
+    Returns
+    -------
+    tuple
+        Output of the array's load
+    """
+    mod = importlib.import_module('gmag.arrays.'+array.lower())
+    if dl:
+        await adownload(array, site, sdate, ndays=ndays, edate=edate, gz=gz, force=force)
+    if array.lower() != 'themis':
+        kwargs['gz'] = gz
+    return await run(mod.load, site, sdate, ndays=ndays, edate=edate, dl=False, **kwargs)
@@ -35,6 +35,7 @@ References
 
 """
 
+import logging
 import os
 import requests
 import pandas as pd
@@ -43,6 +44,16 @@ import numpy as np
 import gmag
 
 from gmag import utils
+from gmag import timing
+from gmag import index
+from gmag import cache
+from gmag import cadence
+from gmag import coverage
+from gmag import lazy
+from gmag import magcoords
+from gmag import qc
+
+logger = logging.getLogger(__name__)
 
 
 local_dir = os.path.join(
@@ -56,7 +67,7 @@ if not os.path.exists(local_dir):
     try:
         os.makedirs(local_dir)
     except FileNotFoundError:
-        print('Local CANOPUS Drive does not exist')
+        logger.warning('Local CANOPUS Drive does not exist')
 
 
 def list_files(site,
@@ -116,8 +127,6 @@ def list_files(site,
                            '{0:04d}'.format(dt.year),
                            '{0:02d}'.format(dt.month),
                            '{0}'.format(site.upper()))
-        if not os.path.exists(fdr):
-            os.makedirs(fdr)
 
         # http directory
         # currently no way to download data
@@ -151,12 +160,14 @@ def download(site=None,
              edate=None,
              f_df=None,
              force=False,
-             verbose=True):
+             verbose=True,
+             progress=None):
     """
     No http dir to download files yet
     """
 
 
+@cache.scoped
 def load(site: str = ['GILL'],
          sdate='1998-01-01',
          ndays: int = 1,
@@ -164,7 +175,11 @@ def load(site: str = ['GILL'],
          gz=True,
          dl=True,
          drop_flag=True,
-         force=False):
+         force=False,
+         progress=None,
+         output='wide',
+         mlt=False,
+         cgm=False):
     """Loads CANOPUS MAG files and MAG.gz files
 
     Parameters
@@ -185,6 +200,19 @@ def load(site: str = ['GILL'],
         Drop flag columns before returning DataFrame
     force : bool, optional
         Force downloading files again, by default False
+    progress : callable, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, see gmag.utils.Progress, by default None
+    output : str, optional
+        'wide' for a column per station and component joined on time,
+        'long' for a (station, t) index with a column per component or
+        'dict' for a DataFrame per station, 'dataset' for a lazy
+        xarray.Dataset (see gmag.lazy), by default 'wide'
+    mlt : bool, optional
+        Add the MLT of every sample, see gmag.magcoords, by default False
+    cgm : bool, optional
+        Add the CGM latitude, longitude and L-shell of every sample, by
+        default False
 
     Returns
     -------
@@ -199,78 +227,152 @@ def load(site: str = ['GILL'],
     else:
         comp = 'infer'
 
+    utils.check_output(output)
+    if output == 'dataset':
+        ds, m_df = lazy.dataset('canopus', site, sdate, ndays=ndays, edate=edate, dl=dl,
+                                force=force, progress=progress, gz=gz)
+        return magcoords.attach(ds, m_df, mlt=mlt, cgm=cgm), m_df
+
+    # list every station's files first so
+    # progress has the total up front
+    lists = {}
+    for stn in site:
+        with timing.stage('canopus', 'list'):
+            lists[stn] = list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        # keep files until the load is done
+        cache.pin(lists[stn])
+    # every file is loaded
+    n_files = sum(len(f_df) for f_df in lists.values())
+    prog = utils.Progress.wrap(progress, total=n_files)
+
     # create empty data frame for data
     d_df = pd.DataFrame()
+    # station data for the long and dict layouts
+    frames = {}
+    # cadence and files of each station
+    cad = {}
+    loaded = {}
     for stn in site:
-        # get list of file names
-        f_df = list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        f_df = lists[stn]
 
         if dl:
-            print('Downloading Data:')
-            download(f_df=f_df, force=force)
+            with timing.stage('canopus', 'download'):
+                download(f_df=f_df, force=force, progress=prog)
+
+        have = index.present('canopus', f_df)
 
         # data frame to store site data
         s_df = pd.DataFrame()
-        for di, row in f_df.iterrows():
-            print('Loading: '+os.path.join(row['dir'], row['fname']))
+        for (di, row), exists in zip(f_df.iterrows(), have):
+            logger.debug('Loading: '+os.path.join(row['dir'], row['fname']))
 
             # get file name and check
             # if it exists
             fn = os.path.join(row['dir'], row['fname'])
-            if not os.path.exists(fn):
-                print('File does not exist: {0}'.format(fn))
+            if not exists:
+                logger.info('File does not exist: {0}'.format(fn))
+                prog.update('load', row['fname'])
                 continue
 
-            i_df = pd.read_fwf(fn, header=None, skiprows=40,
-                               names=['t',
-                                      stn.upper()+'_X',
-                                      stn.upper()+'_Y',
-                                      stn.upper()+'_Z',
-                                      stn.upper()+'_flag'],
-                               widths=[14, 10, 10, 10, 2],
-                               compression=comp)
-
             try:
-                i_df['t'] = pd.to_datetime(i_df['t'],
-                                           format='%Y%m%d%H%M%S')
-            except:
+                with timing.stage('canopus', 'read') as st:
+                    i_df = pd.read_fwf(fn, header=None, skiprows=40,
+                                       names=['t',
+                                              stn.upper()+'_X',
+                                              stn.upper()+'_Y',
+                                              stn.upper()+'_Z',
+                                              stn.upper()+'_flag'],
+                                       widths=[14, 10, 10, 10, 2],
+                                       compression=comp)
+                    st.add_file(fn)
+                    st.add(rows=len(i_df))
+            except FileNotFoundError:
+                # removed since it was indexed
+                logger.info('File does not exist: {0}'.format(fn))
+                index.remove(fn)
+                prog.update('load', row['fname'])
                 continue
-            i_df = i_df.set_index('t')
-            s_df = pd.concat([s_df, i_df])
 
-        # clean data
-        if not s_df.empty:
-            c_df = clean(s_df)
-        else:
+            with timing.stage('canopus', 'parse'):
+                try:
+                    i_df['t'] = pd.to_datetime(i_df['t'],
+                                               format='%Y%m%d%H%M%S')
+                except:
+                    prog.update('load', row['fname'], path=fn)
+                    continue
+                i_df = i_df.set_index('t')
+
+            with timing.stage('canopus', 'concat'):
+                s_df = pd.concat([s_df, i_df])
+            prog.update('load', row['fname'], path=fn)
+
+        if s_df.empty:
             continue
-        # append files
-        if d_df.empty:
-            d_df = c_df
-        else:
-            d_df = d_df.join(c_df,how='outer')
+        with timing.stage('canopus', 'resolution'):
+            cad[stn.upper()] = cadence.stats(s_df.index)
+        loaded[stn.upper()] = f_df[have]
+        # append files, every station is cleaned at once
+        with timing.stage('canopus', 'join'):
+            if output != 'wide':
+                frames[stn.upper()] = s_df
+            elif d_df.empty:
+                d_df = s_df
+            else:
+                d_df = d_df.join(s_df, how='outer')
+
+    if output != 'wide':
+        if not frames:
+            return None
+        with timing.stage('canopus', 'clean', rows=sum(len(f) for f in frames.values())):
+            frames, mask = qc.clean_frames(frames, 'canopus')
+        with timing.stage('canopus', 'coverage'):
+            for stn, c_df in frames.items():
+                coverage.record('canopus', stn, c_df, loaded[stn])
+        # rotate each station on its own time index
+        m_l = []
+        for stn, c_df in frames.items():
+            with timing.stage('canopus', 'rotate', rows=len(c_df)):
+                r_df, m_df = rotate(c_df, [stn], sdate)
+            cadence.add_meta(m_df, cad)
+            if drop_flag:
+                r_df = r_df.drop(columns=stn+'_flag', errors='ignore')
+            frames[stn] = r_df
+            m_l.append(m_df)
+        with timing.stage('canopus', 'tidy'):
+            r_df = utils.tidy(frames, output)
+        meta_df = pd.concat(m_l, axis=0, sort=False, ignore_index=True)
+        #add PI to metadata
+        meta_df['Coordinates'] = 'Geographic North - X, Eas - Y, Vertical Down - Z, Geomagnetic North - H, East- D, Vertical Down - Z'
+        meta_df['PI'] = pi
+        meta_df['Institution'] = pi_i
+
+        return magcoords.attach(r_df, meta_df, mlt=mlt, cgm=cgm), meta_df
 
     # rotate data into HDZ
     if d_df.empty:
         return None
 
-    r_df, meta_df = rotate(d_df, site, sdate)
+    with timing.stage('canopus', 'clean', rows=len(d_df)):
+        d_df = clean(d_df)
+    with timing.stage('canopus', 'coverage'):
+        for stn, f_df in loaded.items():
+            coverage.record('canopus', stn, d_df, f_df)
 
-    #get the nominal resolution of the dataframe
-    res = (pd.Series(r_df.index[1:]) -
-               pd.Series(r_df.index[:-1])).value_counts()
-    res = res.index[0].total_seconds()
+    with timing.stage('canopus', 'rotate', rows=len(d_df)):
+        r_df, meta_df = rotate(d_df, site, sdate)
 
-    #add PI to metadata
-    meta_df['Time Resolution'] = res 
+    #add cadence and PI to metadata
+    cadence.add_meta(meta_df, cad)
     meta_df['Coordinates'] = 'Geographic North - X, Eas - Y, Vertical Down - Z, Geomagnetic North - H, East- D, Vertical Down - Z'
     meta_df['PI'] = pi
     meta_df['Institution'] = pi_i
 
     #drop flag column
     if drop_flag: 
-        r_df = r_df[r_df.columns.drop(list(r_df.filter(regex='flag')))]
+        with timing.stage('canopus', 'drop_flag'):
+            r_df = r_df[r_df.columns.drop(list(r_df.filter(regex='flag')))]
 
-    return r_df, meta_df
+    return magcoords.attach(r_df, meta_df, mlt=mlt, cgm=cgm), meta_df
 
 
 def clean(i_df):
@@ -289,32 +391,11 @@ def clean(i_df):
     c_df : DataFrame
         Cleaned CANOPUS magnetometer data
     """
-    # get a list of column names
-    c_name = list(i_df.columns.values)
-    # find the flag column
-    flag = next((s for s in c_name if 'flag' in s), None)
-    xcom = next((s for s in c_name if '_X' in s), None)
-    ycom = next((s for s in c_name if '_Y' in s), None)
-    zcom = next((s for s in c_name if '_Z' in s), None)
-
-    # find bad data
-    # flag is '.' for good
-    # anything else is bad
-    if flag:
-        i_df.iloc[i_df[flag] != '.', 0:3] = np.nan
-    # z component should always
-    # be positive and less then 99999.992
-    if zcom:
-        i_df.iloc[i_df[zcom] < 0, 0:3] = np.nan
-        i_df.iloc[i_df[zcom] > 99999, 0:3] = np.nan
-    # x and yshould always be less then
-    # 99999.992
-    if xcom:
-        i_df.iloc[i_df[xcom] > 99999, 0:3] = np.nan
-    if ycom:
-        i_df.iloc[i_df[ycom] > 99999, 0:3] = np.nan
-
-    return i_df
+    # flag is '.' for good, Z should always be
+    # positive and 99999.99 is missing, see qc.rules
+    c_df, mask = qc.clean(i_df, 'canopus')
+
+    return c_df
 
 
 def rotate(i_df,
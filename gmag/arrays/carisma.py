@@ -44,14 +44,26 @@ References
 """
 
 
+import logging
 import os
-from requests import get as rget
 import pandas as pd
 import numpy as np
 
 import gmag
 
 from gmag import utils
+from gmag import timing
+from gmag import index
+from gmag import cache
+from gmag import aio
+from gmag import fetch
+from gmag import cadence
+from gmag import coverage
+from gmag import lazy
+from gmag import magcoords
+from gmag import qc
+
+logger = logging.getLogger(__name__)
 
 
 local_dir = os.path.join(gmag.config_set['data_dir'],'magnetometer','CARISMA')
@@ -64,7 +76,7 @@ if not os.path.exists(local_dir):
     try:
         os.makedirs(local_dir)
     except FileNotFoundError:
-        print('Local CARISMA Drive does not exist')
+        logger.warning('Local CARISMA Drive does not exist')
 
 
 def list_files(site,
@@ -124,8 +136,6 @@ def list_files(site,
                            '{0:04d}'.format(dt.year),
                            '{0:02d}'.format(dt.month),
                            '{0:02d}'.format(dt.day))
-        if not os.path.exists(fdr):
-            os.makedirs(fdr)
 
         # http directory
         hdr = http_dir+'FGM/1Hz/'+'{0:04d}'.format(dt.year)+'/'
@@ -148,10 +158,13 @@ def download(site=None,
              edate=None,
              f_df=None,
              force=False,
-             verbose=True):
+             verbose=True,
+             progress=None):
     """Download CARISMA magnetometer data from the CARISMA website
     
-    Requires wget to download data.
+    Files are streamed to a temporary file and only committed once
+    complete and verified, interrupted downloads are resumed, see
+    gmag.fetch.
 
     Parameters
     ----------
@@ -166,33 +179,43 @@ def download(site=None,
     f_df: DataFrame 
         List of files to be loaded
     force: bool, optional
-        Force download even if file exists
+        Force download even if file exists, the file is only
+        replaced if it has changed on the server
     verbose : bool, optional
-        Outputs some additional information, by default 0
+        Log files which already exist, by default True
+    progress : callable or gmag.utils.Progress, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, or the Progress of a load to count files in, see
+        gmag.utils.Progress, by default None
     """
 
     # get file names
     if f_df is None: 
         f_df = list_files(site, sdate, ndays=ndays, edate=edate)   
+    prog = utils.Progress.wrap(progress, total=len(f_df))
+    # files already downloaded
+    have = index.present('carisma', f_df)
     # download files
-    for di, row in f_df.iterrows():
+    for (di, row), exists in zip(f_df.iterrows(), have):
         # get file name and check
         # if it exists
         # only download if force=True
         fn = os.path.join(row['dir'], row['fname'])
-        if not os.path.exists(fn) or force:
+        nbytes = 0
+        if not exists or force:
             # check for online file, if it exists
             #get it
-            ureq = rget(row['hdir']+row['fname'], timeout=5.0)
-            if ureq.ok:
-                print('Downloading {0}'.format(row['hdir']+row['fname']))
-                open(fn,'wb').write(ureq.content)
-            else:
-                print('Error in request: {0}'.format(ureq.status_code))
+            logger.debug('Downloading {0}'.format(row['hdir']+row['fname']))
+            with timing.stage('carisma', 'request') as st:
+                status, nbytes = fetch.fetch(row['hdir']+row['fname'], fn,
+                                             array='carisma', force=force)
+                st.add(files=1, bytes=nbytes)
         elif verbose:
-            print('File {0} exists use force=True to download'.format(row['fname']))   
+            logger.debug('File {0} exists use force=True to download'.format(row['fname']))
+        prog.update('download', row['fname'], nbytes=nbytes)
     
 
+@cache.scoped
 def load(site: str = ['GILL'],
          sdate='2010-01-01',
          ndays: int = 1,
@@ -200,7 +223,11 @@ def load(site: str = ['GILL'],
          gz=True,
          dl=True,
          drop_flag=True,
-         force=False):
+         force=False,
+         progress=None,
+         output='wide',
+         mlt=False,
+         cgm=False):
     """Loads CARISMA F01 files and F01.gz files
     
     Parameters
@@ -221,7 +248,20 @@ def load(site: str = ['GILL'],
         Drop flag columns before returning DataFrame    
     force : bool, optional
         Force downloading files again, by default False
-    
+    progress : callable, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, see gmag.utils.Progress, by default None
+    output : str, optional
+        'wide' for a column per station and component joined on time,
+        'long' for a (station, t) index with a column per component or
+        'dict' for a DataFrame per station, 'dataset' for a lazy
+        xarray.Dataset (see gmag.lazy), by default 'wide'
+    mlt : bool, optional
+        Add the MLT of every sample, see gmag.magcoords, by default False
+    cgm : bool, optional
+        Add the CGM latitude, longitude and L-shell of every sample, by
+        default False
+
     Returns
     -------
     Pandas DataFrame
@@ -234,78 +274,170 @@ def load(site: str = ['GILL'],
     else:
         comp = 'infer'
 
+    utils.check_output(output)
+    if output == 'dataset':
+        ds, m_df = lazy.dataset('carisma', site, sdate, ndays=ndays, edate=edate, dl=dl,
+                                force=force, progress=progress, gz=gz)
+        return magcoords.attach(ds, m_df, mlt=mlt, cgm=cgm), m_df
+
+    # list every station's files first so
+    # progress has the total up front
+    lists = {}
+    for stn in site:
+        with timing.stage('carisma', 'list'):
+            lists[stn] = list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        # keep files until the load is done
+        cache.pin(lists[stn])
+    # every file is downloaded then loaded
+    n_files = sum(len(f_df) for f_df in lists.values())
+    prog = utils.Progress.wrap(progress, total=2*n_files if dl else n_files)
+
     # create empty data frame for data
     d_df = pd.DataFrame()
+    # station data for the long and dict layouts
+    frames = {}
+    # cadence and files of each station
+    cad = {}
+    loaded = {}
     for stn in site:
-        # get list of file names
-        f_df = list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        f_df = lists[stn]
 
         if dl:
-            print('Downloading Data:')
-            download(f_df=f_df,force=force)
+            with timing.stage('carisma', 'download'):
+                download(f_df=f_df, force=force, progress=prog)
+
+        have = index.present('carisma', f_df)
 
         s_df = pd.DataFrame()
-        for di, row in f_df.iterrows():
-            print('Loading: '+os.path.join(row['dir'], row['fname']))
+        for (di, row), exists in zip(f_df.iterrows(), have):
+            logger.debug('Loading: '+os.path.join(row['dir'], row['fname']))
 
             # get file name and check
             # if it exists
             fn = os.path.join(row['dir'], row['fname'])
-            if not os.path.exists(fn):
-                print('File does not exist: {0}'.format(fn))
+            if not exists:
+                logger.info('File does not exist: {0}'.format(fn))
+                prog.update('load', row['fname'])
                 continue
 
-            i_df = pd.read_fwf(fn, header=None, skiprows=1,
-                               names=['t',
-                                      stn.upper()+'_X',
-                                      stn.upper()+'_Y',
-                                      stn.upper()+'_Z',
-                                      stn.upper()+'_flag'],
-                               widths=[14, 10, 10, 10, 2],
-                               compression=comp)
-
             try:
-                i_df['t'] = pd.to_datetime(i_df['t'],
-                                           format='%Y%m%d%H%M%S')
-            except:
+                with timing.stage('carisma', 'read') as st:
+                    i_df = pd.read_fwf(fn, header=None, skiprows=1,
+                                       names=['t',
+                                              stn.upper()+'_X',
+                                              stn.upper()+'_Y',
+                                              stn.upper()+'_Z',
+                                              stn.upper()+'_flag'],
+                                       widths=[14, 10, 10, 10, 2],
+                                       compression=comp)
+                    st.add_file(fn)
+                    st.add(rows=len(i_df))
+            except FileNotFoundError:
+                # removed since it was indexed
+                logger.info('File does not exist: {0}'.format(fn))
+                index.remove(fn)
+                prog.update('load', row['fname'])
                 continue
-            i_df = i_df.set_index('t')
 
-            s_df = pd.concat([s_df, i_df])
+            with timing.stage('carisma', 'parse'):
+                try:
+                    i_df['t'] = pd.to_datetime(i_df['t'],
+                                               format='%Y%m%d%H%M%S')
+                except:
+                    prog.update('load', row['fname'], path=fn)
+                    continue
+                i_df = i_df.set_index('t')
 
-        # clean data
-        if not s_df.empty:
-            c_df = clean(s_df)
-        else:
+            with timing.stage('carisma', 'concat'):
+                s_df = pd.concat([s_df, i_df])
+            prog.update('load', row['fname'], path=fn)
+
+        if s_df.empty:
             continue
-        # append files
-        if d_df.empty:
-            d_df = c_df
-        else:
-            d_df = d_df.join(c_df,how='outer')
+        with timing.stage('carisma', 'resolution'):
+            cad[stn.upper()] = cadence.stats(s_df.index)
+        loaded[stn.upper()] = f_df[have]
+        # append files, every station is cleaned at once
+        with timing.stage('carisma', 'join'):
+            if output != 'wide':
+                frames[stn.upper()] = s_df
+            elif d_df.empty:
+                d_df = s_df
+            else:
+                d_df = d_df.join(s_df, how='outer')
+
+    if output != 'wide':
+        if not frames:
+            return None
+        with timing.stage('carisma', 'clean', rows=sum(len(f) for f in frames.values())):
+            frames, mask = qc.clean_frames(frames, 'carisma')
+        with timing.stage('carisma', 'coverage'):
+            for stn, c_df in frames.items():
+                coverage.record('carisma', stn, c_df, loaded[stn])
+        # rotate each station on its own time index
+        m_l = []
+        for stn, c_df in frames.items():
+            with timing.stage('carisma', 'rotate', rows=len(c_df)):
+                r_df, m_df = rotate(c_df, [stn], sdate)
+            cadence.add_meta(m_df, cad)
+            if drop_flag:
+                r_df = r_df.drop(columns=stn+'_flag', errors='ignore')
+            frames[stn] = r_df
+            m_l.append(m_df)
+        with timing.stage('carisma', 'tidy'):
+            r_df = utils.tidy(frames, output)
+        meta_df = pd.concat(m_l, axis=0, sort=False, ignore_index=True)
+        #add PI to metadata
+        meta_df['Coordinates'] = 'Geographic North - X, East - Y, Vertical Down - Z, Geomagnetic North - H, East- D, Vertical Down - Z'
+        meta_df['PI'] = pi
+        meta_df['Institution'] = pi_i   
+
+        return magcoords.attach(r_df, meta_df, mlt=mlt, cgm=cgm), meta_df
 
     # rotate data into HDZ
     if d_df.empty:
         return None
 
-    r_df, meta_df = rotate(d_df, site, sdate)
+    with timing.stage('carisma', 'clean', rows=len(d_df)):
+        d_df = clean(d_df)
+    with timing.stage('carisma', 'coverage'):
+        for stn, f_df in loaded.items():
+            coverage.record('carisma', stn, d_df, f_df)
 
-    #get the nominal resolution of the dataframe
-    res = (pd.Series(r_df.index[1:]) -
-               pd.Series(r_df.index[:-1])).value_counts()
-    res = res.index[0].total_seconds()
+    with timing.stage('carisma', 'rotate', rows=len(d_df)):
+        r_df, meta_df = rotate(d_df, site, sdate)
 
-    #add PI to metadata
-    meta_df['Time Resolution'] = res 
+    #add cadence and PI to metadata
+    cadence.add_meta(meta_df, cad)
     meta_df['Coordinates'] = 'Geographic North - X, East - Y, Vertical Down - Z, Geomagnetic North - H, East- D, Vertical Down - Z'
     meta_df['PI'] = pi
     meta_df['Institution'] = pi_i   
     
     #drop flag column
     if drop_flag: 
-        r_df = r_df[r_df.columns.drop(list(r_df.filter(regex='flag')))]
-
-    return r_df, meta_df
+        with timing.stage('carisma', 'drop_flag'):
+            r_df = r_df[r_df.columns.drop(list(r_df.filter(regex='flag')))]
+
+    return magcoords.attach(r_df, meta_df, mlt=mlt, cgm=cgm), meta_df
+
+
+async def aload(site: str = ['GILL'],
+                sdate='2010-01-01',
+                ndays: int = 1,
+                edate=None,
+                gz=True,
+                dl=True,
+                drop_flag=True,
+                force=False,
+                output='wide',
+                mlt=False,
+                cgm=False):
+    """Asynchronous load, downloads with an aiohttp client (see
+    gmag.aio.client) and parses in gmag.aio.executor. Parameters and
+    returns are the same as load.
+    """
+    return await aio.aload('carisma', site, sdate, ndays=ndays, edate=edate, gz=gz,
+                           dl=dl, force=force, output=output, mlt=mlt, cgm=cgm, drop_flag=drop_flag)
 
 
 def clean(i_df):
@@ -324,22 +456,11 @@ def clean(i_df):
     c_df : DataFrame
         Cleaned CARISMA magnetometer data
     """
-    # get a list of column names
-    c_name = list(i_df.columns.values)
-    # find the flag column
-    flag = next((s for s in c_name if 'flag' in s), None)
-    zcom = next((s for s in c_name if '_Z' in s), None)
-    # find bad data
-    # flag is '.' for good
-    # anything else is bad
-    if flag:
-        i_df.iloc[i_df[flag] != '.', 0:3] = np.nan
-    # z component should always
-    # be positive
-    if zcom:
-        i_df.iloc[i_df[zcom] < 0, 0:3] = np.nan
-
-    return i_df
+    # flag is '.' for good and Z should
+    # always be positive, see qc.rules
+    c_df, mask = qc.clean(i_df, 'carisma')
+
+    return c_df
 
 
 def rotate(i_df,
@@ -50,16 +50,28 @@ References
 
 """
 
+import logging
 import os
 import pandas as pd
 import numpy as np
 import gzip
-import wget
 
 import gmag
 from gmag.config import get_config_file
 
 from gmag import utils
+from gmag import timing
+from gmag import index
+from gmag import cache
+from gmag import aio
+from gmag import fetch
+from gmag import cadence
+from gmag import coverage
+from gmag import lazy
+from gmag import magcoords
+from gmag import qc
+
+logger = logging.getLogger(__name__)
 
 local_dir =os.path.join(gmag.config_set['data_dir'],'magnetometer','IMAGE')
 http_dir = gmag.config_set['im_http']
@@ -71,7 +83,7 @@ if not os.path.exists(local_dir):
     try:
         os.makedirs(local_dir)
     except FileNotFoundError:
-        print('Local IMAGE Drive does not exist')
+        logger.warning('Local IMAGE Drive does not exist')
 
 
 def list_files(sdate,
@@ -134,8 +146,6 @@ def list_files(sdate,
         # IMAGE data is stored in the local_dir as YYYY\MM\image_file
         fdr = os.path.join(local_dir, '{0:04d}'.format(
             dt.year), '{0:02d}'.format(dt.month))
-        if not os.path.exists(fdr):
-            os.makedirs(fdr)
 
         # Create dataframe row for this site and date. Append to the answer
         curr_file_df = pd.DataFrame( {'date': dt, 'fname': fnm, 'dir': fdr}, index = [0])
@@ -148,13 +158,37 @@ def list_files(sdate,
     return f_df
 
 
+def http_link(date,
+              gz=True):
+    """Request address for a day of IMAGE data
+
+    Parameters
+    ----------
+    date : datetime-like
+        Day to request
+    gz : bool, optional
+        Request a gzipped file, by default True
+
+    Returns
+    -------
+    str
+        Web address of the 10 s .col2 file for every station
+    """
+    hlink = http_dir+'starttime={0:04d}{1:02d}{2:02d}&length=1440&format=text&sample_rate=10'.format(
+        date.year, date.month, date.day)
+    if gz:
+        hlink = hlink+'&compress'
+    return hlink
+
+
 def download(sdate=None,
              ndays=1,
              edate=None,
              gz=True,
              force=False,
              f_df=None,
-             verbose=0):
+             verbose=0,
+             progress=None):
     """Download IMAGE magnetometer data from the IMAGE request website
 
     Parameters
@@ -169,49 +203,57 @@ def download(sdate=None,
     gz : bool, optional
         Download gzipped files, by default True
     force: bool, optional
-        Force download even if file exists
+        Force download even if file exists, the file is only
+        replaced if it has changed on the server
     f_df : DataFrame
         List of files to be loaded
     verbose : int, optional
-        List files being downloaded, by default 0
+        Log files which already exist, by default 0
+    progress : callable or gmag.utils.Progress, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, or the Progress of a load to count files in, see
+        gmag.utils.Progress, by default None
     """
 
     # get file names
     if f_df is None:
         f_df = list_files(sdate, ndays=ndays, edate=edate, gz=gz)
+    prog = utils.Progress.wrap(progress, total=len(f_df))
+    # files already downloaded
+    have = index.present('image', f_df)
 
-    for ind, row in f_df.iterrows():
+    for (ind, row), exists in zip(f_df.iterrows(), have):
         # generate file name
         fn = os.path.join(row['dir'], row['fname'])
         # only donwnload if file does not exist
         #or force is true
-        if not os.path.exists(fn) or force:
-            # if forcing download and file
-            #exists remove file before
-            #redownloading
-            if os.path.exists(fn):
-                os.remove(fn)
-
+        if not exists or force:
             # generate http link for file
-            hlink = http_dir+'starttime={0:04d}{1:02d}{2:02d}&length=1440&format=text&sample_rate=10'.format(
-                row['date'].year, row['date'].month, row['date'].day)
-            if gz:
-                hlink = hlink+'&compress'
+            hlink = http_link(row['date'], gz=gz)
             #download data
-            print(hlink)
-            req = wget.download(hlink,out=fn,bar=wget.bar_adaptive)
-            print('\n {}'.format(req))
+            logger.debug('Downloading {0}'.format(hlink))
+            with timing.stage('image', 'request') as st:
+                status, nbytes = fetch.fetch(hlink, fn, array='image', force=force)
+                st.add(files=1, bytes=nbytes)
+            prog.update('download', row['fname'], nbytes=nbytes)
         else:
-            print('File {0} exists use force=True to download'.format(row['fname']))
+            if verbose:
+                logger.debug('File {0} exists use force=True to download'.format(row['fname']))
+            prog.update('download', row['fname'])
 
          
+@cache.scoped
 def load(site: str = ['AND'],
          sdate='2010-01-01',
          ndays: int = 1,
          edate=None,
          gz=True,
          dl=True,
-         force=False):
+         force=False,
+         progress=None,
+         output='wide',
+         mlt=False,
+         cgm=False):
     """Loads IMAGE magnetometer data in the .col2 data
     format
 
@@ -231,6 +273,20 @@ def load(site: str = ['AND'],
         Download data if it doesn't extist, default True
     force : bool, False
         Force download
+    progress : callable, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, see gmag.utils.Progress, by default None
+    output : str, optional
+        'wide' for a column per station and component, 'long' for a
+        (station, t) index with a column per component or 'dict' for a
+        DataFrame per station, 'dataset' for a lazy xarray.Dataset
+        (see gmag.lazy), by default 'wide'
+    mlt : bool, optional
+        Add the MLT of every sample, see gmag.magcoords, by default False
+    cgm : bool, optional
+        Add the CGM latitude, longitude and L-shell of every sample, by
+        default False
+
     Returns
     -------
     r_df : DataFrame
@@ -239,92 +295,151 @@ def load(site: str = ['AND'],
     # create a site list for returns
     if type(site) is str:
         site = [site]
+    utils.check_output(output)
+    if output == 'dataset':
+        ds, m_df = lazy.dataset('image', site, sdate, ndays=ndays, edate=edate, dl=dl,
+                                force=force, progress=progress, gz=gz)
+        return magcoords.attach(ds, m_df, mlt=mlt, cgm=cgm), m_df
 
     # get list of file names
-    f_df = list_files(sdate, ndays=ndays, edate=edate, gz=gz)
+    with timing.stage('image', 'list'):
+        f_df = list_files(sdate, ndays=ndays, edate=edate, gz=gz)
+    # keep files until the load is done
+    cache.pin(f_df)
+    # every file is downloaded then loaded
+    prog = utils.Progress.wrap(progress, total=2*len(f_df) if dl else len(f_df))
 
     if dl:
-        download(f_df=f_df,gz=gz,force=force)
+        with timing.stage('image', 'download'):
+            download(f_df=f_df,gz=gz,force=force,progress=prog)
+
+    have = index.present('image', f_df)
 
     # create empty data frame for data
     d_df = pd.DataFrame()
 
-    for ind, row in f_df.iterrows():
-        print(os.path.join(row['dir'], row['fname']))
+    for (ind, row), exists in zip(f_df.iterrows(), have):
+        logger.debug('Loading: '+os.path.join(row['dir'], row['fname']))
 
         # get file name and check
         # if it exists
         fn = os.path.join(row['dir'], row['fname'])
-        if not os.path.exists(fn):
-            print('File does not exist: {0}'.format(fn))
+        if not exists:
+            logger.info('File does not exist: {0}'.format(fn))
+            prog.update('load', row['fname'])
             continue
 
         # get header information
-        if gz:
-            with gzip.open(fn, mode='rt') as f:
-                col = f.readline().rstrip('\n')
-        else:
-            with open(fn, 'r') as f:
-                col = f.readline().rstrip('\n')
-
-        # fix header for data fram
-        col = col.replace(' X', '_X').replace(' Y', '_Y').replace(' Z', '_Z')
-        col = col.split()
-        col[3:6] = ['hh', 'mm', 'ss']
+        try:
+            with timing.stage('image', 'header'):
+                if gz:
+                    with gzip.open(fn, mode='rt') as f:
+                        col = f.readline().rstrip('\n')
+                else:
+                    with open(fn, 'r') as f:
+                        col = f.readline().rstrip('\n')
+
+                # fix header for data fram
+                col = col.replace(' X', '_X').replace(' Y', '_Y').replace(' Z', '_Z')
+                col = col.split()
+                col[3:6] = ['hh', 'mm', 'ss']
+        except FileNotFoundError:
+            # removed since it was indexed
+            logger.info('File does not exist: {0}'.format(fn))
+            index.remove(fn)
+            prog.update('load', row['fname'])
+            continue
 
         # read in data
-        i_df = pd.read_csv(fn, delim_whitespace=True, header=None,
-                           skiprows=2, names=col, parse_dates=[[0, 1, 2, 3, 4, 5]])
-        i_df = i_df.rename(index=str, columns={"YYYY_MM_DD_hh_mm_ss": "t"})
+        with timing.stage('image', 'read') as st:
+            i_df = pd.read_csv(fn, delim_whitespace=True, header=None,
+                               skiprows=2, names=col, parse_dates=[[0, 1, 2, 3, 4, 5]])
+            st.add_file(fn)
+            st.add(rows=len(i_df))
+
+        with timing.stage('image', 'parse'):
+            i_df = i_df.rename(index=str, columns={"YYYY_MM_DD_hh_mm_ss": "t"})
 
-        i_df['t'] = pd.to_datetime(
-            i_df['t'].astype(str), format='%Y %m %d %H %M %S')
+            i_df['t'] = pd.to_datetime(
+                i_df['t'].astype(str), format='%Y %m %d %H %M %S')
 
-        d_df = pd.concat([d_df, i_df], ignore_index=True)
+        with timing.stage('image', 'concat'):
+            d_df = pd.concat([d_df, i_df], ignore_index=True)
+        prog.update('load', row['fname'], path=fn)
 
     if d_df.empty:
         return None
 
     # keep only listed stations
-    s_df = pd.DataFrame()
-    s_df['t'] = d_df['t']
-    # empty list for stations
-    # that where actually read in
-    s_l = []
-    for stn in site:
-        try:
-            s_df[stn.upper()+'_X'] = d_df[stn.upper()+'_X']
-            s_df[stn.upper()+'_Y'] = d_df[stn.upper()+'_Y']
-            s_df[stn.upper()+'_Z'] = d_df[stn.upper()+'_Z']
-            s_l.append(stn.upper())
-        except KeyError:
-            print('Station not found: {0}'.format(stn))
+    with timing.stage('image', 'select'):
+        s_df = pd.DataFrame()
+        s_df['t'] = d_df['t']
+        # empty list for stations
+        # that where actually read in
+        s_l = []
+        for stn in site:
+            try:
+                s_df[stn.upper()+'_X'] = d_df[stn.upper()+'_X']
+                s_df[stn.upper()+'_Y'] = d_df[stn.upper()+'_Y']
+                s_df[stn.upper()+'_Z'] = d_df[stn.upper()+'_Z']
+                s_l.append(stn.upper())
+            except KeyError:
+                logger.warning('Station not found: {0}'.format(stn))
 
     # clean and rotate data
     # as long as one station
     # exists
     if len(s_l):
         # clean data frame
-        c_df = clean(s_df)
+        with timing.stage('image', 'clean', rows=len(s_df)):
+            c_df = clean(s_df)
+        # coverage of the XYZ data, rotate
+        # blanks H and D where Z < 0
+        with timing.stage('image', 'coverage'):
+            coverage.record('image', s_l, c_df.set_index('t'), f_df[have])
         # rotate data frame
-        r_df, meta_df = rotate(c_df, s_l, sdate)
-        r_df = r_df.set_index('t')
+        with timing.stage('image', 'rotate', rows=len(c_df)):
+            r_df, meta_df = rotate(c_df, s_l, sdate)
+            r_df = r_df.set_index('t')
     else:
         return None, None
 
-    #get the nominal resolution of the dataframe
-    res = (pd.Series(r_df.index[1:]) -
-               pd.Series(r_df.index[:-1])).value_counts()
-    res = res.index[0].total_seconds()
+    #stations share the file's time stamps
+    with timing.stage('image', 'resolution'):
+        res = cadence.stats(r_df.index)
 
-    #add PI to metadata
-    meta_df['Time Resolution'] = res
+    #add cadence and PI to metadata
+    cadence.add_meta(meta_df, {stn.upper(): res for stn in s_l})
     meta_df['Coordinates'] = 'Geographic North - X, East - Y, Vertical Down - Z, Geomagnetic North - H, East- D, Vertical Down - Z' 
     meta_df['PI'] = pi
     meta_df['Institution'] = pi_i
-    
 
-    return r_df, meta_df
+    if output != 'wide':
+        with timing.stage('image', 'tidy'):
+            # stations share the file's time stamps
+            frames = {stn: r_df[[c for c in r_df.columns if c.startswith(stn+'_')]]
+                      for stn in s_l}
+            r_df = utils.tidy(frames, output)
+
+    return magcoords.attach(r_df, meta_df, mlt=mlt, cgm=cgm), meta_df
+
+
+async def aload(site: str = ['AND'],
+                sdate='2010-01-01',
+                ndays: int = 1,
+                edate=None,
+                gz=True,
+                dl=True,
+                force=False,
+                output='wide',
+                mlt=False,
+                cgm=False):
+    """Asynchronous load, downloads with an aiohttp client (see
+    gmag.aio.client) and parses in gmag.aio.executor. Parameters and
+    returns are the same as load.
+    """
+    return await aio.aload('image', site, sdate, ndays=ndays, edate=edate, gz=gz,
+                           dl=dl, force=force, output=output, mlt=mlt, cgm=cgm)
 
 
 def clean(i_df):
@@ -343,8 +458,9 @@ def clean(i_df):
     c_df : DataFrame
         Cleaned IMAGE magnetometer data
     """
-    c_df = i_df.replace(to_replace=99999.9, value=np.nan).sort_values(
-        by=['t']).reset_index(drop=True)
+    # 99999.9 is missing, see qc.rules
+    c_df, mask = qc.clean(i_df, 'image')
+    c_df = c_df.sort_values(by=['t']).reset_index(drop=True)
 
     return c_df
 
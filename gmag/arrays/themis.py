@@ -52,8 +52,8 @@ References
 """
 
 
+import logging
 import os
-import wget
 import pandas as pd
 import numpy as np
 
@@ -61,8 +61,21 @@ import cdflib
 import gmag
 
 from gmag import utils
+from gmag import timing
+from gmag import index
+from gmag import cache
+from gmag import aio
+from gmag import fetch
+from gmag import cadence
+from gmag import coverage
+from gmag import lazy
+from gmag import magcoords
+from gmag import qc
+
 from urllib.parse import urljoin
 
+logger = logging.getLogger(__name__)
+
 local_dir = os.path.join(gmag.config_set['data_dir'], 'magnetometer', 'THEMIS')
 http_dir = gmag.config_set['th_http']
 
@@ -71,7 +84,7 @@ if not os.path.exists(local_dir):
     try:
         os.makedirs(local_dir)
     except FileNotFoundError:
-        print('Local THEMIS Drive does not exist')
+        logger.warning('Local THEMIS Drive does not exist')
 
 
 def list_files(site,
@@ -125,8 +138,6 @@ def list_files(site,
         fdr = os.path.join(local_dir,
                            site.lower(),
                            '{0:04d}'.format(dt.year))
-        if not os.path.exists(fdr):
-            os.makedirs(fdr)
 
         # http directory
         hdr = http_dir+'thg/l2/mag/'+site.lower()+'/{0:04d}/'.format(dt.year)
@@ -148,10 +159,13 @@ def download(site=None,
              edate=None,
              f_df=None,
              force=False,
-             verbose=True):
+             verbose=True,
+             progress=None):
     """Download THEMIS magnetometer data from the THEMIS website
 
-    Requires wget to download data.
+    Files are streamed to a temporary file and only committed once
+    complete and verified, interrupted downloads are resumed, see
+    gmag.fetch.
 
     Parameters
     ----------
@@ -166,40 +180,143 @@ def download(site=None,
     f_df: DataFrame 
         List of files to be loaded
     force: bool, optional
-        Force download even if file exists
+        Force download even if file exists, the file is only
+        replaced if it has changed on the server
     verbose : bool, optional
-        Outputs some additional information, by default 0
+        Log files which already exist, by default True
+    progress : callable or gmag.utils.Progress, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, or the Progress of a load to count files in, see
+        gmag.utils.Progress, by default None
     """
 
     # get file names
     if f_df is None:
         f_df = list_files(site, sdate, ndays=ndays, edate=edate)
+    prog = utils.Progress.wrap(progress, total=len(f_df))
+    # files already downloaded
+    have = index.present('themis', f_df)
     # download files
-    for di, row in f_df.iterrows():
+    for (di, row), exists in zip(f_df.iterrows(), have):
         # get file name and check
         # if it exists
         fn = os.path.join(row['dir'], row['fname'])
-        if not os.path.exists(fn) or force:
-            # if forcing download and file
-            # exists remove file before
-            # redownloading
-            if os.path.exists(fn):
-                os.remove(fn)
-            try:
-                wget.download(row['hdir']+row['fname'], out=row['dir'])
-            except:
-                print('HTTP file not found {0}'.format(row['fname']))
-        elif verbose:
-            print('File {0} exists use force=True to download'.format(
-                row['fname']))
+        if not exists or force:
+            # an existing file is only downloaded
+            # again if it changed on the server
+            logger.debug('Downloading {0}'.format(row['hdir']+row['fname']))
+            with timing.stage('themis', 'request') as st:
+                status, nbytes = fetch.fetch(row['hdir']+row['fname'], fn,
+                                             array='themis', force=force)
+                st.add(files=1, bytes=nbytes)
+            prog.update('download', row['fname'], nbytes=nbytes)
+        else:
+            if verbose:
+                logger.debug('File {0} exists use force=True to download'.format(
+                    row['fname']))
+            prog.update('download', row['fname'])
+
 
+# labels and global attributes for each station and file version
+_attrs = {}
+
+
+def file_attrs(cdf_file,
+               stn,
+               version='v01'):
+    """Column names, coordinates, PI and resolution of a station's CDF,
+    read once per station and file version
+
+    Parameters
+    ----------
+    cdf_file : cdflib.CDF
+        Open CDF file
+    stn : str
+        Station
+    version : str, optional
+        File version, by default 'v01'
 
+    Returns
+    -------
+    dict
+        columns, coordinates, pi, pi_i and res (s)
+    """
+    key = (stn.upper(), version)
+    if key in _attrs:
+        return _attrs[key]
+
+    # labels are returned as (3,) or (3, 1) depending
+    # on how the variable was written
+    cdf_col = np.asarray(cdf_file.varget('thg_mag_'+stn.lower()+'_labl')).reshape(-1)
+    cdf_col = [str(c).strip() for c in cdf_col]
+
+    test_col = ['Magnetic North', 'Magnetic East', 'Vertical Down']
+    lab_col = ['H','D','Z']
+    columns = [(stn.upper()+'_'+l_col if c_col.replace(',','-').split('-')[0].strip() == t_col
+                else stn.upper()+'_'+c_col)
+               for c_col,t_col,l_col in zip(cdf_col,test_col,lab_col)]
+
+    attrs = {'columns': columns,
+             'coordinates': ', '.join(cdf_col).strip(),
+             'pi': cdf_file.attget('PI_name',0).Data,
+             'pi_i': cdf_file.attget('PI_affiliation',0).Data,
+             'res': float(cdf_file.attget('Time_resolution',0).Data[0:-1])}
+    _attrs[key] = attrs
+    return attrs
+
+
+def read_cdf(cdf_file,
+             stn,
+             trange=None):
+    """Read the time and magnetic field of a station's CDF
+
+    Parameters
+    ----------
+    cdf_file : cdflib.CDF
+        Open CDF file
+    stn : str
+        Station
+    trange : tuple, optional
+        (start, end) datetime-like, only records within
+        are read, by default None for every record
+
+    Returns
+    -------
+    t : np.ndarray
+        Sample times, datetime64[ns]
+    dat : np.ndarray
+        Magnetic field, samples x 3
+    """
+    var = 'thg_mag_'+stn.lower()
+    # unix seconds to nanoseconds
+    t = cdf_file.varget(var+'_time')
+    t = np.round(np.asarray(t, dtype=float)*1e9).astype(np.int64)
+
+    i0, i1 = 0, len(t)
+    if trange is not None:
+        lim = pd.to_datetime(list(trange)).values.astype('datetime64[ns]').astype(np.int64)
+        i0, i1 = np.searchsorted(t, lim[0], side='left'), np.searchsorted(t, lim[1], side='right')
+    if i1 <= i0:
+        return t[:0].view('datetime64[ns]'), np.empty((0, 3))
+
+    dat = cdf_file.varget(var, startrec=int(i0), endrec=int(i1)-1)
+    dat = np.asarray(dat).reshape(-1, 3)
+
+    return t[i0:i1].view('datetime64[ns]'), dat
+
+
+@cache.scoped
 def load(site: str = ['KUUJ'],
          sdate='2010-01-01',
          ndays: int = 1,
          edate=None,
          dl=True,
-         force=False):
+         force=False,
+         progress=None,
+         trange=None,
+         output='wide',
+         mlt=False,
+         cgm=False):
     """Load THEMIS CDF files.
 
     Parameters
@@ -216,6 +333,23 @@ def load(site: str = ['KUUJ'],
         Download data before loading, by default True
     force : bool, optional
         Force download if already exists, by default False
+    progress : callable, optional
+        Called after every file with a dictionary of files done, total,
+        bytes and eta, see gmag.utils.Progress, by default None
+    trange : tuple, optional
+        (start, end) datetime-like, only records within are read
+        from each file, by default None. Only the days overlapping
+        trange are downloaded, each in full.
+    output : str, optional
+        'wide' for a column per station and component joined on time,
+        'long' for a (station, t) index with a column per component or
+        'dict' for a DataFrame per station, 'dataset' for a lazy
+        xarray.Dataset (see gmag.lazy), by default 'wide'
+    mlt : bool, optional
+        Add the MLT of every sample, see gmag.magcoords, by default False
+    cgm : bool, optional
+        Add the CGM latitude, longitude and L-shell of every sample, by
+        default False
 
     Returns
     -------
@@ -233,70 +367,151 @@ def load(site: str = ['KUUJ'],
     if stn_vals is None:
         stn_vals = utils.load_station_geo(param='ALL')
 
+    utils.check_output(output)
+    if output == 'dataset':
+        ds, m_df = lazy.dataset('themis', site, sdate, ndays=ndays, edate=edate, dl=dl,
+                                force=force, progress=progress)
+        return magcoords.attach(ds, m_df, mlt=mlt, cgm=cgm), m_df
+
+    # list every station's files first so
+    # progress has the total up front
+    lists = {}
+    wants = {}
+    for stn in site:
+        with timing.stage('themis', 'list'):
+            f_df = list_files(stn.upper(), sdate, ndays=ndays, edate=edate)
+        # files overlapping the time range
+        want = np.ones(len(f_df), dtype=bool)
+        if trange is not None:
+            lim = pd.to_datetime(list(trange))
+            day = pd.to_datetime(f_df['date'])
+            want = ((day + pd.Timedelta(days=1) > lim[0]) & (day <= lim[1])).to_numpy()
+        lists[stn], wants[stn] = f_df, want
+        # keep files until the load is done
+        cache.pin(f_df)
+    # files overlapping trange are downloaded, every file is loaded
+    n_files = sum(len(f_df) for f_df in lists.values())
+    n_dl = sum(want.sum() for want in wants.values()) if dl else 0
+    prog = utils.Progress.wrap(progress, total=int(n_files + n_dl))
+
     # create empty data frame for data
     d_df = pd.DataFrame()
+    # station data for the long and dict layouts
+    frames = {}
     for stn in site:
-        # get list of file names
-        f_df = list_files(stn.upper(), sdate, ndays=ndays, edate=edate)
-        
-        # station dataframe for data
-        s_df = pd.DataFrame()
-        if dl:
-            print('Downloading Data:')
-            download(f_df=f_df, force=force)
-
-        for di, row in f_df.iterrows():
-            print('Loading: '+os.path.join(row['dir'], row['fname']))
+        f_df, want = lists[stn], wants[stn]
+
+        # station data, joined once all files are read
+        t_l = []
+        dat_l = []
+        attrs = None
+        if dl and want.any():
+            # files are downloaded in full, days outside trange are not
+            with timing.stage('themis', 'download'):
+                download(f_df=f_df[want], force=force, progress=prog)
+
+        have = index.present('themis', f_df)
+
+        for (di, row), exists, use in zip(f_df.iterrows(), have, want):
+            if not use:
+                prog.update('load', row['fname'])
+                continue
+            logger.debug('Loading: '+os.path.join(row['dir'], row['fname']))
 
             # get file name and check
             # if it exists
             fn = os.path.join(row['dir'], row['fname'])
-            if not os.path.exists(fn):
-                print('File does not exist: {0}'.format(fn))
+            if not exists:
+                logger.info('File does not exist: {0}'.format(fn))
+                prog.update('load', row['fname'])
                 continue
 
             # open cdf file and get data
-            cdf_file = cdflib.CDF(fn)
-            dat = cdf_file.varget('thg_mag_'+stn.lower())
-            cdf_col = cdf_file.varget('thg_mag_'+stn.lower()+'_labl')
-            t = pd.to_datetime(cdf_file.varget(
-                'thg_mag_'+stn.lower()+'_time'), unit='s')
-            #pi = cdf_file.attget('PI_name',0)['Data']
-            pi = cdf_file.attget('PI_name',0).Data
-            pi_i = cdf_file.attget('PI_affiliation',0).Data
-            res = float(cdf_file.attget('Time_resolution',0).Data[0:-1])
-
-            #cdf_file.close()
-            # create data frame
-            test_col = ['Magnetic North', 'Magnetic East', 'Vertical Down']
-            lab_col = ['H','D','Z']
-
-            columns=[(stn.upper()+'_'+l_col if c_col[0].astype(str).replace(',','-').split('-')[0].strip() == t_col \
-                    else stn.upper()+'_'+c_col.strip()) \
-                    for c_col,t_col,l_col in zip(cdf_col,test_col,lab_col)]
-            i_df = pd.DataFrame(data=dat, columns=columns)
-            i_df['t'] = t
-            i_df = i_df.set_index('t')
-            # append to returned data frame
-            s_df = pd.concat([s_df, i_df])
-
-        if d_df.empty:
-            d_df = s_df
-        else:
-            d_df = d_df.join(s_df,how='outer')
+            try:
+                with timing.stage('themis', 'open') as st:
+                    cdf_file = cdflib.CDF(fn)
+                    st.add_file(fn)
+            except FileNotFoundError:
+                # removed since it was indexed
+                logger.info('File does not exist: {0}'.format(fn))
+                index.remove(fn)
+                prog.update('load', row['fname'])
+                continue
+            with timing.stage('themis', 'read') as st:
+                attrs = file_attrs(cdf_file, stn, version=row['fname'][-7:-4])
+                t, dat = read_cdf(cdf_file, stn, trange=trange)
+                st.add(rows=len(t))
+
+            t_l.append(t)
+            dat_l.append(dat)
+            prog.update('load', row['fname'], path=fn)
+
+        # create data frame
+        with timing.stage('themis', 'concat'):
+            if len(t_l):
+                t = pd.DatetimeIndex(np.concatenate(t_l), name='t')
+                dat = np.concatenate(dat_l) if len(dat_l) > 1 else dat_l[0]
+                s_df = pd.DataFrame(dat, index=t, columns=attrs['columns'], copy=False)
+            else:
+                s_df = pd.DataFrame()
+            del t_l, dat_l
+
+        # THEMIS has no rules by default, see qc.rules
+        if not s_df.empty and qc.array_rules('themis'):
+            with timing.stage('themis', 'clean', rows=len(s_df)):
+                s_df, mask = qc.clean(s_df, 'themis')
+
+        with timing.stage('themis', 'join'):
+            if output != 'wide':
+                if not s_df.empty:
+                    frames[stn.upper()] = s_df
+            elif d_df.empty:
+                d_df = s_df
+            else:
+                d_df = d_df.join(s_df,how='outer')
 
         if s_df.empty:
             continue
-            
+
+        if trange is None:
+            with timing.stage('themis', 'coverage'):
+                coverage.record('themis', stn, s_df, f_df[have])
+
         stn_dat = stn_vals[stn_vals['code'] == stn.upper()].reset_index(drop=True)
-        stn_dat['Time Resolution'] = res
-        stn_dat['Coordinates'] = ', '.join([str(c_col[0]).strip() for c_col in cdf_col]).strip()
-        stn_dat['PI'] = pi
-        stn_dat['Institution'] = pi_i
+        with timing.stage('themis', 'resolution'):
+            res = cadence.stats(s_df.index)
+        if np.isnan(res['cadence']):
+            # nominal resolution of the file
+            res['cadence'] = attrs['res']
+        cadence.add_meta(stn_dat, {stn.upper(): res})
+        stn_dat['Coordinates'] = attrs['coordinates']
+        stn_dat['PI'] = attrs['pi']
+        stn_dat['Institution'] = attrs['pi_i']
 
         if meta_df.empty:
             meta_df = stn_dat
         else:
             meta_df = pd.concat([meta_df,stn_dat], axis=0, sort=False, ignore_index=True)
 
-    return d_df, meta_df
+    if output != 'wide':
+        with timing.stage('themis', 'tidy'):
+            d_df = utils.tidy(frames, output)
+
+    return magcoords.attach(d_df, meta_df, mlt=mlt, cgm=cgm), meta_df
+
+
+async def aload(site: str = ['KUUJ'],
+                sdate='2010-01-01',
+                ndays: int = 1,
+                edate=None,
+                dl=True,
+                force=False,
+                output='wide',
+                mlt=False,
+                cgm=False):
+    """Asynchronous load, downloads with an aiohttp client (see
+    gmag.aio.client) and parses in gmag.aio.executor. Parameters and
+    returns are the same as load.
+    """
+    return await aio.aload('themis', site, sdate, ndays=ndays, edate=edate,
+                           dl=dl, force=force, output=output, mlt=mlt, cgm=cgm)
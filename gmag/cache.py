@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Size capped data directory with least recently used eviction.
+
+Set cache_size in gmagrc (e.g. cache_size = 50G) to cap the space used by
+data_dir. Whenever a download pushes the indexed files over the cap, the
+least recently used files are removed until usage is back below
+target*cap.
+
+Access times are recorded when the loaders read a file (raw files) and by
+touch() for derived files in data_dir registered with register() (parsed
+files, e.g. calcE_chunk output or hazard checkpoints). Files outside
+data_dir are never tracked or evicted. Files used by a running load are
+pinned and never evicted, pins are visible to other processes sharing
+data_dir until the process holding them exits.
+
+Example
+-------
+
+Cap data_dir for this session and check usage
+cache.cap = '20G'
+cache.usage()
+
+Register a derived file so it is evicted with the raw files
+cache.register('/data/gill_2012_e.npy')
+
+Attributes
+----------
+cap : float or str
+    Size cap (bytes or e.g. '50G'), by default cache_size from gmagrc,
+    None for no cap
+target : float
+    Fraction of the cap usage is reduced to when evicting, by default 0.9
+
+"""
+
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+
+import gmag
+
+from gmag import index
+from gmag import utils
+
+logger = logging.getLogger(__name__)
+
+cap = gmag.config_set.get('cache_size')
+target = 0.9
+
+_schema = """
+CREATE TABLE IF NOT EXISTS access (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    atime REAL
+);
+CREATE TABLE IF NOT EXISTS pins (
+    path TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    PRIMARY KEY (path, pid)
+);
+"""
+
+# databases with the cache tables
+_ready = set()
+# pins held by this process, path: count
+_pins = {}
+_pin_lock = threading.Lock()
+# files pinned by the active scopes on each thread
+_local = threading.local()
+
+
+def connect():
+    """Connection to the index database with the cache tables."""
+    conn = index.connect()
+    if index.db_file not in _ready:
+        with index._lock:
+            conn.executescript(_schema)
+        _ready.add(index.db_file)
+    return conn
+
+
+def _paths(files):
+    if isinstance(files, pd.DataFrame):
+        files = [os.path.join(d, f) for d, f in zip(files['dir'], files['fname'])]
+    elif isinstance(files, str):
+        files = [files]
+    return [os.path.normpath(f) for f in files]
+
+
+def touch(files,
+          kind: str = 'raw'):
+    """Record an access.
+
+    Parameters
+    ----------
+    files : str, list or DataFrame
+        File names, or list_files output
+    kind : str, optional
+        'raw' for array files or 'parsed' for derived files, by default 'raw'
+    """
+    paths = _paths(files)
+    now = time.time()
+    conn = connect()
+    with index._lock:
+        conn.executemany('INSERT INTO access VALUES (?,?,NULL,?) '
+                         'ON CONFLICT(path) DO UPDATE SET atime = excluded.atime',
+                         [(p, kind, now) for p in paths])
+        conn.commit()
+
+
+def _data_dir():
+    """data_dir, the directory holding the index."""
+    return os.path.dirname(os.path.abspath(index.db_file))
+
+
+def register(fn: str):
+    """Track a derived file so it counts toward the cap and can be evicted.
+
+    Called for calcE_chunk output and hazard checkpoints. Only files in
+    data_dir are tracked, anything written elsewhere is left alone.
+
+    Parameters
+    ----------
+    fn : str
+        File name
+
+    Returns
+    -------
+    bool
+        True if the file is tracked
+    """
+    fn = os.path.normpath(fn)
+    root = _data_dir()
+    if os.path.commonpath([root, os.path.abspath(fn)]) != root:
+        logger.debug('Not tracked, outside data_dir {0}'.format(fn))
+        return False
+    conn = connect()
+    with index._lock:
+        conn.execute('INSERT OR REPLACE INTO access VALUES (?,?,?,?)',
+                     (fn, 'parsed', os.path.getsize(fn), time.time()))
+        conn.commit()
+    enforce()
+    return True
+
+
+def _tracked(paths,
+             chunk: int = 400):
+    """Paths in the index or registered, without touching the disk."""
+    conn = connect()
+    have = set()
+    for i in range(0, len(paths), chunk):
+        par = paths[i:i+chunk]
+        q = ','.join('?'*len(par))
+        have.update(r[0] for r in conn.execute(
+            'SELECT path FROM files WHERE path IN ({0}) UNION '
+            "SELECT path FROM access WHERE kind = 'parsed' AND path IN ({0})".format(q),
+            par + par))
+    return [p for p in paths if p in have]
+
+
+def pin(files):
+    """Pin files until the active scope (see scoped) ends.
+
+    Pinned files are never evicted. Pinning also records an access.
+    Only files in the index or registered can be evicted, others are
+    skipped without checking the disk. Files downloaded later in the
+    scope are pinned by gmag.fetch.
+
+    Parameters
+    ----------
+    files : str, list or DataFrame
+        File names, or list_files output
+    """
+    paths = _tracked(_paths(files))
+    if not paths:
+        return
+    scope = getattr(_local, 'scopes', None)
+    if not scope:
+        touch(paths)
+        return
+    with _pin_lock:
+        new = [p for p in paths if _pins.get(p, 0) == 0]
+        for p in paths:
+            _pins[p] = _pins.get(p, 0) + 1
+    scope[-1].extend(paths)
+
+    conn = connect()
+    with index._lock:
+        conn.executemany('INSERT OR IGNORE INTO pins VALUES (?,?)',
+                         [(p, os.getpid()) for p in new])
+        conn.commit()
+    touch(paths)
+
+
+def _unpin(paths):
+    with _pin_lock:
+        done = []
+        for p in paths:
+            _pins[p] -= 1
+            if _pins[p] == 0:
+                del _pins[p]
+                done.append(p)
+    conn = connect()
+    with index._lock:
+        conn.executemany('DELETE FROM pins WHERE path = ? AND pid = ?',
+                         [(p, os.getpid()) for p in done])
+        conn.commit()
+
+
+@contextmanager
+def scope():
+    """Files pinned within the with block are unpinned when it ends."""
+    if not hasattr(_local, 'scopes'):
+        _local.scopes = []
+    _local.scopes.append([])
+    try:
+        yield
+    finally:
+        _unpin(_local.scopes.pop())
+
+
+def scoped(func):
+    """Decorator running func in a pin scope, used by the loaders."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with scope():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def pinned():
+    """Files pinned by any live process.
+
+    Returns
+    -------
+    set
+        Pinned file names
+    """
+    conn = connect()
+    rows = conn.execute('SELECT path, pid FROM pins').fetchall()
+    dead = {pid for p, pid in rows if not _alive(pid)}
+    if dead:
+        with index._lock:
+            conn.executemany('DELETE FROM pins WHERE pid = ?', [(pid,) for pid in dead])
+            conn.commit()
+    with _pin_lock:
+        return {p for p, pid in rows if pid not in dead} | set(_pins)
+
+
+def files():
+    """Every tracked file, least recently used first.
+
+    Returns
+    -------
+    DataFrame
+        path, kind ('raw' or 'parsed'), array (raw files), size (bytes)
+        and atime (unix time, the modification time if never accessed)
+    """
+    sql = ("SELECT f.path, 'raw' AS kind, f.array, f.size, COALESCE(a.atime, f.mtime) AS atime "
+           "FROM files f LEFT JOIN access a ON a.path = f.path "
+           "UNION ALL "
+           "SELECT path, kind, NULL AS array, size, atime FROM access WHERE kind = 'parsed' "
+           "ORDER BY atime")
+    return pd.read_sql_query(sql, connect())
+
+
+def usage():
+    """Space used by tracked files.
+
+    Returns
+    -------
+    DataFrame
+        Files and bytes for each array and derived files, and the cap
+    """
+    f_df = files()
+    f_df['array'] = f_df['array'].fillna(f_df['kind'])
+    u_df = f_df.groupby('array')['size'].agg(['count', 'sum'])
+    u_df.columns = ['files', 'bytes']
+    u_df.loc['total'] = u_df.sum()
+    u_df['cap'] = utils.parse_size(cap)
+    return u_df
+
+
+def evict(size=None,
+          keep: float = None):
+    """Remove least recently used files until usage is below keep*size.
+
+    Parameters
+    ----------
+    size : float or str, optional
+        Cap, by default cap
+    keep : float, optional
+        Fraction of the cap to reduce usage to, by default target
+
+    Returns
+    -------
+    list
+        Files removed
+    """
+    size = utils.parse_size(size if size is not None else cap)
+    if size is None:
+        return []
+    keep = target if keep is None else keep
+
+    f_df = files()
+    total = f_df['size'].sum()
+    if total <= size:
+        return []
+
+    skip = pinned()
+    removed = []
+    for path, kind, nbytes in zip(f_df['path'], f_df['kind'], f_df['size']):
+        if total <= keep*size:
+            break
+        if path in skip:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning('Could not evict {0}: {1}'.format(path, e))
+            continue
+        if kind == 'raw':
+            index.remove(path)
+        total -= nbytes or 0
+        removed.append(path)
+
+    conn = connect()
+    with index._lock:
+        conn.executemany('DELETE FROM access WHERE path = ?', [(p,) for p in removed])
+        conn.commit()
+    logger.info('Evicted {0} files, {1:.1f} MB in use'.format(len(removed), total/2**20))
+    if total > size:
+        logger.warning('data_dir is over cache_size, remaining files are pinned')
+
+    return removed
+
+
+def enforce():
+    """Evict if a cap is set and usage is over it, called after downloads.
+
+    Returns
+    -------
+    list
+        Files removed
+    """
+    if cap is None:
+        return []
+    size = utils.parse_size(cap)
+    total = connect().execute(
+        "SELECT (SELECT COALESCE(SUM(size), 0) FROM files) + "
+        "(SELECT COALESCE(SUM(size), 0) FROM access WHERE kind = 'parsed')").fetchone()[0]
+    if total <= size:
+        return []
+    return evict(size)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Sample cadence of magnetometer data.
+
+Works on the int64 nanoseconds of a DatetimeIndex with NumPy, without
+building timedelta Series. The loaders report the cadence, jitter and
+number of gaps of every station in the Time Resolution, Jitter and Gaps
+columns of the metadata, see add_meta.
+
+Data on a regular grid can be held as a start, a step and the values,
+see Regular.
+
+Example
+-------
+
+dat, meta = carisma.load(['GILL','ISLL'], '2012-01-01', output='dict')
+cadence.stats(dat['GILL'].index)
+g = cadence.regular(dat['GILL'])
+if g is not None:
+    x = g.values[:, 0]
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _ns(t):
+    """int64 nanoseconds of times."""
+    if isinstance(t, (pd.DatetimeIndex, pd.Series)):
+        return pd.DatetimeIndex(t).asi8
+    t = np.asarray(t)
+    if t.dtype.kind == 'M':
+        return t.astype('datetime64[ns]').view(np.int64)
+    return t.astype(np.int64, copy=False)
+
+
+def step(t):
+    """Nominal spacing (ns), the median spacing of t.
+
+    Parameters
+    ----------
+    t : np.ndarray or DatetimeIndex
+        Sorted times, datetime64 or int64 nanoseconds
+
+    Returns
+    -------
+    int
+        Spacing in nanoseconds, 0 if there are fewer than two samples
+    """
+    t = _ns(t)
+    if len(t) < 2:
+        return 0
+    d = np.diff(t)
+    # O(n) median, no sort of the spacings
+    k = len(d)//2
+    return int(np.partition(d, k)[k])
+
+
+def stats(t):
+    """Cadence, jitter and gaps.
+
+    Parameters
+    ----------
+    t : np.ndarray or DatetimeIndex
+        Sorted times, datetime64 or int64 nanoseconds
+
+    Returns
+    -------
+    dict
+        cadence (s), jitter (s, RMS departure of spacings from the
+        cadence, gaps excluded) and gaps (spacings over 1.5 cadences)
+    """
+    t = _ns(t)
+    dt = step(t)
+    if dt <= 0:
+        return {'cadence': np.nan, 'jitter': np.nan, 'gaps': 0}
+    d = np.diff(t)
+    gap = d > 1.5*dt
+    r = (d[~gap] - dt).astype(float)
+    return {'cadence': dt/1e9,
+            'jitter': float(np.sqrt(np.mean(r*r)))/1e9 if len(r) else 0.,
+            'gaps': int(np.count_nonzero(gap))}
+
+
+def is_regular(t,
+               tol: float = 0.):
+    """True if every spacing is within tol (s) of the cadence.
+
+    Parameters
+    ----------
+    t : np.ndarray or DatetimeIndex
+        Sorted times, datetime64 or int64 nanoseconds
+    tol : float, optional
+        Allowed departure (s), by default 0.
+
+    Returns
+    -------
+    bool
+        True for a regular grid without gaps
+    """
+    t = _ns(t)
+    dt = step(t)
+    if dt <= 0:
+        return False
+    d = np.diff(t)
+    return bool(np.abs(d - dt).max() <= tol*1e9)
+
+
+def add_meta(meta_df: pd.DataFrame,
+             cad: dict):
+    """Add Time Resolution, Jitter and Gaps columns to a loader's metadata.
+
+    Parameters
+    ----------
+    meta_df : DataFrame
+        Metadata with a code column, changed in place
+    cad : dict
+        Station: stats output
+
+    Returns
+    -------
+    DataFrame
+        meta_df
+    """
+    code = [str(c).upper() for c in meta_df['code']]
+    empty = {'cadence': np.nan, 'jitter': np.nan, 'gaps': np.nan}
+    meta_df['Time Resolution'] = [cad.get(c, empty)['cadence'] for c in code]
+    meta_df['Jitter'] = [cad.get(c, empty)['jitter'] for c in code]
+    meta_df['Gaps'] = [cad.get(c, empty)['gaps'] for c in code]
+    return meta_df
+
+
+class Regular:
+    """Samples on a regular grid, sample i is at start + i*step.
+
+    Parameters
+    ----------
+    start : np.datetime64
+        Time of the first sample
+    step : int
+        Spacing (ns)
+    values : np.ndarray
+        samples or samples x columns
+    columns : list, optional
+        Column names, by default None
+    """
+
+    def __init__(self, start, step, values, columns=None):
+        self.start = np.datetime64(start, 'ns')
+        self.step = int(step)
+        self.values = values
+        self.columns = list(columns) if columns is not None else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return 'Regular(start={0}, step={1}s, n={2})'.format(self.start, self.step/1e9, len(self))
+
+    @property
+    def index(self):
+        """DatetimeIndex of the samples."""
+        return pd.date_range(self.start, periods=len(self), freq=pd.Timedelta(self.step, unit='ns'),
+                             name='t')
+
+    def time(self, i):
+        """Time of samples i."""
+        return self.start + np.asarray(i, dtype=np.int64)*np.timedelta64(self.step, 'ns')
+
+    def locate(self, t):
+        """Sample at or before times t, may be out of range."""
+        return (_ns(np.atleast_1d(t)) - self.start.astype(np.int64))//self.step
+
+    def to_frame(self):
+        """DataFrame with a DatetimeIndex."""
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns, copy=False)
+
+
+def regular(df,
+            tol: float = 0.):
+    """Regular grid of a DataFrame if its samples are regular.
+
+    Parameters
+    ----------
+    df : DataFrame or Series
+        Data with a DatetimeIndex
+    tol : float, optional
+        Allowed departure of spacings from the cadence (s), by default 0.
+
+    Returns
+    -------
+    Regular or None
+        None if the index is not regular
+    """
+    t = _ns(df.index)
+    if not is_regular(t, tol=tol):
+        return None
+    columns = df.columns if isinstance(df, pd.DataFrame) else None
+    return Regular(t[0].astype('datetime64[ns]'), step(t), df.to_numpy(), columns=columns)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface.
+
+gmag sync ARRAY [--site SITE ...] --sdate DATE [--ndays N | --edate DATE]
+          [--workers N] [--rate RATE] [--force] [--no-gz] [-v]
+
+Mirror CARISMA, IMAGE or THEMIS files into data_dir, e.g.
+gmag sync themis --site KUUJ GBAY --sdate 2012-01-01 --edate 2012-12-31 --workers 8 --rate 5M
+
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import gmag
+
+
+def sync_command(args):
+    """Run gmag sync and print the summary, returns the exit code."""
+    from gmag import sync
+
+    def show(p):
+        print('\r{0}/{1} files {2:.1f} MB'.format(p['done'], p['total'], p['bytes']/2**20),
+              end='', file=sys.stderr, flush=True)
+
+    t0 = time.perf_counter()
+    try:
+        r_df = sync.sync(args.array, site=args.site, sdate=args.sdate, ndays=args.ndays,
+                         edate=args.edate, gz=args.gz, workers=args.workers,
+                         rate=args.rate, force=args.force,
+                         progress=None if args.quiet else show)
+    except ValueError as e:
+        print('gmag sync: {0}'.format(e), file=sys.stderr)
+        return 2
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    print(sync.report(r_df, elapsed=time.perf_counter() - t0))
+    failed = r_df['status'].isin(['missing', 'partial', 'corrupt', 'error'])
+    return 1 if failed.any() else 0
+
+
+def parser():
+    """Argument parser for the gmag command."""
+    p = argparse.ArgumentParser(prog='gmag', description='Ground based magnetometer data tools')
+    sub = p.add_subparsers(dest='command', required=True)
+
+    s = sub.add_parser('sync', help='Mirror an array into data_dir',
+                       description='Download every missing file for stations and a date range '
+                                   'into data_dir ({0})'.format(gmag.config_set['data_dir']))
+    s.add_argument('array', choices=['carisma', 'image', 'themis'], type=str.lower)
+    s.add_argument('--site', nargs='+', help='Stations, not used for IMAGE')
+    s.add_argument('--sdate', required=True, help='First day, YYYY-MM-DD')
+    g = s.add_mutually_exclusive_group()
+    g.add_argument('--ndays', type=int, default=1, help='Number of days (default 1)')
+    g.add_argument('--edate', help='Last day, YYYY-MM-DD')
+    s.add_argument('--workers', type=int, default=4, help='Concurrent transfers (default 4)')
+    s.add_argument('--rate', help='Bandwidth cap in bytes/s, e.g. 500k or 2M')
+    s.add_argument('--force', action='store_true',
+                   help='Revalidate files already present, changed files are downloaded again')
+    s.add_argument('--no-gz', dest='gz', action='store_false',
+                   help='Uncompressed CARISMA and IMAGE files')
+    s.add_argument('-q', '--quiet', action='store_true', help='No progress')
+    s.add_argument('-v', '--verbose', action='count', default=0,
+                   help='Log messages, -vv for debug')
+    s.set_defaults(func=sync_command)
+
+    return p
+
+
+def main(argv=None):
+    """Entry point of the gmag command."""
+    args = parser().parse_args(argv)
+    if getattr(args, 'verbose', 0):
+        gmag.log_level(logging.DEBUG if args.verbose > 1 else logging.INFO)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,14 @@ Simple set of utilites for reading the config file
 """
 
 import configparser
+import logging
 import os
 import gmag
 
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 def get_config_file():
     """Return location of configuration file
 
@@ -71,7 +74,7 @@ def load_config():
 
     # Create data directory if not created
     if not os.path.isdir(data_dir):
-        print('Creating data directory {}'.format(data_dir))
+        logger.info('Creating data directory {}'.format(data_dir))
         os.makedirs(data_dir)
     
     # Read in configuration setting for downloading
@@ -91,6 +94,8 @@ def load_config():
         config_dic['th_http'] = configf['DEFAULT']['th_http']
     else:
         config_dic['th_http'] = None
+    # Optional size cap of data_dir, e.g. 50G
+    config_dic['cache_size'] = configf['DEFAULT'].get('cache_size') or None
     return config_dic
 
 
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Coverage of each station-day, recorded as data are loaded.
+
+After clean() the loaders record, for every station and day, the number
+of valid samples (all components finite), the number expected from the
+station's cadence and the gap intervals. Records are stored beside the
+file index (see gmag.index) and tied to the file's modification time, so
+a re-downloaded file is treated as unknown until it is loaded again.
+
+Coverage over any set of stations and dates is then a single query and
+batch jobs can skip empty station-days without parsing files.
+
+Example
+-------
+
+Fraction of valid samples per station and day
+cov = coverage.query('carisma', ['GILL','ISLL'], '2012-01-01', ndays=31)
+
+Fill in station-days that have not been loaded yet, then list the gaps
+coverage.build('carisma', ['GILL','ISLL'], '2012-01-01', ndays=31)
+gap_df = coverage.gaps('carisma', 'GILL', '2012-01-01', ndays=31)
+
+Attributes
+----------
+enabled : bool
+    Record coverage when data are loaded, by default True
+
+"""
+
+import importlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from gmag import cadence as _cadence
+from gmag import index
+
+logger = logging.getLogger(__name__)
+
+enabled = True
+
+_schema = """
+CREATE TABLE IF NOT EXISTS coverage (
+    array TEXT NOT NULL,
+    site TEXT NOT NULL,
+    date TEXT NOT NULL,
+    path TEXT,
+    mtime REAL,
+    cadence REAL,
+    expected INTEGER,
+    valid INTEGER,
+    gaps TEXT,
+    PRIMARY KEY (array, site, date)
+);
+"""
+
+# databases with the coverage table
+_ready = set()
+
+_day = np.int64(86400*10**9)
+
+
+def connect():
+    """Connection to the index database with the coverage table."""
+    conn = index.connect()
+    if index.db_file not in _ready:
+        with index._lock:
+            conn.executescript(_schema)
+        _ready.add(index.db_file)
+    return conn
+
+
+def cadence(t: np.ndarray):
+    """Nominal sample spacing (s), see gmag.cadence.step.
+
+    Parameters
+    ----------
+    t : np.ndarray
+        Sorted sample times, int64 nanoseconds
+
+    Returns
+    -------
+    float
+        Spacing in seconds, NaN if there are fewer than two samples
+    """
+    if len(t) < 2:
+        return np.nan
+    return _cadence.step(t)/1e9
+
+
+def day_gaps(t: np.ndarray,
+             day: np.int64,
+             dt: float):
+    """Gaps in a day of valid sample times.
+
+    Parameters
+    ----------
+    t : np.ndarray
+        Sorted valid sample times within the day, int64 nanoseconds
+    day : np.int64
+        Start of the day, int64 nanoseconds
+    dt : float
+        Cadence (s)
+
+    Returns
+    -------
+    list
+        [start, end] pairs, seconds from the start of the day, of the
+        intervals without valid samples
+    """
+    step = np.int64(round(dt*1e9))
+    # pad with the sample before the day and the end of the day
+    edge = np.concatenate([[day - step], t, [day + _day]])
+    d = np.diff(edge)
+    i = np.flatnonzero(d > 1.5*step)
+    start = (edge[i] + step - day)/1e9
+    end = (edge[i+1] - day)/1e9
+    return [[float(s), float(e)] for s, e in zip(start, end)]
+
+
+def stats(dat: pd.DataFrame,
+          site: str,
+          dates=None,
+          dt: float = None):
+    """Coverage of a station for each day.
+
+    Parameters
+    ----------
+    dat : DataFrame
+        Data indexed by time with columns SITE_<component>
+    site : str
+        Station
+    dates : list or DatetimeIndex, optional
+        Days to report, by default the days in dat
+    dt : float, optional
+        Cadence (s), by default the most common sample spacing
+
+    Returns
+    -------
+    DataFrame
+        Indexed by date with cadence, expected, valid, fraction and gaps
+    """
+    stn = site.upper()
+    col = [c for c in dat.columns
+           if c.startswith(stn+'_') and not c.endswith('_flag')]
+    t = dat.index.values.astype('datetime64[ns]').astype(np.int64)
+    if col:
+        valid = np.isfinite(dat[col].to_numpy(dtype=float)).all(axis=1)
+    else:
+        valid = np.zeros(len(t), dtype=bool)
+    tv = np.sort(t[valid])
+
+    if dates is None:
+        dates = np.unique(t - t % _day)
+    else:
+        dates = pd.to_datetime(pd.Series(dates)).dt.normalize()
+        dates = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    if dt is None:
+        dt = cadence(tv) if len(tv) > 1 else cadence(np.sort(t))
+
+    # valid samples in each day
+    lo = np.searchsorted(tv, dates, side='left')
+    hi = np.searchsorted(tv, dates + _day, side='left')
+    expected = int(round(86400/dt)) if np.isfinite(dt) and dt > 0 else 0
+
+    rows = []
+    for d, i0, i1 in zip(dates, lo, hi):
+        gaps = day_gaps(tv[i0:i1], d, dt) if expected else [[0., 86400.]]
+        rows.append({'date': pd.Timestamp(d),
+                     'cadence': dt,
+                     'expected': expected,
+                     'valid': int(i1 - i0),
+                     'fraction': (i1 - i0)/expected if expected else 0.,
+                     'gaps': gaps})
+
+    return pd.DataFrame(rows, columns=['date', 'cadence', 'expected', 'valid',
+                                       'fraction', 'gaps']).set_index('date')
+
+
+def record(array: str,
+           site: str | list,
+           dat: pd.DataFrame,
+           f_df: pd.DataFrame = None):
+    """Record the coverage of loaded data.
+
+    Parameters
+    ----------
+    array : str
+        Array the data were loaded from
+    site : str | list
+        Station or stations to record
+    dat : DataFrame
+        Cleaned data indexed by time
+    f_df : DataFrame, optional
+        Files the data were loaded from (list_files output), days with a
+        file are recorded even if they have no valid data, by default
+        the days in dat. Ignored when gmag.index is disabled.
+    """
+    if not enabled or dat is None or dat.empty:
+        return
+    if type(site) is str:
+        site = [site]
+    array = array.lower()
+
+    # file modification times from the index
+    paths = {}
+    mtime = {}
+    dates = None
+    if f_df is not None and not f_df.empty and index.enabled:
+        dates = pd.to_datetime(f_df['date']).dt.normalize()
+        for dt, d, f in zip(dates, f_df['dir'], f_df['fname']):
+            paths[dt] = os.path.normpath(os.path.join(d, f))
+        mtime = dict(index.connect().execute(
+            'SELECT path, mtime FROM files WHERE array = ? AND date BETWEEN ? AND ?',
+            (array, f'{dates.min():%Y-%m-%d}', f'{dates.max():%Y-%m-%d}')).fetchall())
+        # only days with a file
+        dates = [dt for dt in dates if paths[dt] in mtime]
+    if not dates:
+        # index disabled or no indexed files, the days in dat
+        # are recorded without a file so they stay current
+        paths = {}
+        dates = None
+
+    rows = []
+    for stn in site:
+        s_df = stats(dat, stn, dates=dates)
+        for dt, r in s_df.iterrows():
+            p = paths.get(dt)
+            rows.append((array, stn.upper(), f'{dt:%Y-%m-%d}', p, mtime.get(p),
+                         r['cadence'], r['expected'], r['valid'], json.dumps(r['gaps'])))
+
+    conn = connect()
+    with index._lock:
+        conn.executemany('INSERT OR REPLACE INTO coverage VALUES (?,?,?,?,?,?,?,?,?)', rows)
+        conn.commit()
+
+
+def _select(array, site, sdate, ndays, edate, columns):
+    """Current coverage rows for stations and dates."""
+    if type(site) is str:
+        site = [site]
+    site = [s.upper() for s in site]
+    if edate is not None:
+        dates = pd.date_range(start=sdate, end=edate, freq='D')
+    else:
+        dates = pd.date_range(start=sdate, periods=ndays, freq='D')
+
+    # records are current if the file is unchanged since it was loaded
+    sql = ('SELECT c.site, c.date, {0} FROM coverage c '
+           'LEFT JOIN files f ON c.path = f.path '
+           'WHERE c.array = ? AND c.date BETWEEN ? AND ? '
+           'AND c.site IN ({1}) '
+           'AND (c.path IS NULL OR f.mtime = c.mtime)').format(
+               ', '.join('c.'+c for c in columns), ','.join('?'*len(site)))
+    par = [array.lower(), f'{dates[0]:%Y-%m-%d}', f'{dates[-1]:%Y-%m-%d}'] + site
+    c_df = pd.read_sql_query(sql, connect(), params=par)
+    c_df['date'] = pd.to_datetime(c_df['date'])
+    return c_df, site, dates
+
+
+def query(array: str,
+          site: str | list,
+          sdate,
+          ndays: int = 1,
+          edate=None,
+          value: str = 'fraction'):
+    """Coverage of stations over a date range.
+
+    Parameters
+    ----------
+    array : str
+        Array, e.g. 'carisma'
+    site : str | list
+        Station or stations
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    value : str, optional
+        'fraction' of expected samples that are valid, or the number of
+        'valid' or 'expected' samples, by default 'fraction'
+
+    Returns
+    -------
+    DataFrame
+        Indexed by date with a column for each station. Station-days
+        that have no file are 0, those never loaded are NaN.
+    """
+    if value not in ['fraction', 'valid', 'expected']:
+        raise ValueError("value must be 'fraction', 'valid' or 'expected'")
+
+    c_df, site, dates = _select(array, site, sdate, ndays, edate, ['valid', 'expected'])
+    if value == 'fraction':
+        c_df['fraction'] = (c_df['valid']/c_df['expected'].where(c_df['expected'] > 0)).fillna(0.)
+
+    cov = c_df.pivot(index='date', columns='site', values=value)
+    cov = cov.reindex(index=dates, columns=site).astype(float)
+    cov.index.name = 'date'
+    cov.columns.name = None
+
+    # days without files have no coverage
+    avail = index.availability(array, site, dates[0], edate=dates[-1])
+    cov = cov.mask(~avail, 0.)
+
+    return cov
+
+
+def gaps(array: str,
+         site: str | list,
+         sdate,
+         ndays: int = 1,
+         edate=None):
+    """Gap intervals recorded for stations over a date range.
+
+    Parameters are the same as query.
+
+    Returns
+    -------
+    DataFrame
+        One row per gap with site, start and end
+    """
+    c_df, site, dates = _select(array, site, sdate, ndays, edate, ['gaps'])
+
+    rows = []
+    for stn, dt, g in zip(c_df['site'], c_df['date'], c_df['gaps']):
+        for start, end in json.loads(g):
+            rows.append((stn, dt + pd.Timedelta(seconds=start),
+                         dt + pd.Timedelta(seconds=end)))
+    g_df = pd.DataFrame(rows, columns=['site', 'start', 'end'])
+    return g_df.sort_values(['site', 'start'], ignore_index=True)
+
+
+def build(array: str,
+          site: str | list,
+          sdate,
+          ndays: int = 1,
+          edate=None,
+          **kwargs):
+    """Record coverage for station-days with files that have not been loaded.
+
+    Each station is loaded over the contiguous block of days between its
+    first and last unknown day, loading records the coverage.
+
+    Parameters
+    ----------
+    array : str
+        Array, e.g. 'carisma'
+    site : str | list
+        Station or stations
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    kwargs : dict, optional
+        Passed to the array's load, dl=False unless set
+
+    Returns
+    -------
+    DataFrame
+        Coverage fraction, see query
+    """
+    if type(site) is str:
+        site = [site]
+    mod = importlib.import_module('gmag.arrays.'+array.lower())
+    kwargs.setdefault('dl', False)
+
+    cov = query(array, site, sdate, ndays=ndays, edate=edate)
+    todo = cov.isna()
+    if array.lower() == 'image':
+        # every station is in the same file
+        days = todo.index[todo.any(axis=1)]
+        if len(days):
+            mod.load(site, days[0], edate=days[-1], **kwargs)
+    else:
+        for stn in site:
+            days = todo.index[todo[stn.upper()]]
+            if len(days):
+                mod.load([stn], days[0], edate=days[-1], **kwargs)
+
+    return query(array, site, sdate, ndays=ndays, edate=edate)
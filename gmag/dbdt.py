@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized dB/dt and GIC proxy indices for ground magnetometer arrays.
+
+Derivatives are computed for every station (column) in a single pass using
+the actual time between valid samples, so gaps and stations with
+different cadences in an outer joined DataFrame are handled correctly.
+Derivatives across gaps longer then max_dt are NaN.
+
+Example
+-------
+
+dat, meta = carisma.load(site=['GILL','ISLL','PINA'],sdate='2012-01-01',ndays=1)
+bx, by = utils.field_arrays(dat, ['GILL','ISLL','PINA'])
+dbh = dbdt.dbh_dt(dat.index, bx, by)
+tw, wmax, wrms, cnt = dbdt.window(dat.index, dbh, width=60)
+
+Process data as it arrives, carrying state between calls
+st = dbdt.Stream(width=60)
+for dat in data_chunks:
+    bx, by = utils.field_arrays(dat, site)
+    tw, wmax, wrms, cnt = st.update(dat.index, bx, by)
+
+Notes
+-----
+    dB/dt is in nT/s. Times can be a DatetimeIndex, datetime64 array or
+    int64 nanoseconds.
+
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def time_ns(t):
+    """Sample times as int64 nanoseconds.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times
+
+    Returns
+    -------
+    np.ndarray
+        int64 nanoseconds
+    """
+    t = np.asarray(t)
+    if t.dtype.kind == 'M':
+        t = t.astype('datetime64[ns]')
+    return t.astype(np.int64)
+
+
+def _previous(t, dat, prev_t=None, prev_v=None):
+    """Previous valid value and time (s) since it for every sample,
+    and where a derivative can be taken."""
+    n, ncol = dat.shape
+    good = np.isfinite(dat)
+    idx = np.broadcast_to(np.arange(n)[:, np.newaxis], dat.shape)
+
+    # index of the previous valid sample of each column
+    prev = np.where(good, idx, -1)
+    np.maximum.accumulate(prev, axis=0, out=prev)
+    prev = np.vstack([np.full((1, ncol), -1), prev[:-1]])
+
+    col = np.broadcast_to(np.arange(ncol), dat.shape)
+    t_p = np.where(prev >= 0, t[np.maximum(prev, 0)], -1)
+    v_p = np.where(prev >= 0, dat[np.maximum(prev, 0), col], np.nan)
+    # samples without a previous valid sample
+    # in this block use the carried state
+    if prev_t is not None and prev_v is not None:
+        first = prev < 0
+        t_p = np.where(first, np.asarray(prev_t, dtype=np.int64)[np.newaxis, :], t_p)
+        v_p = np.where(first, np.asarray(prev_v, dtype=float)[np.newaxis, :], v_p)
+        ok_p = ~first | np.isfinite(v_p)
+    else:
+        ok_p = prev >= 0
+
+    step = (t[:, np.newaxis] - t_p)/1e9
+    return v_p, step, good & ok_p & (step > 0)
+
+
+def _spacing(step, ok):
+    """Twice the median of step where ok, for each column."""
+    med = np.full(step.shape[1], np.nan)
+    has = ok.any(axis=0)
+    if has.any():
+        med[has] = np.nanmedian(np.where(ok, step, np.nan)[:, has], axis=0)
+    return 2*med
+
+
+def spacing(t,
+            dat,
+            prev_t=None,
+            prev_v=None):
+    """Default max_dt, twice the median valid spacing of each column.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, samples x stations
+    prev_t, prev_v : array like, optional
+        Time (int64 ns) and value of the last valid sample of each
+        column before t, by default None
+
+    Returns
+    -------
+    np.ndarray
+        max_dt (s) of each column, NaN for columns without two valid
+        samples
+    """
+    t = time_ns(t)
+    dat = np.asarray(dat, dtype=float)
+    if dat.ndim == 1:
+        dat = dat[:, np.newaxis]
+    if dat.shape[0] == 0:
+        return np.full(dat.shape[1], np.nan)
+    v_p, step, ok = _previous(t, dat, prev_t, prev_v)
+    return _spacing(step, ok)
+
+
+def deriv(t,
+          dat,
+          max_dt=None,
+          prev_t=None,
+          prev_v=None):
+    """Time derivative of every column using the previous valid sample.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, samples or samples x stations
+    max_dt : float | array like | None, optional
+        Longest time (s) between valid samples to difference across, for
+        all or each column, by default None which uses spacing(), twice
+        the median valid spacing of each column
+    prev_t : array like, optional
+        Time (int64 ns) of the last valid sample of each column before t,
+        used when streaming, by default None
+    prev_v : array like, optional
+        Value of the last valid sample of each column before t, by default None
+
+    Returns
+    -------
+    np.ndarray
+        Derivative (units/s) at each sample, NaN where it can't be derived
+    """
+    t = time_ns(t)
+    dat = np.asarray(dat, dtype=float)
+    squeeze = dat.ndim == 1
+    if squeeze:
+        dat = dat[:, np.newaxis]
+
+    n, ncol = dat.shape
+    if n == 0:
+        return dat[:, 0] if squeeze else dat
+
+    v_p, step, ok = _previous(t, dat, prev_t, prev_v)
+    if max_dt is None:
+        max_dt = _spacing(step, ok)
+    with np.errstate(invalid='ignore'):
+        ok &= step <= max_dt
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(ok, (dat - v_p)/step, np.nan)
+
+    if squeeze:
+        return out[:, 0]
+    return out
+
+
+def dbh_dt(t,
+           mag_x,
+           mag_y,
+           max_dt: float | None = None):
+    """Magnitude of the horizontal field derivative.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    mag_x : array like
+        North-South magnetic field (nT), samples or samples x stations
+    mag_y : array like
+        East-West magnetic field (nT), same shape as mag_x
+    max_dt : float | None, optional
+        Longest time (s) between valid samples to difference across, by
+        default None which uses twice the median valid spacing of each column
+
+    Returns
+    -------
+    np.ndarray
+        |dBh/dt| (nT/s)
+    """
+    return np.hypot(deriv(t, mag_x, max_dt=max_dt), deriv(t, mag_y, max_dt=max_dt))
+
+
+def blocks(t,
+           dat,
+           step: float):
+    """Maximum absolute value, sum of squares and count in
+    contiguous time blocks.
+
+    Blocks are aligned to multiples of step from the epoch.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, samples x stations
+    step : float
+        Block length (s)
+
+    Returns
+    -------
+    tuple
+        Block index (int64), max, sum of squares and count, blocks x stations.
+        Every block between the first and last is returned, none if there
+        are no samples.
+    """
+    t = time_ns(t)
+    dat = np.abs(np.asarray(dat, dtype=float))
+    step_ns = int(round(step*1e9))
+    if t.size == 0:
+        shape = (0,) + dat.shape[1:]
+        return (np.empty(0, dtype=np.int64), np.empty(shape), np.empty(shape),
+                np.empty(shape, dtype=np.int64))
+
+    b = t // step_ns
+    b_idx = np.arange(b[0], b[-1]+1)
+
+    start = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    good = np.isfinite(dat)
+    b_max = np.fmax.reduceat(np.where(good, dat, np.nan), start, axis=0)
+    b_ssq = np.add.reduceat(np.where(good, dat**2, 0.), start, axis=0)
+    b_cnt = np.add.reduceat(good.astype(np.int64), start, axis=0)
+
+    # fill in blocks without any samples
+    pos = b[start] - b[0]
+    w_max = np.full((b_idx.size, dat.shape[1]), np.nan)
+    w_ssq = np.zeros((b_idx.size, dat.shape[1]))
+    w_cnt = np.zeros((b_idx.size, dat.shape[1]), dtype=np.int64)
+    w_max[pos] = b_max
+    w_ssq[pos] = b_ssq
+    w_cnt[pos] = b_cnt
+
+    return b_idx, w_max, w_ssq, w_cnt
+
+
+def combine(b_max,
+            b_ssq,
+            b_cnt,
+            k: int):
+    """Combine k consecutive blocks into rolling windows.
+
+    Parameters
+    ----------
+    b_max, b_ssq, b_cnt : np.ndarray
+        Block max, sum of squares and count from blocks()
+    k : int
+        Number of blocks in a window
+
+    Returns
+    -------
+    tuple
+        Window max, rms and count, one window ending at each block from the
+        k-th block onward
+    """
+    if k == 1:
+        w_max, w_ssq, w_cnt = b_max, b_ssq, b_cnt
+    else:
+        with np.errstate(invalid='ignore'):
+            w_max = np.fmax.reduce(sliding_window_view(b_max, k, axis=0), axis=-1)
+        w_ssq = sliding_window_view(b_ssq, k, axis=0).sum(axis=-1)
+        w_cnt = sliding_window_view(b_cnt, k, axis=0).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w_rms = np.where(w_cnt > 0, np.sqrt(w_ssq/w_cnt), np.nan)
+
+    return w_max, w_rms, w_cnt
+
+
+def window(t,
+           dat,
+           width: float = 60,
+           step: float | None = None):
+    """Rolling maximum and RMS of the absolute value over time windows.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, e.g. |dBh/dt|, samples or samples x stations
+    width : float, optional
+        Window length (s), by default 60
+    step : float | None, optional
+        Time (s) between window starts, must divide width, by default None
+        which uses non-overlapping windows
+
+    Returns
+    -------
+    tuple
+        Window start times (datetime64[ns]), max, rms and number of valid
+        samples, windows x stations
+    """
+    if step is None:
+        step = width
+    k = int(round(width/step))
+    if k < 1 or not np.isclose(k*step, width):
+        raise ValueError('step must divide width')
+
+    dat = np.asarray(dat, dtype=float)
+    squeeze = dat.ndim == 1
+    if squeeze:
+        dat = dat[:, np.newaxis]
+
+    b_idx, b_max, b_ssq, b_cnt = blocks(t, dat, step)
+    if b_idx.size < k:
+        empty = np.empty((0, dat.shape[1]))
+        tw = np.empty(0, dtype='datetime64[ns]')
+        return (tw, empty, empty, empty.astype(np.int64)) if not squeeze else \
+            (tw, empty[:, 0], empty[:, 0], empty[:, 0].astype(np.int64))
+
+    w_max, w_rms, w_cnt = combine(b_max, b_ssq, b_cnt, k)
+    tw = (b_idx[:b_idx.size-k+1]*int(round(step*1e9))).astype('datetime64[ns]')
+
+    if squeeze:
+        return tw, w_max[:, 0], w_rms[:, 0], w_cnt[:, 0]
+    return tw, w_max, w_rms, w_cnt
+
+
+class Stream:
+    """Incremental |dBh/dt| and rolling window statistics.
+
+    Data is passed in consecutive, time ordered chunks. The last valid
+    sample of each station and the incomplete blocks are carried between
+    chunks so the results match dbh_dt and window on the full series.
+
+    Parameters
+    ----------
+    width : float, optional
+        Window length (s), by default 60
+    step : float | None, optional
+        Time (s) between window starts, must divide width, by default None
+        which uses non-overlapping windows
+    max_dt : float | None, optional
+        Longest time (s) between valid samples to difference across, by
+        default None which uses twice the median valid spacing of each
+        column, fixed from the first chunk with two valid samples of that
+        column. Results then match dbh_dt if the cadence is steady.
+    """
+
+    def __init__(self,
+                 width: float = 60,
+                 step: float | None = None,
+                 max_dt: float | None = None):
+        if step is None:
+            step = width
+        self.k = int(round(width/step))
+        if self.k < 1 or not np.isclose(self.k*step, width):
+            raise ValueError('step must divide width')
+        self.step = step
+        self.max_dt = max_dt
+        # max_dt of each column when not given, NaN until known
+        self.dt_x = None
+        self.dt_y = None
+
+        # time and value of the last valid
+        # sample of each column
+        self.prev_tx = None
+        self.prev_x = None
+        self.prev_ty = None
+        self.prev_y = None
+        # blocks not yet emitted, the last may be incomplete
+        self.b_idx = None
+        self.b_max = None
+        self.b_ssq = None
+        self.b_cnt = None
+
+    @staticmethod
+    def last_valid(t, dat, prev_t, prev_v):
+        """Time and value of the last valid sample of each column."""
+        good = np.isfinite(dat)
+        idx = np.where(good.any(axis=0), dat.shape[0]-1-np.argmax(good[::-1], axis=0), -1)
+        col = np.arange(dat.shape[1])
+        p_t = np.where(idx >= 0, t[np.maximum(idx, 0)], prev_t)
+        p_v = np.where(idx >= 0, dat[np.maximum(idx, 0), col], prev_v)
+        return p_t, p_v
+
+    def limit(self, lim, t, dat, prev_t, prev_v):
+        """max_dt of each column, set once a column has two valid samples."""
+        if self.max_dt is not None:
+            return self.max_dt
+        if np.isnan(lim).any():
+            lim = np.where(np.isnan(lim), spacing(t, dat, prev_t, prev_v), lim)
+        return lim
+
+    def update(self, t, mag_x, mag_y):
+        """Add a chunk of data.
+
+        Parameters
+        ----------
+        t : DatetimeIndex, datetime64 or int64 array like
+            Sample times, sorted and after any previous chunk
+        mag_x : array like
+            North-South magnetic field (nT), samples x stations
+        mag_y : array like
+            East-West magnetic field (nT), same shape as mag_x
+
+        Returns
+        -------
+        tuple
+            Start times, max, rms and count of the windows completed by
+            this chunk, as returned by window()
+        """
+        t = time_ns(t)
+        mag_x = np.asarray(mag_x, dtype=float)
+        mag_y = np.asarray(mag_y, dtype=float)
+        if mag_x.ndim == 1:
+            mag_x = mag_x[:, np.newaxis]
+            mag_y = mag_y[:, np.newaxis]
+        ncol = mag_x.shape[1]
+        if self.prev_x is None:
+            self.prev_tx = np.full(ncol, -1, dtype=np.int64)
+            self.prev_x = np.full(ncol, np.nan)
+            self.prev_ty = np.full(ncol, -1, dtype=np.int64)
+            self.prev_y = np.full(ncol, np.nan)
+            self.dt_x = np.full(ncol, np.nan)
+            self.dt_y = np.full(ncol, np.nan)
+
+        empty = np.empty((0, ncol))
+        tw = np.empty(0, dtype='datetime64[ns]')
+        if t.size == 0:
+            return tw, empty, empty, empty.astype(np.int64)
+
+        self.dt_x = self.limit(self.dt_x, t, mag_x, self.prev_tx, self.prev_x)
+        self.dt_y = self.limit(self.dt_y, t, mag_y, self.prev_ty, self.prev_y)
+        dbh = np.hypot(deriv(t, mag_x, max_dt=self.dt_x, prev_t=self.prev_tx, prev_v=self.prev_x),
+                       deriv(t, mag_y, max_dt=self.dt_y, prev_t=self.prev_ty, prev_v=self.prev_y))
+        self.prev_tx, self.prev_x = self.last_valid(t, mag_x, self.prev_tx, self.prev_x)
+        self.prev_ty, self.prev_y = self.last_valid(t, mag_y, self.prev_ty, self.prev_y)
+
+        b_idx, b_max, b_ssq, b_cnt = blocks(t, dbh, self.step)
+        if self.b_idx is not None:
+            # merge the carried incomplete block and
+            # fill any empty blocks between chunks
+            last = self.b_idx[-1]
+            fill = b_idx[0] - last - 1
+            if fill < 0:
+                b_max[0] = np.fmax(b_max[0], self.b_max[-1])
+                b_ssq[0] += self.b_ssq[-1]
+                b_cnt[0] += self.b_cnt[-1]
+                c_sl = slice(None, -1)
+            else:
+                c_sl = slice(None)
+            gap = np.arange(last+1, b_idx[0])
+            b_idx = np.r_[self.b_idx[c_sl], gap, b_idx]
+            b_max = np.vstack([self.b_max[c_sl], np.full((gap.size, ncol), np.nan), b_max])
+            b_ssq = np.vstack([self.b_ssq[c_sl], np.zeros((gap.size, ncol)), b_ssq])
+            b_cnt = np.vstack([self.b_cnt[c_sl], np.zeros((gap.size, ncol), dtype=np.int64), b_cnt])
+
+        # windows made of complete blocks, the last
+        # block may still receive samples
+        n_done = b_idx.size - 1
+        n_win = n_done - self.k + 1
+        if n_win > 0:
+            w_max, w_rms, w_cnt = combine(b_max[:n_done], b_ssq[:n_done], b_cnt[:n_done], self.k)
+            tw = (b_idx[:n_win]*int(round(self.step*1e9))).astype('datetime64[ns]')
+            keep = slice(n_win, None)
+        else:
+            w_max = w_rms = empty
+            w_cnt = empty.astype(np.int64)
+            keep = slice(None)
+
+        self.b_idx = b_idx[keep]
+        self.b_max = b_max[keep]
+        self.b_ssq = b_ssq[keep]
+        self.b_cnt = b_cnt[keep]
+
+        return tw, w_max, w_rms, w_cnt
+
+    def flush(self):
+        """Windows ending at the last, possibly incomplete, block.
+
+        Returns
+        -------
+        tuple
+            Start times, max, rms and count as returned by window()
+        """
+        if self.b_idx is None or self.b_idx.size < self.k:
+            ncol = 0 if self.b_max is None else self.b_max.shape[1]
+            empty = np.empty((0, ncol))
+            return np.empty(0, dtype='datetime64[ns]'), empty, empty, empty.astype(np.int64)
+
+        w_max, w_rms, w_cnt = combine(self.b_max, self.b_ssq, self.b_cnt, self.k)
+        n_win = self.b_idx.size - self.k + 1
+        tw = (self.b_idx[:n_win]*int(round(self.step*1e9))).astype('datetime64[ns]')
+        self.b_idx = self.b_idx[n_win:]
+        self.b_max = self.b_max[n_win:]
+        self.b_ssq = self.b_ssq[n_win:]
+        self.b_cnt = self.b_cnt[n_win:]
+
+        return tw, w_max, w_rms, w_cnt
@@ -29,6 +29,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import logging
+
 from pathlib import Path
 
 import numpy as np
@@ -36,6 +38,12 @@ import numpy.typing as npt
 import pandas as pd
 
 import gmag
+import gmag.utils
+
+from gmag import cache
+from gmag import timing
+
+logger = logging.getLogger(__name__)
 
 def calcZ(resistivities: npt.ArrayLike | list,
           thicknesses: npt.ArrayLike | list,
@@ -171,21 +179,596 @@ def calcE(mag_x: npt.ArrayLike,
     # N = 2**(int(np.log2(N0))+2)
     N = N0
 
+    with timing.stage('efield', 'impedance'):
+        freqs = np.fft.rfftfreq(N, d=dt)
+        # Z needs to be organized as: xx, xy, yx, yy
+        Z_interp = calcZ(resistivities, thicknesses, freqs)
+
+    with timing.stage('efield', 'fft', rows=N):
+        mag_x_fft = np.fft.rfft(mag_x, n=N)
+        mag_y_fft = np.fft.rfft(mag_y, n=N)
+
+    with timing.stage('efield', 'convolve'):
+        Ex_fft = Z_interp[0, :]*mag_x_fft + Z_interp[1, :]*mag_y_fft
+        Ey_fft = Z_interp[2, :]*mag_x_fft + Z_interp[3, :]*mag_y_fft
+
+    with timing.stage('efield', 'ifft', rows=N):
+        # without n, irfft returns N-1 samples for odd N
+        Ex_t = np.real(np.fft.irfft(Ex_fft, n=N)[:N0])
+        Ey_t = np.real(np.fft.irfft(Ey_fft, n=N)[:N0])
+
+    return Ex_t, Ey_t
+
+def calcE_chunk(mag_x: npt.ArrayLike,
+                mag_y: npt.ArrayLike,
+                resistivities: npt.ArrayLike | list,
+                thicknesses: npt.ArrayLike | list,
+                dt=60,
+                mem: int = 2**28,
+                overlap: int | None = None,
+                out=None):
+    """Derive E from long series in overlapping segments.
+
+    calcE transforms the full series at once and allocates several
+    complex arrays the size of the series. Here the series is split into
+    segments sized to mem, each segment is transformed with the same
+    (cached) impedance and the overlap at either end of the segment,
+    which is contaminated by the circular convolution, is discarded.
+
+    Results match calcE to within a small fraction of the field away from
+    the ends of the series where calcE itself wraps around.
+
+    Parameters
+    ----------
+    mag_x : Numpy Array Like
+        North-South magnetic field (nT), can be a Numpy memmap.
+    mag_y : Numpy Array Like
+        East-West magnetic field (nT), can be a Numpy memmap.
+    resistivities : Numpy Array Like or list
+        Array or list of ground resistivities (Ohm-m).
+    thicknesses : Numpy Array Like or list
+        Array or list of thickness of each layer corresponding to resitivity array 
+        in meters (m).
+    dt : int, optional
+        Temporal resolution of the magnetic field in seconds, by default 60 (s).
+    mem : int, optional
+        Memory budget for each segment in bytes, by default 2**28 (256 MB)
+    overlap : int | None, optional
+        Samples discarded at either end of each segment, by default None
+        which uses a quarter of the segment
+    out : str | Numpy Array | None, optional
+        Where to write the electric field. A (2, N) array, a file name for
+        a new .npy memmap (registered with gmag.cache if it is in data_dir),
+        or None to allocate a new array, by default None
+
+    Returns
+    -------
+    Numpy array
+        North-South and East-West induced electric field
+    """
+    # pylint: disable=invalid-name
+    N = len(mag_x)
+
+    # segment input, FFTs, impedance and output use
+    # roughly 112 bytes per sample
+    seg = int(max(mem // 112, 16))
+    if overlap is None:
+        overlap = seg // 4
+    if seg <= 2*overlap:
+        raise ValueError('Segment too small for overlap, increase mem')
+
+    fn = None
+    if out is None:
+        out = np.empty((2, N))
+    elif isinstance(out, (str, Path)):
+        fn = str(out)
+        out = np.lib.format.open_memmap(fn, mode='w+',
+                                        dtype=float, shape=(2, N))
+
+    # short series are done in one go
+    if N <= seg:
+        out[0, :], out[1, :] = calcE(mag_x, mag_y, resistivities,
+                                     thicknesses, dt=dt)
+    else:
+        _chunks(mag_x, mag_y, resistivities, thicknesses, dt, seg, overlap, out)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    if fn is not None:
+        cache.register(fn)
+
+    return out[0], out[1]
+
+
+def _chunks(mag_x, mag_y, resistivities, thicknesses, dt, seg, overlap, out):
+    """Fill out with E from overlapping segments of length seg."""
+    # pylint: disable=invalid-name
+    N = len(mag_x)
+
+    # every segment has the same length so the
+    # impedance only needs to be calculated once
+    freqs = np.fft.rfftfreq(seg, d=dt)
+    Z = calcZ(resistivities, thicknesses, freqs)
+
+    step = seg - 2*overlap
+    for a in range(0, N, step):
+        b = min(a+step, N)
+        # segment around the samples being kept, shifted to
+        # stay inside the series at the start and end
+        s1 = min(N, max(0, a-overlap)+seg)
+        s0 = s1-seg
+
+        with timing.stage('efield', 'segment', rows=seg):
+            mag_x_fft = np.fft.rfft(np.asarray(mag_x[s0:s1], dtype=float))
+            mag_y_fft = np.fft.rfft(np.asarray(mag_y[s0:s1], dtype=float))
+
+            Ex_fft = Z[0, :]*mag_x_fft + Z[1, :]*mag_y_fft
+            Ey_fft = Z[2, :]*mag_x_fft + Z[3, :]*mag_y_fft
+
+            out[0, a:b] = np.fft.irfft(Ex_fft, n=seg)[a-s0:b-s0]
+            out[1, a:b] = np.fft.irfft(Ey_fft, n=seg)[a-s0:b-s0]
+
+
+def fill_gaps(dat: npt.ArrayLike,
+              max_gap: int | None = None):
+    """Linearly interpolate across NaN gaps in magnetic field data.
+
+    Gaps are filled for all columns at once, there is no loop over
+    stations or samples.
+
+    Parameters
+    ----------
+    dat : Numpy Array Like
+        Magnetic field data, 1-D (samples) or 2-D (samples x stations).
+    max_gap : int | None, optional
+        Longest gap, in samples, to interpolate across. Longer gaps and
+        gaps at the start or end of the series are left as NaN, by default
+        None which fills every interior gap.
+
+    Returns
+    -------
+    Numpy Array
+        Copy of dat with the gaps filled
+    Numpy Array
+        Boolean mask, True where dat is still invalid
+    """
+    dat = np.array(dat, dtype=float)
+    squeeze = dat.ndim == 1
+    if squeeze:
+        dat = dat[:, np.newaxis]
+
+    n = dat.shape[0]
+    good = np.isfinite(dat)
+    idx = np.broadcast_to(np.arange(n)[:, np.newaxis], dat.shape)
+
+    # index of the previous and next valid sample
+    # for every sample in the series
+    prev = np.where(good, idx, -1)
+    np.maximum.accumulate(prev, axis=0, out=prev)
+    nxt = np.where(good, idx, n)
+    nxt = np.minimum.accumulate(nxt[::-1], axis=0)[::-1]
+
+    # only fill interior gaps shorter then max_gap
+    fill = ~good & (prev >= 0) & (nxt < n)
+    if max_gap is not None:
+        fill &= (nxt - prev - 1) <= max_gap
+
+    if fill.any():
+        col = np.broadcast_to(np.arange(dat.shape[1]), dat.shape)[fill]
+        p = prev[fill]
+        q = nxt[fill]
+        w = (idx[fill] - p) / (q - p)
+        dat[fill] = dat[p, col] + w * (dat[q, col] - dat[p, col])
+
+    mask = ~good & ~fill
+
+    if squeeze:
+        return dat[:, 0], mask[:, 0]
+    return dat, mask
+
+
+def detrend(dat: npt.ArrayLike,
+            kind: str | None = 'linear'):
+    """Remove the mean or a linear trend from magnetic field data.
+
+    NaNs are ignored when deriving the trend and are left in place.
+
+    Parameters
+    ----------
+    dat : Numpy Array Like
+        Magnetic field data, 1-D (samples) or 2-D (samples x stations).
+    kind : str | None, optional
+        'mean', 'linear' or None, by default 'linear'
+
+    Returns
+    -------
+    Numpy Array
+        Detrended copy of dat
+    """
+    dat = np.array(dat, dtype=float)
+    if kind is None:
+        return dat
+    if kind not in ['mean', 'linear']:
+        raise ValueError(f'Unknown detrend: {kind}')
+
+    good = np.isfinite(dat)
+    cnt = np.maximum(good.sum(axis=0), 1)
+    d0 = np.where(good, dat, 0.)
+    mean = d0.sum(axis=0) / cnt
+
+    if kind == 'mean':
+        return dat - mean
+
+    # least squares slope ignoring NaNs
+    t = np.arange(dat.shape[0], dtype=float)
+    if dat.ndim > 1:
+        t = t[:, np.newaxis]
+    t = np.where(good, t, 0.)
+    t_mean = t.sum(axis=0) / cnt
+    t_anom = np.where(good, t - t_mean, 0.)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (t_anom * (d0 - mean)).sum(axis=0) / (t_anom**2).sum(axis=0)
+    slope = np.nan_to_num(slope)
+
+    t = np.arange(dat.shape[0], dtype=float)
+    if dat.ndim > 1:
+        t = t[:, np.newaxis]
+
+    return dat - mean - slope * (t - t_mean)
+
+
+def taper(n: int,
+          alpha: float = 0.1):
+    """Tukey (tapered cosine) window.
+
+    Parameters
+    ----------
+    n : int
+        Number of samples in the window.
+    alpha : float, optional
+        Fraction of the window inside the cosine tapered region,
+        0 is a boxcar and 1 a Hann window, by default 0.1
+
+    Returns
+    -------
+    Numpy Array
+        Window of length n
+    """
+    w = np.ones(n)
+    if alpha <= 0 or n < 2:
+        return w
+    alpha = min(alpha, 1.)
+
+    width = int(np.floor(alpha * (n - 1) / 2.))
+    if width < 1:
+        return w
+    ramp = 0.5 * (1 - np.cos(np.pi * np.arange(width) / width))
+    w[:width] = ramp
+    w[n-width:] = ramp[::-1]
+
+    return w
+
+
+def prep_mag(mag_x: npt.ArrayLike,
+             mag_y: npt.ArrayLike,
+             max_gap: int | None = None,
+             detrend_type: str | None = 'linear',
+             alpha: float = 0.):
+    """Prepare magnetic field data with gaps for calcE.
+
+    NaNs in the magnetic field spread through the FFT in calcE
+    and make the entire electric field NaN. Short gaps are interpolated,
+    the series detrended and optionally tapered and any remaining
+    gaps are zeroed.
+
+    Example
+    -------
+    bx, by, mask = prep_mag(df['GILL_X'], df['GILL_Y'], max_gap=60)
+    ex, ey = calcE(bx, by, res, thick, dt=1)
+    ex[mask] = np.nan
+    ey[mask] = np.nan
+
+    Parameters
+    ----------
+    mag_x : Numpy Array Like
+        North-South magnetic field (nT), 1-D or 2-D (samples x stations).
+    mag_y : Numpy Array Like
+        East-West magnetic field (nT), same shape as mag_x.
+    max_gap : int | None, optional
+        Longest gap, in samples, to interpolate across, by default None
+        which fills every interior gap.
+    detrend_type : str | None, optional
+        'mean', 'linear' or None, by default 'linear'
+    alpha : float, optional
+        Tukey taper fraction applied after detrending, by default 0. (no taper)
+
+    Returns
+    -------
+    Numpy Array
+        Prepared North-South magnetic field
+    Numpy Array
+        Prepared East-West magnetic field
+    Numpy Array
+        Boolean mask, True for samples that are invalid because of gaps
+    """
+    mag_x, mask_x = fill_gaps(mag_x, max_gap=max_gap)
+    mag_y, mask_y = fill_gaps(mag_y, max_gap=max_gap)
+    mask = mask_x | mask_y
+
+    mag_x[mask] = np.nan
+    mag_y[mask] = np.nan
+
+    mag_x = detrend(mag_x, kind=detrend_type)
+    mag_y = detrend(mag_y, kind=detrend_type)
+
+    mag_x[mask] = 0.
+    mag_y[mask] = 0.
+
+    if alpha > 0:
+        w = taper(mag_x.shape[0], alpha=alpha)
+        if mag_x.ndim > 1:
+            w = w[:, np.newaxis]
+        mag_x *= w
+        mag_y *= w
+
+    return mag_x, mag_y, mask
+
+
+def res_dirs():
+    """Directories searched for Earth resistivity model files.
+
+    In order
+    1. ~/.gmag/Stations
+    2. The Stations folder of the gmag installation
+    3. ~/Stations, for running notebooks on colab
+
+    Returns
+    -------
+    list
+        List of pathlib.Path directories
+    """
+    home_dir = Path.home()
+    module_dir = Path(gmag.__file__)
+
+    return [home_dir / '.gmag' / 'Stations',
+            (module_dir / '..' / 'Stations').resolve(),
+            home_dir / 'Stations']
+
+
+def parse_res(fn: str):
+    """Read and validate a resistivity model file.
+
+    Parameters
+    ----------
+    fn : str
+        Resistivity model file, comma separated layer, thickness (m)
+        and resistivity (Ohm-m) with # comments.
+
+    Returns
+    -------
+    Pandas DataFrame
+        Containing the resitivity profile
+
+    Raises
+    ------
+    ValueError
+        If the model has no layers or non-positive thicknesses or
+        resistivities.
+    """
+    res_df = pd.read_csv(str(fn), comment='#')
+    res_df.columns = [c.strip() for c in res_df.columns]
+
+    if res_df.empty or res_df.shape[1] < 3:
+        raise ValueError(f'No layers in resistivity model {fn}')
+
+    thick = res_df.iloc[:, 1].to_numpy(dtype=float)
+    res = res_df.iloc[:, 2].to_numpy(dtype=float)
+    if not (np.all(np.isfinite(res)) and np.all(res > 0)):
+        raise ValueError(f'Invalid resistivity in model {fn}')
+    # thickness of the last layer is not used, it's
+    # the half space
+    if not (np.all(np.isfinite(thick[:-1])) and np.all(thick[:-1] > 0)):
+        raise ValueError(f'Invalid thickness in model {fn}')
+
+    return res_df
+
+
+# resistivity models keyed by upper case model code
+# populated once by res_models(), None until then
+_res_models = None
+
+
+def res_models(reload: bool = False):
+    """Registry of every Earth resistivity model.
+
+    Every res_model_*.txt file in res_dirs() is parsed and validated
+    once and cached, an empty search is cached too. Files earlier in
+    res_dirs() take precedence.
+
+    Parameters
+    ----------
+    reload : bool, optional
+        Search for and read the model files again, by default False
+
+    Returns
+    -------
+    dict
+        Keyed by upper case model code, each entry is a dictionary with
+        'resistivity' and 'thickness' Numpy arrays, the parsed 'table'
+        and the 'file' it was read from
+    """
+    global _res_models
+    if _res_models is not None and not reload:
+        return _res_models
+
+    models = {}
+    for d in res_dirs():
+        if not d.is_dir():
+            continue
+        for f in sorted(d.glob('res_model_*.txt')):
+            code = f.stem[len('res_model_'):].upper()
+            if code in models:
+                continue
+            try:
+                res_df = parse_res(f)
+            except (ValueError, pd.errors.ParserError) as err:
+                logger.warning(f'Skipping resistivity model: {err}')
+                continue
+            models[code] = {
+                'resistivity': res_df.iloc[:, 2].to_numpy(dtype=float),
+                'thickness': res_df.iloc[:, 1].to_numpy(dtype=float),
+                'table': res_df,
+                'file': str(f)}
+
+    _res_models = models
+    return _res_models
+
+
+def get_res(stn: str):
+    """Cached resistivity profile for a model.
+
+    Parameters
+    ----------
+    stn : str
+        Resistivity model (station code) to return
+
+    Returns
+    -------
+    tuple of Numpy Array or None
+        resistivities (Ohm-m) and thicknesses (m), None if the model
+        can't be found
+    """
+    mod = res_models().get(stn.upper())
+    if mod is None:
+        return None
+
+    return mod['resistivity'], mod['thickness']
+
+
+def nearest_res(site: str | list,
+                max_dist: float | None = None):
+    """Map stations to the nearest resistivity model.
+
+    Distances are great circle distances between the station and the
+    station the model was derived for, using the coordinates in
+    Stations/station_list.csv.
+
+    Parameters
+    ----------
+    site : str | list
+        Station or list of stations to map
+    max_dist : float | None, optional
+        Largest distance (km) to accept a model, by default None
+
+    Returns
+    -------
+    dict
+        Station code (upper) -> model code, None if no model is found
+    """
+    if type(site) is str:
+        site = [site]
+    site = [stn.upper() for stn in site]
+
+    models = res_models()
+    geo = gmag.utils.load_station_geo(param='ALL')
+    if geo is None or not models:
+        return {stn: (stn if stn in models else None) for stn in site}
+    geo = geo.drop_duplicates(subset='code').set_index('code')
+
+    m_code = [m for m in models if m in geo.index]
+    s_code = [s for s in site if s in geo.index]
+
+    # distances for all station, model pairs
+    lat1 = np.deg2rad(geo.loc[s_code, 'latitude'].to_numpy(dtype=float))
+    lon1 = np.deg2rad(geo.loc[s_code, 'longitude'].to_numpy(dtype=float))
+    lat2 = np.deg2rad(geo.loc[m_code, 'latitude'].to_numpy(dtype=float))
+    lon2 = np.deg2rad(geo.loc[m_code, 'longitude'].to_numpy(dtype=float))
+
+    a = np.sin((lat2[np.newaxis, :]-lat1[:, np.newaxis])/2)**2 + \
+        np.cos(lat1[:, np.newaxis])*np.cos(lat2[np.newaxis, :]) * \
+        np.sin((lon2[np.newaxis, :]-lon1[:, np.newaxis])/2)**2
+    dist = 2*6371.2*np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    stn_map = {stn: (stn if stn in models else None) for stn in site}
+    if not m_code:
+        return stn_map
+    for i, stn in enumerate(s_code):
+        if stn in models:
+            continue
+        j = np.argmin(dist[i])
+        if max_dist is None or dist[i, j] <= max_dist:
+            stn_map[stn] = m_code[j]
+
+    return stn_map
+
+
+def calcE_array(mag_x: npt.ArrayLike,
+                mag_y: npt.ArrayLike,
+                site: list,
+                dt=60,
+                stn_map: dict | None = None):
+    """Derive E for every station of an array.
+
+    The impedance is calculated once for each resistivity model
+    and applied to all stations sharing that model.
+
+    Parameters
+    ----------
+    mag_x : Numpy Array Like
+        North-South magnetic field (nT), samples x stations.
+    mag_y : Numpy Array Like
+        East-West magnetic field (nT), samples x stations.
+    site : list
+        Station codes for the columns of mag_x and mag_y
+    dt : int, optional
+        Temporal resolution of the magnetic field in seconds, by default 60 (s).
+    stn_map : dict | None, optional
+        Station -> resistivity model, by default None which uses
+        nearest_res(site)
+
+    Returns
+    -------
+    Numpy array
+        North-South and East-West induced electric field, samples x stations.
+        Stations without a model are NaN.
+    """
+    # pylint: disable=invalid-name
+    mag_x = np.asarray(mag_x, dtype=float)
+    mag_y = np.asarray(mag_y, dtype=float)
+    if stn_map is None:
+        stn_map = nearest_res(site)
+
+    N = mag_x.shape[0]
     freqs = np.fft.rfftfreq(N, d=dt)
-    # Z needs to be organized as: xx, xy, yx, yy
-    Z_interp = calcZ(resistivities, thicknesses, freqs)
 
-    mag_x_fft = np.fft.rfft(mag_x, n=N)
-    mag_y_fft = np.fft.rfft(mag_y, n=N)
+    Ex_t = np.full(mag_x.shape, np.nan)
+    Ey_t = np.full(mag_y.shape, np.nan)
 
-    Ex_fft = Z_interp[0, :]*mag_x_fft + Z_interp[1, :]*mag_y_fft
-    Ey_fft = Z_interp[2, :]*mag_x_fft + Z_interp[3, :]*mag_y_fft
+    # group columns by model
+    groups = {}
+    for i, stn in enumerate(site):
+        mod = stn_map.get(stn.upper())
+        if mod is not None:
+            groups.setdefault(mod, []).append(i)
 
-    Ex_t = np.real(np.fft.irfft(Ex_fft)[:N0])
-    Ey_t = np.real(np.fft.irfft(Ey_fft)[:N0])
+    for mod, cols in groups.items():
+        res = get_res(mod)
+        if res is None:
+            continue
+        Z = calcZ(res[0], res[1], freqs)
+
+        mag_x_fft = np.fft.rfft(mag_x[:, cols], n=N, axis=0)
+        mag_y_fft = np.fft.rfft(mag_y[:, cols], n=N, axis=0)
+
+        Ex_fft = Z[0, :, np.newaxis]*mag_x_fft + Z[1, :, np.newaxis]*mag_y_fft
+        Ey_fft = Z[2, :, np.newaxis]*mag_x_fft + Z[3, :, np.newaxis]*mag_y_fft
+
+        Ex_t[:, cols] = np.fft.irfft(Ex_fft, n=N, axis=0)
+        Ey_t[:, cols] = np.fft.irfft(Ey_fft, n=N, axis=0)
 
     return Ex_t, Ey_t
 
+
 def read_res(stn: str):
     """Magntometer station resistivity profile
 
@@ -200,21 +783,8 @@ def read_res(stn: str):
     Pandas DataFrame
         Containing the resitivity profile for the magnetometer station
     """
-    res_filename = f'res_model_{stn}.txt'
-
-    # Get location of Earth Resistivity Model Files
-    home_dir = Path.home()
-    res_file_1 = home_dir / '.gmag' / 'Stations' / res_filename
-
-    module_dir = Path(gmag.__file__)
-    res_file_2 = module_dir / '..' / 'Stations' / res_filename
-    res_file_2 = res_file_2.resolve()
-
-    # Configuration file for running notebooks on colab 
-    res_file_3 = home_dir / 'Stations' / res_filename
-
-    for f in [res_file_1, res_file_2, res_file_3]:
-        if f.is_file():
-            return pd.read_csv(str(f),comment='#')
+    mod = res_models().get(stn.upper())
+    if mod is None:
+        return -1
 
-    return -1
\ No newline at end of file
+    return mod['table'].copy()
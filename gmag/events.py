@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Windows of data around many events, for superposed epoch analysis.
+
+windows() takes a table of events, each with an epoch, the stations to
+extract and the time before and after the epoch, and returns one array
+of events x stations x samples on a common time axis relative to the
+epoch. The requests are grouped by day so every station-day file is
+decoded once however many events fall on it, and only one day is held
+in memory at a time.
+
+Example
+-------
+
+ev = pd.DataFrame({'epoch': onsets, 'stations': [['GILL','ISLL']]*len(onsets)})
+ep, t, meta = events.windows('carisma', ev, pre='2h', post='2h')
+# superposed epoch mean of each station
+sea = np.nanmean(ep, axis=0)
+
+"""
+
+import importlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from gmag import coverage
+from gmag import timing
+
+logger = logging.getLogger(__name__)
+
+
+def _delta(x):
+    """Nanoseconds from a Timedelta-like or seconds."""
+    if isinstance(x, (int, float, np.integer, np.floating)):
+        return np.int64(round(x*1e9))
+    return np.int64(pd.to_timedelta(x).value)
+
+
+def table(ev,
+          site=None,
+          pre='2h',
+          post='2h'):
+    """Normalise an event table.
+
+    Parameters
+    ----------
+    ev : DataFrame, list or DatetimeIndex
+        Events, a DataFrame with an epoch column and optional stations,
+        pre and post columns, or epochs
+    site : str | list, optional
+        Stations for events without a stations column, by default None
+    pre, post : str, float or Timedelta, optional
+        Window before and after the epoch for events without pre and
+        post columns, seconds if a number, by default '2h'
+
+    Returns
+    -------
+    DataFrame
+        epoch (datetime64[ns]), stations (list of upper case codes),
+        pre and post (int64 nanoseconds)
+    """
+    if not isinstance(ev, pd.DataFrame):
+        ev = pd.DataFrame({'epoch': pd.to_datetime(ev)})
+    e_df = pd.DataFrame({'epoch': pd.to_datetime(ev['epoch']).to_numpy()})
+
+    if 'stations' in ev.columns:
+        stations = ev['stations'].tolist()
+    elif site is not None:
+        stations = [site]*len(ev)
+    else:
+        raise ValueError('Events have no stations column and no site was given')
+    e_df['stations'] = [[s.upper() for s in ([stn] if isinstance(stn, str) else stn)]
+                        for stn in stations]
+
+    for col, default in (('pre', pre), ('post', post)):
+        if col in ev.columns:
+            e_df[col] = [_delta(x) for x in ev[col]]
+        else:
+            e_df[col] = _delta(default)
+        if (e_df[col] < 0).any():
+            raise ValueError('{0} must not be negative'.format(col))
+
+    return e_df
+
+
+def windows(array: str,
+            ev,
+            site=None,
+            pre='2h',
+            post='2h',
+            component: str = None,
+            cadence: float = None,
+            dl: bool = True,
+            progress=None,
+            **kwargs):
+    """Extract windows around events for many stations.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'canopus', 'image' or 'themis'
+    ev : DataFrame, list or DatetimeIndex
+        Events, see table, each row has an epoch, stations (str or
+        list) and optionally its own pre and post
+    site : str | list, optional
+        Stations for events without a stations column, by default None
+    pre, post : str, float or Timedelta, optional
+        Default window before and after the epoch, seconds if a number,
+        by default '2h'
+    component : str, optional
+        Component extracted, e.g. 'X', 'H' or 'Z', by default None for
+        the first component of each station (X, or H for THEMIS)
+    cadence : float, optional
+        Spacing of the relative time axis (s), by default None for the
+        cadence of the first day read
+    dl : bool, optional
+        Download missing files, by default True
+    progress : callable, optional
+        Called after every file, see gmag.utils.Progress, by default None
+    kwargs : dict, optional
+        Passed to the array's load, e.g. gz=False
+
+    Returns
+    -------
+    ep : np.ndarray
+        events x stations x samples, NaN where a station is not
+        requested for an event, outside an event's own window or
+        without data
+    t : pd.TimedeltaIndex
+        Time of each sample relative to the epoch
+    meta : DataFrame
+        Station metadata, one row per station in the order of the
+        station axis
+    """
+    load = importlib.import_module('gmag.arrays.'+array.lower()).load
+    e_df = table(ev, site=site, pre=pre, post=post)
+
+    # station axis, in order of first request
+    stations = list(dict.fromkeys(s for stn in e_df['stations'] for s in stn))
+    s_idx = {s: i for i, s in enumerate(stations)}
+
+    epoch = e_df['epoch'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    e_pre = e_df['pre'].to_numpy(dtype=np.int64)
+    e_post = e_df['post'].to_numpy(dtype=np.int64)
+
+    # days touched by each event
+    day_ns = np.int64(86400*10**9)
+    first = (epoch - e_pre)//day_ns
+    last = (epoch + e_post)//day_ns
+    days = {}
+    for i, (d0, d1) in enumerate(zip(first, last)):
+        for d in range(d0, d1+1):
+            days.setdefault(d, []).append(i)
+
+    ep = None
+    step = None
+    meta = {}
+    # days too sparse to measure the cadence, held
+    # until a later day gives the time axis
+    sparse = []
+    for d in sorted(days):
+        idx = np.array(days[d])
+        need = list(dict.fromkeys(s for i in idx for s in e_df['stations'].iloc[i]))
+        date = pd.Timestamp(d*day_ns)
+        with timing.stage('events', 'load'):
+            res = load(need, date, ndays=1, dl=dl, progress=progress, **kwargs)
+        # loaders return None, or None data, for days without files
+        if res is None or res[0] is None or res[0].empty:
+            continue
+        dat, m_df = res
+        for _, row in m_df.iterrows():
+            meta.setdefault(str(row['code']).upper(), row.to_dict())
+
+        t = dat.index.to_numpy().astype('datetime64[ns]').astype(np.int64)
+        if step is None:
+            dt = cadence if cadence is not None else _cadence(t, m_df)
+            if not np.isfinite(dt):
+                logger.debug('Too few samples for the cadence on {0:%Y-%m-%d}'.format(date))
+                sparse.append((d, idx, need, dat, t))
+                continue
+            # common relative axis
+            step = _delta(dt)
+            n0 = int(e_pre.max()//step)
+            rel = np.arange(-n0, int(e_post.max()//step)+1, dtype=np.int64)*step
+            ep = np.full((len(e_df), len(stations), len(rel)), np.nan)
+            for args in sparse:
+                _extract(ep, rel, step, e_df, epoch, e_pre, e_post, s_idx, component, *args)
+            sparse = []
+
+        _extract(ep, rel, step, e_df, epoch, e_pre, e_post, s_idx, component, d, idx, need, dat, t)
+        del dat
+
+    if ep is None:
+        if sparse:
+            logger.info('Too few samples to measure the cadence, set cadence')
+        else:
+            logger.info('No data for any event')
+        step = _delta(cadence) if cadence is not None else None
+        rel = (np.arange(-int(e_pre.max()//step), int(e_post.max()//step)+1, dtype=np.int64)*step
+               if step else np.zeros(0, dtype=np.int64))
+        ep = np.full((len(e_df), len(stations), len(rel)), np.nan)
+
+    # stations without data keep their row
+    meta = pd.DataFrame([meta.get(s, {'code': s}) for s in stations])
+    return ep, pd.to_timedelta(rel, unit='ns'), meta
+
+
+def _cadence(t, m_df):
+    """Cadence (s) of a day, from the station metadata if there are
+    fewer than two samples, NaN if neither has it."""
+    dt = coverage.cadence(t)
+    if np.isnan(dt) and 'Time Resolution' in m_df:
+        res = pd.to_numeric(m_df['Time Resolution'], errors='coerce')
+        res = res[np.isfinite(res) & (res > 0)]
+        dt = float(res.min()) if len(res) else np.nan
+    return dt
+
+
+def _extract(ep, rel, step, e_df, epoch, e_pre, e_post, s_idx, component,
+             d, idx, need, dat, t):
+    """Fill ep with the samples of one day nearest the target times."""
+    day_ns = np.int64(86400*10**9)
+    with timing.stage('events', 'extract') as st:
+        for stn in need:
+            col = _column(dat, stn, component)
+            if col is None:
+                continue
+            v = dat[col].to_numpy(dtype=float)
+            ok = ~np.isnan(v)
+            t_s, v = t[ok], v[ok]
+            if not len(t_s):
+                continue
+            sel = np.array([i for i in idx if stn in e_df['stations'].iloc[i]])
+            # nearest sample to each target time
+            tgt = epoch[sel, None] + rel[None, :]
+            j = np.clip(np.searchsorted(t_s, tgt), 1, len(t_s)-1)
+            j -= (tgt - t_s[j-1]) < (t_s[j] - tgt)
+            use = ((np.abs(t_s[j] - tgt) <= step//2)
+                   & (rel[None, :] >= -e_pre[sel, None])
+                   & (rel[None, :] <= e_post[sel, None])
+                   & (tgt >= d*day_ns) & (tgt < (d+1)*day_ns))
+            out = ep[sel, s_idx[stn]]
+            out[use] = v[j[use]]
+            ep[sel, s_idx[stn]] = out
+            st.add(rows=int(use.sum()))
+
+
+def _column(dat, stn, component):
+    """Column of a station's component in a loaded frame."""
+    if component is not None:
+        col = stn+'_'+component.upper()
+        return col if col in dat.columns else None
+    cols = [c for c in dat.columns
+            if c.startswith(stn+'_') and not c.endswith('flag')]
+    return cols[0] if cols else None
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable, integrity checked downloads.
+
+Responses are streamed to fn.part and renamed over fn once complete and
+verified, so an interrupted transfer never leaves a truncated file in
+data_dir. An interrupted transfer is resumed with an HTTP Range request
+the next time the file is fetched.
+
+The ETag and Last-Modified headers of every downloaded file are kept in
+the index database. Fetching a file that already exists sends them as
+If-None-Match and If-Modified-Since, a 304 response leaves the file
+untouched.
+
+gzip files are decompressed and CDF files opened before they are
+committed, corrupt downloads are removed.
+
+Example
+-------
+
+status = fetch.fetch('http://data.carisma.ca/FGM/1Hz/2012/01/01/20120101GILL.F01.gz',
+                     '/data/magnetometer/CARISMA/2012/01/01/20120101GILL.F01.gz',
+                     array='carisma')
+
+"""
+
+import email.utils
+import gzip
+import logging
+import os
+import threading
+import zlib
+
+import requests
+import urllib3
+
+from gmag import cache
+from gmag import index
+
+logger = logging.getLogger(__name__)
+
+# default request timeout (s)
+timeout = 30.
+# bytes written at a time
+chunk_size = 2**16
+
+_schema = """
+CREATE TABLE IF NOT EXISTS http (
+    path TEXT PRIMARY KEY,
+    url TEXT,
+    etag TEXT,
+    modified TEXT
+);
+"""
+
+# databases with the http table
+_ready = set()
+
+# one session per thread
+_local = threading.local()
+
+
+def session():
+    """Requests session for this thread, reuses connections between files."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def connect():
+    """Connection to the index database with the http table."""
+    conn = index.connect()
+    if index.db_file not in _ready:
+        with index._lock:
+            conn.executescript(_schema)
+        _ready.add(index.db_file)
+    return conn
+
+
+def validators(fn: str):
+    """Stored ETag and Last-Modified of a file.
+
+    Parameters
+    ----------
+    fn : str
+        File name, or partial file name
+
+    Returns
+    -------
+    tuple
+        (etag, modified), either may be None
+    """
+    row = connect().execute('SELECT etag, modified FROM http WHERE path = ?',
+                            (os.path.normpath(fn),)).fetchone()
+    return row if row is not None else (None, None)
+
+
+def _store(fn, url, etag, modified):
+    conn = connect()
+    with index._lock:
+        conn.execute('INSERT OR REPLACE INTO http VALUES (?,?,?,?)',
+                     (os.path.normpath(fn), url, etag, modified))
+        conn.commit()
+
+
+def _forget(fn):
+    conn = connect()
+    with index._lock:
+        conn.execute('DELETE FROM http WHERE path = ?', (os.path.normpath(fn),))
+        conn.commit()
+
+
+def _discard(part):
+    """Remove a partial file, if still there, and its validators."""
+    try:
+        os.remove(part)
+    except FileNotFoundError:
+        pass
+    _forget(part)
+
+
+def request_headers(fn: str,
+                    resume: bool = True):
+    """Conditional and range headers for a request of fn.
+
+    Parameters
+    ----------
+    fn : str
+        Local file name
+    resume : bool, optional
+        Resume a partial download, by default True
+
+    Returns
+    -------
+    tuple
+        (headers, offset), offset is the size of the partial file resumed
+        or 0
+    """
+    part = fn + '.part'
+    headers = {}
+    etag, modified = validators(fn)
+    if os.path.exists(fn):
+        # revalidate
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        elif not etag:
+            headers['If-Modified-Since'] = email.utils.formatdate(
+                os.path.getmtime(fn), usegmt=True)
+
+    offset = 0
+    if resume and os.path.exists(part):
+        offset = os.path.getsize(part)
+        p_etag, p_modified = validators(part)
+        if offset and (p_etag or p_modified):
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            # only resume if the file hasn't changed
+            headers['If-Range'] = p_etag or p_modified
+        else:
+            offset = 0
+    return headers, offset
+
+
+def begin(url: str,
+          fn: str,
+          etag: str = None,
+          modified: str = None):
+    """Prepare to write a response to fn.part.
+
+    Parameters
+    ----------
+    url : str
+        Address of the file
+    fn : str
+        Local file name
+    etag, modified : str, optional
+        ETag and Last-Modified of the response, by default None
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+    # validators let an interrupted transfer resume
+    _store(fn + '.part', url, etag, modified)
+
+
+def commit(url: str,
+           fn: str,
+           nbytes: int,
+           length=None,
+           etag: str = None,
+           modified: str = None,
+           array: str = None,
+           check: bool = True):
+    """Check a complete transfer in fn.part and rename it over fn.
+
+    Parameters
+    ----------
+    url : str
+        Address of the file
+    fn : str
+        Local file name
+    nbytes : int
+        Bytes transferred
+    length : str or int, optional
+        Content-Length of the response, by default None
+    etag, modified : str, optional
+        ETag and Last-Modified of the response, by default None
+    array : str, optional
+        Array the file belongs to, added to the index when given, by
+        default None
+    check : bool, optional
+        Verify gzip and CDF files, by default True
+
+    Returns
+    -------
+    tuple
+        (status, bytes transferred) as fetch
+    """
+    part = fn + '.part'
+    # incomplete transfer, keep the partial file
+    if length is not None and nbytes < int(length):
+        logger.warning('Incomplete download {0}: {1} of {2} bytes'.format(url, nbytes, length))
+        return 'partial', nbytes
+
+    if check and not verify(part):
+        _discard(part)
+        return 'corrupt', nbytes
+
+    os.replace(part, fn)
+    _forget(part)
+    _store(fn, url, etag, modified)
+    if array is not None:
+        index.add(array, fn)
+        # kept until the load that downloaded it is done
+        cache.pin(fn)
+        cache.enforce()
+    logger.debug('Downloaded {0}'.format(url))
+
+    return 'downloaded', nbytes
+
+
+def verify(fn: str):
+    """Check a downloaded file can be read.
+
+    gzip files are decompressed in full, checking the CRC and length, and
+    CDF files are opened. Other files are accepted.
+
+    Parameters
+    ----------
+    fn : str
+        File name, the type is taken from the final name with any .part
+        suffix removed
+
+    Returns
+    -------
+    bool
+        True if the file is intact
+    """
+    name = fn[:-5] if fn.endswith('.part') else fn
+    try:
+        if name.endswith('.gz'):
+            with gzip.open(fn, 'rb') as f:
+                while f.read(2**20):
+                    pass
+        elif name.endswith('.cdf'):
+            import cdflib
+            cdf = cdflib.CDF(fn)
+            cdf.cdf_info()
+    except (OSError, EOFError, zlib.error, ValueError) as e:
+        logger.warning('Corrupt download {0}: {1}'.format(os.path.basename(name), e))
+        return False
+    return True
+
+
+def fetch(url: str,
+          fn: str,
+          array: str = None,
+          force: bool = False,
+          resume: bool = True,
+          check: bool = True,
+          limit=None):
+    """Download a file.
+
+    Parameters
+    ----------
+    url : str
+        Address of the file
+    fn : str
+        Local file name
+    array : str, optional
+        Array the file belongs to, the file is added to the index when
+        given, by default None
+    force : bool, optional
+        Revalidate an existing file with the server and download it again
+        if it changed, by default False
+    resume : bool, optional
+        Resume a partial download, by default True
+    check : bool, optional
+        Verify gzip and CDF files before committing, by default True
+    limit : callable, optional
+        Called with the number of bytes in each chunk before it is
+        written, used to cap bandwidth, by default None
+
+    Returns
+    -------
+    tuple
+        (status, bytes transferred), status is 'exists' (not requested),
+        'downloaded', 'not modified', 'missing' (request failed), 'partial'
+        (interrupted, resumed next time) or 'corrupt'
+    """
+    if os.path.exists(fn) and not force:
+        if array is not None:
+            # present but not indexed
+            index.add(array, fn)
+        return 'exists', 0
+
+    part = fn + '.part'
+    headers, offset = request_headers(fn, resume=resume)
+
+    try:
+        resp = session().get(url, headers=headers, stream=True, timeout=timeout)
+    except requests.RequestException as e:
+        logger.warning('Error in request: {0} {1}'.format(e, url))
+        return 'missing', 0
+
+    with resp:
+        if resp.status_code == 304:
+            logger.debug('Not modified {0}'.format(url))
+            return 'not modified', 0
+        if resp.status_code == 416:
+            # partial file is not a prefix of the remote file
+            _discard(part)
+            return fetch(url, fn, array=array, force=force, resume=False,
+                         check=check, limit=limit)
+        if not resp.ok:
+            logger.warning('Error in request: {0} {1}'.format(resp.status_code, url))
+            return 'missing', 0
+
+        etag = resp.headers.get('ETag')
+        modified = resp.headers.get('Last-Modified')
+        if resp.status_code == 206:
+            mode = 'ab'
+            logger.debug('Resuming {0} at {1} bytes'.format(url, offset))
+        else:
+            mode = 'wb'
+        begin(url, fn, etag, modified)
+
+        nbytes = 0
+        try:
+            with open(part, mode) as f:
+                # raw bytes, ranges refer to the encoded content
+                for b in resp.raw.stream(chunk_size, decode_content=False):
+                    if limit is not None:
+                        limit(len(b))
+                    f.write(b)
+                    nbytes += len(b)
+        except (requests.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+            logger.warning('Interrupted download {0}: {1}'.format(url, e))
+            return 'partial', nbytes
+
+    return commit(url, fn, nbytes, resp.headers.get('Content-Length'), etag, modified,
+                  array=array, check=check)
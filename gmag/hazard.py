@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+Geoelectric hazard statistics over long intervals of magnetometer data.
+
+Years of data are streamed through load -> clean -> rotate -> calcE in
+blocks of days and reduced to a fixed size set of statistics for every
+station; the running maximum, a histogram of daily peak |E|, the number
+of samples exceeding thresholds and annual maxima from which return
+levels are estimated.
+
+Example
+-------
+
+Statistics for three CARISMA stations, two workers, checkpointing so the
+run can be resumed
+stats = hazard.run('carisma', site=['GILL','ISLL','PINA'], years=range(2008,2020),
+                   workers=2, checkpoint='carisma_hazard.npz')
+hazard.summary(stats, periods=[10,100])
+
+Notes
+-----
+    Electric fields are derived with efield.calcE_array using the nearest
+    resistivity model to each station (efield.nearest_res). The 1-D
+    impedance makes |E| independent of the horizontal coordinate system
+    so X, Y is used when available and H, D otherwise.
+
+    |E| is in mV/km.
+
+"""
+
+import importlib
+import os
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from gmag import cache
+from gmag import efield
+from gmag import utils
+
+
+def new_stats(site: list,
+              bins: np.ndarray,
+              thresholds: np.ndarray):
+    """Empty set of hazard statistics.
+
+    Parameters
+    ----------
+    site : list
+        Station codes
+    bins : np.ndarray
+        Histogram bin edges for daily peak |E| (mV/km)
+    thresholds : np.ndarray
+        |E| thresholds (mV/km) to count exceedances for
+
+    Returns
+    -------
+    dict
+        Hazard statistics, arrays are stations x ...
+    """
+    nstn = len(site)
+    return {'site': [stn.upper() for stn in site],
+            'bins': np.asarray(bins, dtype=float),
+            'thresholds': np.asarray(thresholds, dtype=float),
+            'years': [],
+            'count': np.zeros(nstn, dtype=np.int64),
+            'max': np.full(nstn, np.nan),
+            'hist': np.zeros((nstn, len(bins)-1), dtype=np.int64),
+            'exceed': np.zeros((nstn, len(thresholds)), dtype=np.int64),
+            'annual_max': {}}
+
+
+def merge(stats: dict,
+          y_stats: dict):
+    """Merge the statistics from a year into stats, in place.
+
+    Parameters
+    ----------
+    stats : dict
+        Accumulated hazard statistics
+    y_stats : dict
+        Hazard statistics for a single year from year_stats
+
+    Returns
+    -------
+    dict
+        stats
+    """
+    stats['count'] += y_stats['count']
+    stats['max'] = np.fmax(stats['max'], y_stats['max'])
+    stats['hist'] += y_stats['hist']
+    stats['exceed'] += y_stats['exceed']
+    for yr, ymax in y_stats['annual_max'].items():
+        stats['annual_max'][yr] = ymax
+    stats['years'] = sorted(set(stats['years']) | set(y_stats['years']))
+
+    return stats
+
+
+def accumulate(stats: dict,
+               t: np.ndarray,
+               e_mag: np.ndarray,
+               year: int):
+    """Add |E| for a block of data to stats, in place.
+
+    Parameters
+    ----------
+    stats : dict
+        Hazard statistics
+    t : np.ndarray
+        Sample times, datetime64[ns]
+    e_mag : np.ndarray
+        |E| (mV/km), samples x stations, NaN where invalid
+    year : int
+        Year the block belongs to
+    """
+    if e_mag.size == 0:
+        return
+
+    good = np.isfinite(e_mag)
+    stats['count'] += good.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        b_max = np.where(good.any(axis=0), np.nanmax(np.where(good, e_mag, -np.inf), axis=0), np.nan)
+        stats['exceed'] += (e_mag[:, :, np.newaxis] >
+                            stats['thresholds'][np.newaxis, np.newaxis, :]).sum(axis=0)
+    stats['max'] = np.fmax(stats['max'], b_max)
+    a_max = stats['annual_max'].get(year, np.full(e_mag.shape[1], np.nan))
+    stats['annual_max'][year] = np.fmax(a_max, b_max)
+
+    # daily peaks, data is sorted so each day is a
+    # contiguous run of samples
+    day = t.astype('datetime64[D]').astype(np.int64)
+    start = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    d_max = np.fmax.reduceat(np.where(good, e_mag, np.nan), start, axis=0)
+    for i in range(e_mag.shape[1]):
+        peak = d_max[:, i]
+        peak = peak[np.isfinite(peak)]
+        stats['hist'][i] += np.histogram(peak, bins=stats['bins'])[0]
+
+
+def year_stats(array: str,
+               site: list,
+               year: int,
+               bins: np.ndarray,
+               thresholds: np.ndarray,
+               block: int = 5,
+               stn_map: dict | None = None,
+               max_gap: int | None = 60,
+               load_kw: dict | None = None):
+    """Hazard statistics for a single year.
+
+    The year is loaded in blocks of days, each block is gap filled,
+    detrended and converted to |E|.
+
+    Parameters
+    ----------
+    array : str
+        gmag.arrays module to load data with, e.g. 'carisma'
+    site : list
+        Station codes
+    year : int
+        Year to process
+    bins : np.ndarray
+        Histogram bin edges for daily peak |E| (mV/km)
+    thresholds : np.ndarray
+        |E| thresholds (mV/km) to count exceedances for
+    block : int, optional
+        Number of days loaded at a time, by default 5
+    stn_map : dict | None, optional
+        Station -> resistivity model, by default None which uses
+        efield.nearest_res
+    max_gap : int | None, optional
+        Longest gap, in samples, to interpolate across, by default 60
+    load_kw : dict | None, optional
+        Additional keywords for the load function, by default None
+
+    Returns
+    -------
+    dict
+        Hazard statistics for the year
+    """
+    mod = importlib.import_module('gmag.arrays.'+array.lower())
+    site = [stn.upper() for stn in site]
+    if stn_map is None:
+        stn_map = efield.nearest_res(site)
+    if load_kw is None:
+        load_kw = {}
+
+    stats = new_stats(site, bins, thresholds)
+    stats['years'] = [year]
+
+    days = pd.date_range(start=f'{year:04d}-01-01', end=f'{year:04d}-12-31', freq='D')
+    for sdate in days[::block]:
+        ndays = min(block, (days[-1]-sdate).days+1)
+        dat = mod.load(site=site, sdate=sdate, ndays=ndays, **load_kw)
+        if dat is None or dat[0] is None or dat[0].empty:
+            continue
+        df = dat[0].sort_index()
+
+        t = df.index.to_numpy(dtype='datetime64[ns]')
+        if t.size < 2:
+            continue
+        dt = np.median(np.diff(t)).astype('timedelta64[ns]').astype(np.int64)/1e9
+
+        bx, by = utils.field_arrays(df, site)
+        bx, by, mask = efield.prep_mag(bx, by, max_gap=max_gap)
+        ex, ey = efield.calcE_array(bx, by, site, dt=dt, stn_map=stn_map)
+        e_mag = np.hypot(ex, ey)
+        e_mag[mask] = np.nan
+
+        accumulate(stats, t, e_mag, year)
+
+    return stats
+
+
+def save(stats: dict,
+         fn: str):
+    """Write hazard statistics to a checkpoint file.
+
+    The file is written to a temporary file and renamed so an
+    interrupted write doesn't corrupt an existing checkpoint, and is
+    registered with gmag.cache if it is in data_dir.
+
+    Parameters
+    ----------
+    stats : dict
+        Hazard statistics
+    fn : str
+        Checkpoint file (.npz)
+    """
+    years = sorted(stats['annual_max'])
+    annual = np.array([stats['annual_max'][yr] for yr in years]).reshape(len(years), len(stats['site']))
+
+    tmp = fn+'.tmp.npz'
+    np.savez(tmp, site=np.array(stats['site']), bins=stats['bins'],
+             thresholds=stats['thresholds'], years=np.array(stats['years'], dtype=int),
+             count=stats['count'], max=stats['max'], hist=stats['hist'],
+             exceed=stats['exceed'], annual_years=np.array(years, dtype=int),
+             annual_max=annual)
+    os.replace(tmp, fn)
+    cache.register(fn)
+
+
+def read(fn: str):
+    """Read hazard statistics from a checkpoint file.
+
+    Parameters
+    ----------
+    fn : str
+        Checkpoint file (.npz)
+
+    Returns
+    -------
+    dict
+        Hazard statistics
+    """
+    with np.load(fn) as f:
+        stats = new_stats(list(f['site']), f['bins'], f['thresholds'])
+        stats['years'] = [int(yr) for yr in f['years']]
+        stats['count'] = f['count']
+        stats['max'] = f['max']
+        stats['hist'] = f['hist']
+        stats['exceed'] = f['exceed']
+        stats['annual_max'] = {int(yr): amax for yr, amax in zip(f['annual_years'], f['annual_max'])}
+
+    return stats
+
+
+def run(array: str = 'carisma',
+        site: list = ('GILL',),
+        years=(2010,),
+        bins=None,
+        thresholds=(10, 100, 1000),
+        block: int = 5,
+        workers: int = 1,
+        checkpoint: str | None = None,
+        stn_map: dict | None = None,
+        max_gap: int | None = 60,
+        load_kw: dict | None = None):
+    """Accumulate geoelectric hazard statistics over many years.
+
+    Parameters
+    ----------
+    array : str, optional
+        gmag.arrays module to load data with, by default 'carisma'
+    site : list, optional
+        Station codes, by default ('GILL',)
+    years : iterable, optional
+        Years to process, by default (2010,)
+    bins : array like, optional
+        Histogram bin edges for daily peak |E| (mV/km), by default None
+        which uses 61 logarithmic bins from 0.01 to 10000 mV/km
+    thresholds : list, optional
+        |E| thresholds (mV/km) to count exceedances for, by default (10, 100, 1000)
+    block : int, optional
+        Number of days loaded at a time by each worker, by default 5
+    workers : int, optional
+        Number of years processed in parallel, by default 1
+    checkpoint : str | None, optional
+        File to save statistics to after each year. If it exists, years
+        already in the file are skipped, by default None
+    stn_map : dict | None, optional
+        Station -> resistivity model, by default None which uses
+        efield.nearest_res
+    max_gap : int | None, optional
+        Longest gap, in samples, to interpolate across, by default 60
+    load_kw : dict | None, optional
+        Additional keywords for the load function, by default None
+
+    Returns
+    -------
+    dict
+        Hazard statistics
+    """
+    if type(site) is str:
+        site = [site]
+    site = [stn.upper() for stn in site]
+    if bins is None:
+        bins = np.logspace(-2, 4, 61)
+    if stn_map is None:
+        stn_map = efield.nearest_res(site)
+
+    stats = None
+    if checkpoint is not None and os.path.exists(checkpoint):
+        stats = read(checkpoint)
+        if stats['site'] != site or \
+           not np.array_equal(stats['bins'], np.asarray(bins, dtype=float)) or \
+           not np.array_equal(stats['thresholds'], np.asarray(thresholds, dtype=float)):
+            raise ValueError(f'Checkpoint {checkpoint} does not match the requested statistics')
+    if stats is None:
+        stats = new_stats(site, bins, thresholds)
+
+    todo = [yr for yr in years if yr not in stats['years']]
+    args = (stats['bins'], stats['thresholds'], block, stn_map, max_gap, load_kw)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(year_stats, array, site, yr, *args) for yr in todo]
+            for fut in as_completed(futures):
+                merge(stats, fut.result())
+                if checkpoint is not None:
+                    save(stats, checkpoint)
+    else:
+        for yr in todo:
+            merge(stats, year_stats(array, site, yr, *args))
+            if checkpoint is not None:
+                save(stats, checkpoint)
+
+    return stats
+
+
+def return_levels(stats: dict,
+                  periods=(10, 100)):
+    """Return levels of |E| from annual maxima.
+
+    A Gumbel distribution is fit to the annual maxima of each
+    station using the method of moments.
+
+    Parameters
+    ----------
+    stats : dict
+        Hazard statistics
+    periods : list, optional
+        Return periods in years, by default (10, 100)
+
+    Returns
+    -------
+    np.ndarray
+        Return levels (mV/km), stations x periods. NaN for stations
+        with fewer then two years of data.
+    """
+    years = sorted(stats['annual_max'])
+    if not years:
+        return np.full((len(stats['site']), len(periods)), np.nan)
+    amax = np.array([stats['annual_max'][yr] for yr in years])
+
+    n = np.isfinite(amax).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(amax, axis=0)/n
+        std = np.sqrt(np.nansum((amax-mean)**2, axis=0)/(n-1))
+    beta = np.sqrt(6)*std/np.pi
+    mu = mean - np.euler_gamma*beta
+
+    y = -np.log(-np.log(1-1/np.asarray(periods, dtype=float)))
+    levels = mu[:, np.newaxis] + beta[:, np.newaxis]*y[np.newaxis, :]
+    levels[n < 2, :] = np.nan
+
+    return levels
+
+
+def summary(stats: dict,
+            periods=(10, 100)):
+    """Per station summary of hazard statistics.
+
+    Parameters
+    ----------
+    stats : dict
+        Hazard statistics
+    periods : list, optional
+        Return periods in years, by default (10, 100)
+
+    Returns
+    -------
+    pd.DataFrame
+        Sample count, maximum |E|, exceedances and return levels for
+        each station
+    """
+    s_df = pd.DataFrame({'count': stats['count'], 'max': stats['max']},
+                        index=pd.Index(stats['site'], name='code'))
+    for i, thr in enumerate(stats['thresholds']):
+        s_df[f'exceed_{thr:g}'] = stats['exceed'][:, i]
+    levels = return_levels(stats, periods=periods)
+    for i, per in enumerate(periods):
+        s_df[f'return_{per:g}yr'] = levels[:, i]
+
+    return s_df
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Local index of the magnetometer files in data_dir.
+
+Checking availability file by file costs one or more metadata calls per
+station-day, which is slow on network file systems. Instead the files
+present for each array are recorded in a small SQLite database with the
+station, date, size, modification time and a checksum. The index is
+updated as files are downloaded and is consulted by the loaders in place
+of os.path.exists.
+
+The first time an array is queried in a session, and it has no entries,
+its directory is scanned once to build the index. When a loader requests
+files the index doesn't have, the array is rescanned, at most once every
+rescan seconds, so files copied into data_dir by hand are found without
+a metadata call per missing file. scan() updates the index for a whole
+array at any time.
+
+Example
+-------
+
+Which CARISMA stations have data in January 2012
+avail = index.availability('carisma', ['GILL','ISLL'], '2012-01-01', ndays=31)
+
+Rebuild the index after copying files into data_dir
+index.scan('carisma')
+
+Attributes
+----------
+db_file : str
+    Location of the index, by default data_dir/gmag_index.sqlite
+enabled : bool
+    Use the index in the loaders, when False the loaders check the
+    file system directly, by default True
+rescan : float
+    Minimum time (s) between rescans of an array for requested files
+    missing from the index, None to never rescan, by default 600
+
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import gmag
+
+logger = logging.getLogger(__name__)
+
+db_file = os.path.join(gmag.config_set['data_dir'], 'gmag_index.sqlite')
+enabled = True
+rescan = 600.
+
+# file names for each array, groups are station and date
+# IMAGE files contain every station
+patterns = {'carisma': re.compile(r'^(?P<date>\d{8})(?P<site>[A-Z0-9]+)\.F01(\.gz)?$'),
+            'canopus': re.compile(r'^(?P<date>\d{8})(?P<site>[A-Z0-9]+)\.MAG(\.gz)?$'),
+            'image': re.compile(r'^image(?P<date>\d{8})\d{2}\.col2(\.gz)?$'),
+            'themis': re.compile(r'^thg_l2_mag_(?P<site>[a-z0-9]+)_(?P<date>\d{8})_v\d+\.cdf$')}
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    array TEXT NOT NULL,
+    site TEXT NOT NULL,
+    date TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    checksum TEXT
+);
+CREATE INDEX IF NOT EXISTS files_array_date ON files (array, site, date);
+"""
+
+_conn = {}
+_lock = threading.Lock()
+# arrays scanned this session, (db_file, array): time
+_scanned = {}
+
+
+def connect():
+    """Connection to the index, created if it doesn't exist.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Shared between threads, writes are serialised with a lock
+    """
+    conn = _conn.get(db_file)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        with _lock:
+            conn.executescript(_schema)
+        _conn[db_file] = conn
+    return conn
+
+
+def close():
+    """Close every open connection to the index."""
+    with _lock:
+        for conn in _conn.values():
+            conn.close()
+        _conn.clear()
+        _scanned.clear()
+
+
+def checksum(fn: str,
+             block: int = 2**20):
+    """SHA-256 checksum of a file.
+
+    Parameters
+    ----------
+    fn : str
+        File name
+    block : int, optional
+        Bytes read at a time, by default 2**20
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for b in iter(lambda: f.read(block), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def parse_name(array: str,
+               fname: str):
+    """Station and date of a file from its name.
+
+    Parameters
+    ----------
+    array : str
+        Array, e.g. 'carisma'
+    fname : str
+        File name without directory
+
+    Returns
+    -------
+    tuple or None
+        (site, 'YYYY-MM-DD'), site is '' for IMAGE, None if the name
+        isn't a file for the array
+    """
+    m = patterns[array.lower()].match(fname)
+    if m is None:
+        return None
+    d = m.group('date')
+    site = m.groupdict().get('site') or ''
+    return site.upper(), f'{d[0:4]}-{d[4:6]}-{d[6:8]}'
+
+
+def _row(array, fn, check=True):
+    """Index row for a file, None if the file can't be indexed."""
+    name = parse_name(array, os.path.basename(fn))
+    if name is None:
+        return None
+    st = os.stat(fn)
+    return (os.path.normpath(fn), array.lower(), name[0], name[1],
+            st.st_size, st.st_mtime, checksum(fn) if check else None)
+
+
+def add(array: str,
+        fn: str,
+        check: bool = True):
+    """Add or update a file in the index.
+
+    Parameters
+    ----------
+    array : str
+        Array the file belongs to
+    fn : str
+        File name including directory
+    check : bool, optional
+        Store a checksum of the file, by default True
+    """
+    try:
+        row = _row(array, fn, check=check)
+    except OSError:
+        remove(fn)
+        return
+    if row is None:
+        logger.debug('Not indexed, unrecognised file name {0}'.format(fn))
+        return
+    conn = connect()
+    with _lock:
+        conn.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)', row)
+        conn.commit()
+
+
+def remove(fn: str):
+    """Remove a file from the index.
+
+    Parameters
+    ----------
+    fn : str
+        File name including directory
+    """
+    conn = connect()
+    with _lock:
+        conn.execute('DELETE FROM files WHERE path = ?', (os.path.normpath(fn),))
+        conn.commit()
+
+
+def scan(array: str | list = ['carisma', 'canopus', 'image', 'themis'],
+         check: bool = True):
+    """Walk the data directory of each array and update the index.
+
+    Files whose size and modification time are unchanged keep their
+    checksum, files that no longer exist are removed.
+
+    Parameters
+    ----------
+    array : str | list, optional
+        Array or arrays to scan, by default every array
+    check : bool, optional
+        Store checksums of new and changed files, by default True
+
+    Returns
+    -------
+    int
+        Files in the index for the scanned arrays
+    """
+    if type(array) is str:
+        array = [array]
+
+    conn = connect()
+    n = 0
+    for arr in array:
+        arr = arr.lower()
+        local_dir = importlib.import_module('gmag.arrays.'+arr).local_dir
+
+        old = {p: (s, m, c) for p, s, m, c in
+               conn.execute('SELECT path, size, mtime, checksum FROM files WHERE array = ?', (arr,))}
+        rows = []
+        for root, dirs, files in os.walk(local_dir):
+            for fnm in files:
+                name = parse_name(arr, fnm)
+                if name is None:
+                    continue
+                fn = os.path.normpath(os.path.join(root, fnm))
+                st = os.stat(fn)
+                prev = old.pop(fn, None)
+                if prev is not None and prev[0] == st.st_size and prev[1] == st.st_mtime:
+                    chk = prev[2]
+                else:
+                    chk = checksum(fn) if check else None
+                rows.append((fn, arr, name[0], name[1], st.st_size, st.st_mtime, chk))
+
+        with _lock:
+            conn.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)', rows)
+            conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in old])
+            conn.commit()
+        _scanned[(db_file, arr)] = time.monotonic()
+        logger.info('Indexed {0} {1} files'.format(len(rows), arr.upper()))
+        n += len(rows)
+
+    return n
+
+
+def _ensure(array):
+    """Scan an array once per session if it has no entries."""
+    if (db_file, array) in _scanned:
+        return
+    conn = connect()
+    if conn.execute('SELECT 1 FROM files WHERE array = ? LIMIT 1', (array,)).fetchone() is None:
+        scan(array)
+    # not scanned yet, the first miss rescans
+    _scanned.setdefault((db_file, array), -np.inf)
+
+
+def present(array: str,
+            f_df: pd.DataFrame):
+    """Which files in a file list are present.
+
+    Parameters
+    ----------
+    array : str
+        Array the files belong to
+    f_df : DataFrame
+        File list from the array's list_files, with dir and fname columns
+
+    Returns
+    -------
+    np.ndarray
+        Boolean, True for every row of f_df that is present. If files
+        are missing from the index and the array hasn't been scanned in
+        the last rescan seconds it is rescanned.
+    """
+    if f_df.empty:
+        return np.zeros(0, dtype=bool)
+    paths = [os.path.normpath(os.path.join(d, f)) for d, f in zip(f_df['dir'], f_df['fname'])]
+    if not enabled:
+        return np.array([os.path.exists(p) for p in paths], dtype=bool)
+
+    array = array.lower()
+    _ensure(array)
+    dates = pd.to_datetime(f_df['date'])
+    sql = 'SELECT path FROM files WHERE array = ? AND date BETWEEN ? AND ?'
+    par = (array, f'{dates.min():%Y-%m-%d}', f'{dates.max():%Y-%m-%d}')
+    have = {r[0] for r in connect().execute(sql, par)}
+    # files copied into data_dir since the last scan
+    if rescan is not None and not have.issuperset(paths):
+        if time.monotonic() - _scanned[(db_file, array)] >= rescan:
+            scan(array)
+            have = {r[0] for r in connect().execute(sql, par)}
+    return np.array([p in have for p in paths], dtype=bool)
+
+
+def files(array: str,
+          site: str | list = None,
+          sdate=None,
+          ndays: int = 1,
+          edate=None):
+    """Indexed files for an array.
+
+    Parameters
+    ----------
+    array : str
+        Array, e.g. 'carisma'
+    site : str | list, optional
+        Station or stations, by default None for every station
+    sdate : str or datetime-like, optional
+        First day, by default None for every day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+
+    Returns
+    -------
+    DataFrame
+        One row per file with path, array, site, date, size (bytes),
+        mtime (unix time) and checksum
+    """
+    array = array.lower()
+    _ensure(array)
+
+    sql = 'SELECT * FROM files WHERE array = ?'
+    par = [array]
+    if sdate is not None:
+        sdate = pd.to_datetime(sdate)
+        edate = pd.to_datetime(edate) if edate is not None else sdate + pd.Timedelta(days=ndays-1)
+        sql += ' AND date BETWEEN ? AND ?'
+        par += [f'{sdate:%Y-%m-%d}', f'{edate:%Y-%m-%d}']
+    if site is not None and array != 'image':
+        if type(site) is str:
+            site = [site]
+        sql += ' AND site IN ({0})'.format(','.join('?'*len(site)))
+        par += [s.upper() for s in site]
+    sql += ' ORDER BY site, date'
+
+    f_df = pd.read_sql_query(sql, connect(), params=par)
+    f_df['date'] = pd.to_datetime(f_df['date'])
+    return f_df
+
+
+def availability(array: str,
+                 site: str | list,
+                 sdate,
+                 ndays: int = 1,
+                 edate=None):
+    """Days with data for each station, from the index.
+
+    Parameters
+    ----------
+    array : str
+        Array, e.g. 'carisma'
+    site : str | list
+        Station or stations
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+
+    Returns
+    -------
+    DataFrame
+        Boolean, indexed by date with a column for each station. For
+        IMAGE every station shares the daily file.
+    """
+    if type(site) is str:
+        site = [site]
+    site = [s.upper() for s in site]
+    if edate is not None:
+        dates = pd.date_range(start=sdate, end=edate, freq='D')
+    else:
+        dates = pd.date_range(start=sdate, periods=ndays, freq='D')
+
+    f_df = files(array, site, sdate=dates[0], edate=dates[-1])
+    avail = pd.DataFrame(False, index=dates, columns=site)
+    avail.index.name = 'date'
+    for stn in site:
+        if array.lower() == 'image':
+            days = f_df['date']
+        else:
+            days = f_df.loc[f_df['site'] == stn, 'date']
+        avail.loc[avail.index.isin(days), stn] = True
+
+    return avail
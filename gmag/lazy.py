@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy xarray datasets backed by Dask.
+
+dataset() describes an array's files for a set of stations and a date
+range as an xarray.Dataset with dimensions (time, station, component).
+Nothing is read until the data is computed, each Dask chunk reads one
+station-day with the array's load and places it on a regular time grid
+at the array's nominal cadence. Station metadata are coordinates along
+station, so reductions run out-of-core and in parallel, e.g.
+
+Example
+-------
+
+ds, meta = carisma.load(['GILL','ISLL'], '2012-01-01', ndays=365, output='dataset')
+dbdt = abs(ds['B'].diff('time')).sel(component='X')
+daily = dbdt.resample(time='1D').max().compute()
+
+Requires xarray and dask (pip install gmag[lazy]).
+
+Attributes
+----------
+layouts : dict
+    Nominal cadence (s), components and dtype of each array
+
+"""
+
+import importlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from gmag import index
+from gmag import utils
+
+logger = logging.getLogger(__name__)
+
+layouts = {'carisma': (1., ['X', 'Y', 'Z', 'H', 'D'], np.float64),
+           'canopus': (5., ['X', 'Y', 'Z', 'H', 'D'], np.float64),
+           'image': (10., ['X', 'Y', 'Z', 'H', 'D'], np.float64),
+           'themis': (0.5, ['H', 'D', 'Z'], np.float32)}
+
+
+def has_xarray():
+    """True if xarray and dask are installed."""
+    try:
+        import dask.array  # noqa: F401
+        import xarray  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def grid(df: pd.DataFrame,
+         day: pd.Timestamp,
+         n: int,
+         cadence: float,
+         comps: list,
+         dtype=np.float64):
+    """Place a station's samples on a day's regular time grid.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Station data indexed by time with a column per component
+    day : pd.Timestamp
+        Start of the grid
+    n : int
+        Samples in the grid
+    cadence : float
+        Grid spacing (s)
+    comps : list
+        Components, missing components are NaN
+    dtype : np.dtype, optional
+        dtype of the grid, by default np.float64
+
+    Returns
+    -------
+    np.ndarray
+        n x components, samples more than half a step from a grid
+        point are dropped
+    """
+    out = np.full((n, len(comps)), np.nan, dtype=dtype)
+    if df is None or df.empty:
+        return out
+    step = np.int64(round(cadence*1e9))
+    off = df.index.asi8 - day.value
+    i = (off + step//2)//step
+    ok = (i >= 0) & (i < n) & (np.abs(off - i*step) <= step//2)
+    for k, c in enumerate(comps):
+        if c in df.columns:
+            out[i[ok], k] = df[c].to_numpy(dtype=dtype)[ok]
+    return out
+
+
+def _read(array, site, day, n, cadence, comps, dtype, kwargs):
+    """Read one chunk, samples x stations x components."""
+    mod = importlib.import_module('gmag.arrays.'+array)
+    res = mod.load(site, day, ndays=1, dl=False, output='dict', **kwargs)
+    out = np.full((n, len(site), len(comps)), np.nan, dtype=dtype)
+    if res is None or not res[0]:
+        return out
+    for j, stn in enumerate(site):
+        out[:, j, :] = grid(res[0].get(stn), day, n, cadence, comps, dtype=dtype)
+    return out
+
+
+def meta(array: str,
+         site: list,
+         sdate,
+         edate=None,
+         cadence: float = None):
+    """Station metadata without reading data files.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'canopus', 'image' or 'themis'
+    site : list
+        Stations
+    sdate : str or datetime-like
+        First day, the station coordinates are for its year
+    edate : str or datetime-like, optional
+        Last day, THEMIS attributes are read from the first file in
+        the range, by default None for sdate only
+    cadence : float, optional
+        Time Resolution, by default the array's nominal cadence
+
+    Returns
+    -------
+    DataFrame
+        One row per station in the order of site
+    """
+    array = array.lower()
+    mod = importlib.import_module('gmag.arrays.'+array)
+    stn_vals = utils.load_station_coor(param='ALL', year=pd.to_datetime(sdate).year)
+    if stn_vals is None:
+        stn_vals = utils.load_station_geo(param='ALL')
+
+    rows = []
+    for stn in site:
+        stn_dat = stn_vals[stn_vals['code'] == stn].reset_index(drop=True)
+        if stn_dat.empty:
+            stn_dat = pd.DataFrame({'code': [stn]})
+        rows.append(stn_dat.iloc[:1])
+    m_df = pd.concat(rows, axis=0, sort=False, ignore_index=True)
+    m_df['Time Resolution'] = layouts[array][0] if cadence is None else cadence
+
+    if array == 'themis':
+        # global attributes of each station's first file
+        import cdflib
+        pi, pi_i = [], []
+        for stn in site:
+            f_df = index.files('themis', stn, sdate, edate=edate)
+            attrs = {}
+            if len(f_df):
+                attrs = mod.file_attrs(cdflib.CDF(f_df['path'].iloc[0]), stn)
+            pi.append(attrs.get('pi'))
+            pi_i.append(attrs.get('pi_i'))
+        m_df['PI'] = pi
+        m_df['Institution'] = pi_i
+    else:
+        m_df['PI'] = mod.pi
+        m_df['Institution'] = mod.pi_i
+
+    return m_df
+
+
+def dataset(array: str,
+            site,
+            sdate,
+            ndays: int = 1,
+            edate=None,
+            dl: bool = True,
+            force: bool = False,
+            progress=None,
+            cadence: float = None,
+            **kwargs):
+    """Lazy dataset of an array's stations.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'canopus', 'image' or 'themis'
+    site : str | list
+        Station or stations
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    dl : bool, optional
+        Download missing files before building the dataset, by default True
+    force : bool, optional
+        Revalidate existing files, by default False
+    progress : callable, optional
+        Called after every file downloaded, see gmag.utils.Progress, by
+        default None
+    cadence : float, optional
+        Spacing of the time grid (s), by default the array's nominal
+        cadence, see layouts
+    kwargs : dict, optional
+        Passed to the array's load when a chunk is read, e.g. gz=False
+
+    Returns
+    -------
+    ds : xarray.Dataset
+        Variable B (nT) with dimensions (time, station, component),
+        chunked per station-day (per day for IMAGE, whose files hold
+        every station), and the station metadata as coordinates along
+        station
+    meta : DataFrame
+        Station metadata
+    """
+    if not has_xarray():
+        raise ImportError('output=\'dataset\' requires xarray and dask, pip install gmag[lazy]')
+    import dask.array as da
+    import xarray as xr
+
+    from gmag import sync
+
+    array = array.lower()
+    if type(site) is str:
+        site = [site]
+    site = [s.upper() for s in site]
+    step, comps, dtype = layouts[array]
+    step = step if cadence is None else cadence
+
+    if edate is not None:
+        days = pd.date_range(start=pd.to_datetime(sdate).normalize(),
+                             end=pd.to_datetime(edate).normalize(), freq='D')
+    else:
+        days = pd.date_range(start=pd.to_datetime(sdate).normalize(), periods=ndays, freq='D')
+
+    if dl and array in sync.arrays:
+        sync.sync(array, site, days[0], edate=days[-1], gz=kwargs.get('gz', True),
+                  force=force, progress=progress)
+
+    n = int(round(86400/step))
+    # IMAGE files hold every station, read each day once
+    group = [site] if array == 'image' else [[s] for s in site]
+
+    def block(block_id=None):
+        d, g = block_id[0], block_id[1]
+        return _read(array, group[g], days[d], n, step, comps, dtype, kwargs)
+
+    b = da.map_blocks(block, dtype=dtype, meta=np.array((), dtype=dtype),
+                      chunks=((n,)*len(days), tuple(len(g) for g in group), (len(comps),)),
+                      name='gmag-{0}-{1}'.format(array, _token(array, site, days, step, kwargs)))
+
+    time = (days[0] + pd.to_timedelta(np.arange(n*len(days))*step, unit='s'))
+    m_df = meta(array, site, days[0], edate=days[-1], cadence=step)
+    coords = {'time': time, 'station': site, 'component': comps}
+    for c in m_df.columns:
+        if c == 'code':
+            continue
+        coords[c.lower().replace(' ', '_')] = ('station', m_df[c].to_numpy())
+
+    ds = xr.Dataset({'B': (('time', 'station', 'component'), b, {'units': 'nT'})},
+                    coords=coords, attrs={'array': array.upper()})
+    return ds, m_df
+
+
+def _token(*args):
+    """Deterministic name for a dataset's Dask graph."""
+    from dask.base import tokenize
+    return tokenize(*args)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Per sample magnetic local time and CGM coordinates.
+
+The station tables give each station's MLT at 0 UT (mlt_ut) for every
+year, so MLT at any time is mlt_ut plus the UT hour, modulo 24. mlt()
+evaluates this for samples x stations in one broadcast operation, using
+the table of the year of each sample, and attach() adds the result to
+loader output in any layout. CGM latitude, longitude and L-shell come
+from the same tables.
+
+Example
+-------
+
+dat, meta = carisma.load(['GILL','ISLL'], '2012-01-01', ndays=2, mlt=True)
+dat['GILL_MLT']
+
+Add to data already loaded
+dat = magcoords.attach(dat, meta, cgm=True)
+
+Attributes
+----------
+cgm_columns : list
+    Station table columns attached with cgm=True
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from gmag import utils
+
+logger = logging.getLogger(__name__)
+
+cgm_columns = ['cgm_latitude', 'cgm_longitude', 'lshell']
+
+_day = np.int64(86400*10**9)
+
+
+def hours(t):
+    """UT hour of times.
+
+    Parameters
+    ----------
+    t : DatetimeIndex or np.ndarray
+        Times, datetime64 or int64 nanoseconds
+
+    Returns
+    -------
+    np.ndarray
+        Hours since the start of the day
+    """
+    if isinstance(t, np.ndarray) and t.dtype.kind != 'M':
+        ns = t
+    else:
+        ns = pd.DatetimeIndex(t).asi8
+    return (ns % _day)/3.6e12
+
+
+def table(site: list,
+          years,
+          columns: list,
+          meta: pd.DataFrame = None):
+    """Station table values for each year.
+
+    Parameters
+    ----------
+    site : list
+        Stations
+    years : list
+        Years
+    columns : list
+        Station table columns, e.g. ['mlt_ut']
+    meta : DataFrame, optional
+        Loader metadata, used for years without a station table, by
+        default None
+
+    Returns
+    -------
+    np.ndarray
+        years x stations x columns, NaN if unknown
+    """
+    site = [s.upper() for s in site]
+    out = np.full((len(years), len(site), len(columns)), np.nan)
+    fallback = None
+    if meta is not None and len(meta):
+        fallback = meta.assign(code=meta['code'].astype(str).str.upper()).drop_duplicates('code')
+        fallback = fallback.set_index('code').reindex(site)
+    for i, yr in enumerate(years):
+        stn = utils.load_station_coor(param='ALL', year=int(yr))
+        if stn is not None:
+            stn = stn.drop_duplicates('code').set_index('code').reindex(site)
+        elif fallback is not None:
+            logger.debug('No station table for {0}, using the metadata'.format(yr))
+            stn = fallback
+        else:
+            continue
+        for k, c in enumerate(columns):
+            if c in stn.columns:
+                out[i, :, k] = stn[c].to_numpy(dtype=float)
+    return out
+
+
+def _years(t):
+    """Years spanned by times and the year index of each time."""
+    t = pd.DatetimeIndex(t)
+    if not len(t):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    y0, y1 = t.min().year, t.max().year
+    years = np.arange(y0, y1+1)
+    if len(years) == 1:
+        return years, np.zeros(len(t), dtype=int)
+    edges = pd.DatetimeIndex([f'{y}-01-01' for y in years[1:]]).asi8
+    return years, np.searchsorted(edges, t.asi8, side='right')
+
+
+def mlt(t,
+        site: list,
+        meta: pd.DataFrame = None,
+        cgm: bool = False):
+    """MLT of every sample of every station.
+
+    Parameters
+    ----------
+    t : DatetimeIndex
+        Sample times
+    site : list
+        Stations
+    meta : DataFrame, optional
+        Loader metadata, used for years without a station table, by
+        default None
+    cgm : bool, optional
+        Also return CGM latitude, longitude and L-shell, by default False
+
+    Returns
+    -------
+    dict
+        MLT (hours) and with cgm the cgm_columns, each samples x
+        stations float32
+    """
+    t = pd.DatetimeIndex(t)
+    years, yi = _years(t)
+    columns = ['mlt_ut'] + (cgm_columns if cgm else [])
+    vals = table(site, years, columns, meta=meta)
+
+    out = {'MLT': np.mod(vals[yi, :, 0] + hours(t)[:, None], 24.).astype(np.float32)}
+    for k, c in enumerate(columns[1:], start=1):
+        out[c] = vals[yi, :, k].astype(np.float32)
+    return out
+
+
+def _values(t, site, meta=None, cgm=False, keep=None):
+    """(name, samples x stations) pairs of mlt output in keep."""
+    return [(c, v) for c, v in mlt(t, site, meta=meta, cgm=cgm).items()
+            if keep is None or c in keep]
+
+
+def attach(dat,
+           meta: pd.DataFrame,
+           mlt: bool = True,
+           cgm: bool = False):
+    """Add MLT and CGM coordinates to loader output.
+
+    Parameters
+    ----------
+    dat : DataFrame, dict or xarray.Dataset
+        Output of a load function in any layout
+    meta : DataFrame
+        Station metadata
+    mlt : bool, optional
+        Add MLT, by default True
+    cgm : bool, optional
+        Add CGM latitude, longitude and L-shell, by default False
+
+    Returns
+    -------
+    DataFrame, dict or xarray.Dataset
+        dat with STN_MLT (wide), MLT (long and dict) or an mlt
+        (time, station) coordinate (dataset) and the cgm_columns named
+        the same way, a dataset already has them as station coordinates
+    """
+    if dat is None or meta is None or not (mlt or cgm):
+        return dat
+    site = [str(s).upper() for s in meta['code']]
+    # columns added
+    keep = (['MLT'] if mlt else []) + (cgm_columns if cgm else [])
+
+    if isinstance(dat, dict):
+        for stn, df in dat.items():
+            for c, v in _values(df.index, [stn], meta=meta, cgm=cgm, keep=keep):
+                df[c] = v[:, 0]
+        return dat
+
+    if isinstance(dat, pd.DataFrame):
+        if isinstance(dat.index, pd.MultiIndex):
+            # long, map each row to its station
+            stn = dat.index.get_level_values('station')
+            codes = pd.Index(site).get_indexer(stn)
+            t = dat.index.get_level_values('t')
+            for c, v in _values(t, site, meta=meta, cgm=cgm, keep=keep):
+                x = v[np.arange(len(t)), np.clip(codes, 0, None)]
+                x[codes < 0] = np.nan
+                dat[c] = x
+            return dat
+        site = [s for s in site if any(c.startswith(s+'_') for c in dat.columns)]
+        new = {}
+        for c, v in _values(dat.index, site, meta=meta, cgm=cgm, keep=keep):
+            for j, s in enumerate(site):
+                new[s+'_'+c] = v[:, j]
+        return pd.concat([dat, pd.DataFrame(new, index=dat.index)], axis=1)
+
+    # xarray dataset, MLT evaluated lazily with the data's time chunks,
+    # CGM coordinates are already station coordinates
+    if not mlt:
+        return dat
+    import dask.array as da
+
+    site = [str(s).upper() for s in dat['station'].values]
+    t = dat['time'].to_index()
+    years, yi = _years(t)
+    vals = table(site, years, ['mlt_ut'], meta=meta)[:, :, 0]
+    chunks = dat['B'].chunks[0] if dat['B'].chunks else (len(t),)
+    h = da.from_array(hours(t), chunks=(chunks,))
+    y = da.from_array(yi, chunks=(chunks,))
+    v = da.map_blocks(lambda yb: vals[yb], y, dtype=float, new_axis=1,
+                      chunks=(chunks, (len(site),)))
+    m = da.mod(v + h[:, None], 24.).astype(np.float32)
+    return dat.assign_coords(mlt=(('time', 'station'), m))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Day by day loading with background read ahead.
+
+Prefetch walks through a date range one day at a time. While the caller
+processes the current day the following days are downloaded and parsed
+in background threads and held in a bounded buffer, so a pipeline is
+limited by its own processing rather than by I/O.
+
+The buffer holds at most ahead days and stops reading ahead while the
+days waiting to be consumed use more than max_bytes. Closing the
+iterator, or leaving its with block, cancels the days not yet started.
+
+Example
+-------
+
+with prefetch.Prefetch('carisma', ['GILL','ISLL'], '2012-01-01', ndays=31, ahead=3) as days:
+    for date, dat, meta in days:
+        process(dat)
+
+"""
+
+import importlib
+import logging
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from gmag import utils
+
+logger = logging.getLogger(__name__)
+
+
+def nbytes(res):
+    """Memory used by a loaded day (bytes)."""
+    if res is None:
+        return 0
+    # dict layout, a DataFrame per station
+    frames = [f for x in res for f in (x.values() if isinstance(x, dict) else [x])]
+    return int(sum(df.memory_usage(deep=False).sum() for df in frames
+                   if isinstance(df, pd.DataFrame)))
+
+
+class Prefetch:
+    """Iterate over days of data, loading upcoming days in the background.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'canopus', 'image' or 'themis'
+    site : str | list
+        Station or stations loaded each day
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    ahead : int, optional
+        Days loaded ahead of the caller, by default 2
+    workers : int, optional
+        Threads loading days, by default 1
+    max_bytes : float or str, optional
+        Stop reading ahead while buffered days use more than this, e.g.
+        '2G', by default None for no cap
+    kwargs : dict, optional
+        Passed to the array's load, e.g. dl=False
+
+    Yields
+    ------
+    tuple
+        (date, data, meta), data and meta are None for days without data
+
+    Attributes
+    ----------
+    wait : float
+        Time (s) the caller spent waiting for data
+    """
+
+    def __init__(self, array, site, sdate, ndays=1, edate=None,
+                 ahead=2, workers=1, max_bytes=None, **kwargs):
+        self.load = importlib.import_module('gmag.arrays.'+array.lower()).load
+        self.site = site
+        self.kwargs = kwargs
+        if edate is not None:
+            self.dates = deque(pd.date_range(start=sdate, end=edate, freq='D'))
+        else:
+            self.dates = deque(pd.date_range(start=sdate, periods=ndays, freq='D'))
+        self.ahead = max(1, ahead)
+        self.max_bytes = utils.parse_size(max_bytes)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                       thread_name_prefix='gmag-prefetch')
+        self.pending = deque()
+        self.closed = False
+        self.wait = 0.
+        # size of the last day loaded
+        self.estimate = None
+        self.fill()
+
+    def _load(self, date):
+        res = self.load(self.site, date, ndays=1, **self.kwargs)
+        if res is None or res[0] is None:
+            res = (None, None)
+        size = nbytes(res)
+        self.estimate = size
+        return res, size
+
+    def buffered(self):
+        """Bytes held by days waiting to be consumed.
+
+        Days still loading are counted at the size of the last day loaded.
+        """
+        size = 0
+        for d, f in self.pending:
+            if f.done() and not f.cancelled() and f.exception() is None:
+                size += f.result()[1]
+            else:
+                size += self.estimate or 0
+        return size
+
+    def fill(self):
+        """Start loading days until the buffer is full."""
+        while (not self.closed and self.dates and len(self.pending) < self.ahead
+               and (self.max_bytes is None or not self.pending
+                    or (self.estimate is not None and self.buffered() < self.max_bytes))):
+            date = self.dates.popleft()
+            self.pending.append((date, self.pool.submit(self._load, date)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        self.fill()
+        if not self.pending:
+            self.close()
+            raise StopIteration
+
+        date, fut = self.pending.popleft()
+        t0 = time.perf_counter()
+        try:
+            (dat, meta), size = fut.result()
+        except BaseException:
+            self.close()
+            raise
+        self.wait += time.perf_counter() - t0
+        # start the next day before handing this one over
+        self.fill()
+        return date, dat, meta
+
+    def close(self):
+        """Cancel days not yet started, days being loaded are discarded."""
+        if self.closed:
+            return
+        self.closed = True
+        n = sum(fut.cancel() for date, fut in self.pending)
+        if n:
+            logger.debug('Cancelled {0} days'.format(n))
+        self.pending.clear()
+        self.dates.clear()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+Rule based quality control of magnetometer data.
+
+check() runs a list of rules over an array of samples x stations x
+components in one vectorized pass and returns a bitmask with a bit per
+rule for every sample of every station. clean() does the same for a
+loader DataFrame and sets flagged samples to NaN, clean_frames() for a
+DataFrame per station without joining them on time. The loaders call
+them once over every station in place of per-array cleaning, with the
+rules for each array in rules.
+
+Rules are dictionaries with a rule name and its parameters
+
+sentinel  value (a missing value or list of them) and/or above, any
+          component equal to value or above above. With scope 'value'
+          clean() sets only those values to NaN, not the whole sample
+flag      good, the flag column differs from good
+range     component, min and/or max, the component is outside [min, max]
+spike     window, nmad and floor, residual from a rolling median larger
+          than nmad robust standard deviations (MAD) and floor (nT)
+step      window, nmad and floor, a jump between samples larger than nmad
+          robust standard deviations of the differences and floor (nT)
+          that persists for window samples
+
+Example
+-------
+
+Also remove spikes when loading CARISMA
+qc.rules['carisma'].append({'rule': 'spike', 'window': 11, 'nmad': 10})
+
+Bitmask of an array, samples x stations
+mask = qc.check(b, rules=[{'rule': 'range', 'component': 'Z', 'min': 0},
+                          {'rule': 'step'}], components=['X', 'Y', 'Z'])
+steps = mask & qc.STEP != 0
+
+Attributes
+----------
+SENTINEL, FLAG, RANGE, SPIKE, STEP : int
+    Bits of the mask set by each rule
+BAD : int
+    Bits clean() sets to NaN by default, every rule but step
+rules : dict
+    Rules run by each array's loader
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+SENTINEL = 1
+FLAG = 2
+RANGE = 4
+SPIKE = 8
+STEP = 16
+BAD = SENTINEL | FLAG | RANGE | SPIKE
+
+bits = {'sentinel': SENTINEL, 'flag': FLAG, 'range': RANGE, 'spike': SPIKE, 'step': STEP}
+
+rules = {'carisma': [{'rule': 'flag', 'good': '.'},
+                     {'rule': 'range', 'component': 'Z', 'min': 0}],
+         'canopus': [{'rule': 'flag', 'good': '.'},
+                     {'rule': 'range', 'component': 'Z', 'min': 0},
+                     {'rule': 'sentinel', 'above': 99999}],
+         'image': [{'rule': 'sentinel', 'value': 99999.9, 'scope': 'value'}],
+         'themis': []}
+
+# samples processed at a time by the rolling rules
+_block = 2**16
+
+
+def sentinel(b: np.ndarray,
+             value=None,
+             above: float = None):
+    """Samples where any component is a missing value.
+
+    Parameters
+    ----------
+    b : np.ndarray
+        samples x stations x components
+    value : float or list, optional
+        Missing values, by default None
+    above : float, optional
+        Values above this are missing, by default None
+
+    Returns
+    -------
+    np.ndarray
+        samples x stations, True if missing
+    """
+    return _missing(b, value=value, above=above).any(axis=2)
+
+
+def _missing(b, value=None, above=None):
+    """Values equal to value or above above, the shape of b."""
+    bad = np.zeros(b.shape, dtype=bool)
+    if value is not None:
+        for v in np.atleast_1d(value):
+            bad |= b == v
+    if above is not None:
+        with np.errstate(invalid='ignore'):
+            bad |= b > above
+    return bad
+
+
+def flags(flag: np.ndarray,
+          good='.'):
+    """Samples whose flag is not good.
+
+    Parameters
+    ----------
+    flag : np.ndarray
+        samples x stations
+    good : str, optional
+        Flag of good samples, by default '.'
+
+    Returns
+    -------
+    np.ndarray
+        samples x stations, True if flagged
+    """
+    return flag != good
+
+
+def limits(v: np.ndarray,
+           min: float = None,
+           max: float = None):
+    """Samples outside [min, max].
+
+    Parameters
+    ----------
+    v : np.ndarray
+        samples x stations, one component
+    min, max : float, optional
+        Limits, by default None
+
+    Returns
+    -------
+    np.ndarray
+        samples x stations, True if outside
+    """
+    bad = np.zeros(v.shape, dtype=bool)
+    if min is not None:
+        bad |= v < min
+    if max is not None:
+        bad |= v > max
+    return bad
+
+
+def _rolling_median(b, window):
+    """Centred rolling median along samples, edges padded."""
+    h = window//2
+    out = np.empty_like(b, dtype=float)
+    p = np.pad(b, [(h, h)] + [(0, 0)]*(b.ndim-1), mode='edge')
+    for i0 in range(0, b.shape[0], _block):
+        i1 = min(i0 + _block, b.shape[0])
+        w = sliding_window_view(p[i0:i1+2*h], window, axis=0)
+        out[i0:i1] = np.median(w, axis=-1)
+    return out
+
+
+def _mad(x, axis=0):
+    """Robust standard deviation, 1.4826 times the median absolute deviation."""
+    with np.errstate(invalid='ignore'):
+        med = np.nanmedian(x, axis=axis, keepdims=True)
+        return 1.4826*np.nanmedian(np.abs(x - med), axis=axis)
+
+
+def spikes(b: np.ndarray,
+           window: int = 11,
+           nmad: float = 10.,
+           floor: float = 1.):
+    """Samples departing from a rolling median.
+
+    Parameters
+    ----------
+    b : np.ndarray
+        samples x stations x components
+    window : int, optional
+        Samples in the rolling median, by default 11
+    nmad : float, optional
+        Threshold in robust standard deviations of the residuals, by
+        default 10
+    floor : float, optional
+        Smallest residual flagged (nT), by default 1
+
+    Returns
+    -------
+    np.ndarray
+        samples x stations, True if any component spikes
+    """
+    if b.shape[0] < window:
+        return np.zeros(b.shape[:2], dtype=bool)
+    r = np.abs(b - _rolling_median(b, window))
+    with np.errstate(invalid='ignore'):
+        s = 1.4826*np.nanmedian(r, axis=0)
+    with np.errstate(invalid='ignore'):
+        return ((r > nmad*s) & (r > floor)).any(axis=2)
+
+
+def steps(b: np.ndarray,
+          window: int = 60,
+          nmad: float = 10.,
+          floor: float = 5.):
+    """Samples following a persistent jump.
+
+    Parameters
+    ----------
+    b : np.ndarray
+        samples x stations x components
+    window : int, optional
+        Samples either side of a jump compared, by default 60
+    nmad : float, optional
+        Threshold in robust standard deviations of the first
+        differences, by default 10
+    floor : float, optional
+        Smallest jump flagged (nT), by default 5
+
+    Returns
+    -------
+    np.ndarray
+        samples x stations, True at the first sample after a step
+    """
+    bad = np.zeros(b.shape[:2], dtype=bool)
+    n = b.shape[0]
+    if n < 2*window + 1:
+        return bad
+    dx = np.diff(b, axis=0)
+    s = _mad(dx)
+    with np.errstate(invalid='ignore'):
+        cand = (np.abs(dx) > nmad*s) & (np.abs(dx) > floor)
+    # jumps with room for a window either side
+    i, j, k = np.nonzero(cand)
+    keep = (i >= window-1) & (i + window < n)
+    i, j, k = i[keep], j[keep], k[keep]
+    if not len(i):
+        return bad
+
+    off = np.arange(window)
+    pre = np.median(b[i[:, None] - off[::-1], j[:, None], k[:, None]], axis=1)
+    post = np.median(b[i[:, None] + 1 + off, j[:, None], k[:, None]], axis=1)
+    # a spike returns, a step stays
+    step = np.abs(post - pre) > 0.5*np.abs(dx[i, j, k])
+    bad[i[step]+1, j[step]] = True
+    return bad
+
+
+def check(b: np.ndarray,
+          flag: np.ndarray = None,
+          rules: list = (),
+          components: list = ('X', 'Y', 'Z')):
+    """Run rules over every station at once.
+
+    Parameters
+    ----------
+    b : np.ndarray
+        samples x stations x components, or samples x components for a
+        single station
+    flag : np.ndarray, optional
+        Flags, samples x stations, by default None
+    rules : list, optional
+        Rules, see the module docstring, by default ()
+    components : list, optional
+        Names of the components, by default ('X', 'Y', 'Z')
+
+    Returns
+    -------
+    np.ndarray
+        uint8 bitmask, samples x stations (samples for a single
+        station), see SENTINEL, FLAG, RANGE, SPIKE and STEP
+    """
+    single = b.ndim == 2
+    b = np.asarray(b, dtype=float)
+    if single:
+        b = b[:, None, :]
+        flag = flag[:, None] if flag is not None else None
+    components = [c.upper() for c in components]
+
+    mask = np.zeros(b.shape[:2], dtype=np.uint8)
+    for rule in rules:
+        par = {k: v for k, v in rule.items() if k not in ('rule', 'scope')}
+        name = rule['rule']
+        if name == 'sentinel':
+            bad = sentinel(b, **par)
+        elif name == 'flag':
+            if flag is None:
+                continue
+            bad = flags(flag, **par)
+        elif name == 'range':
+            c = par.pop('component').upper()
+            if c not in components:
+                continue
+            bad = limits(b[:, :, components.index(c)], **par)
+        elif name == 'spike':
+            bad = spikes(b, **par)
+        elif name == 'step':
+            bad = steps(b, **par)
+        else:
+            raise ValueError('Unknown rule {0!r}, use one of {1}'.format(name, list(bits)))
+        mask[bad] |= bits[name]
+
+    return mask[:, 0] if single else mask
+
+
+def array_rules(array: str = None):
+    """Rules run by an array's loader, [] if array is None."""
+    if array is None:
+        return []
+    return rules.get(array.lower(), [])
+
+
+def clean(df: pd.DataFrame,
+          array: str = None,
+          rules: list = None,
+          bad: int = BAD):
+    """Set samples failing quality control to NaN.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Loader data with STN_component and optional STN_flag columns,
+        every station is checked in one pass
+    array : str, optional
+        Array whose rules are run, by default None
+    rules : list, optional
+        Rules, overrides array, by default None
+    bad : int, optional
+        Bits set to NaN, by default BAD
+
+    Returns
+    -------
+    df : DataFrame
+        Cleaned data, the components of a flagged sample are NaN
+    mask : DataFrame
+        uint8 bitmask with a column per station, no columns if there
+        are no rules
+    """
+    if rules is None:
+        rules = array_rules(array)
+    if not len(rules):
+        return df, pd.DataFrame(index=df.index)
+
+    # STN_component columns, grouped by station
+    cols = [c for c in df.columns if '_' in c and not c.endswith('_flag')]
+    site = list(dict.fromkeys(c.split('_')[0] for c in cols))
+    comps = list(dict.fromkeys(c.split('_', 1)[1] for c in cols))
+    cols = [[s+'_'+c for c in comps] for s in site]
+    if not site or any(c not in df.columns for s_c in cols for c in s_c):
+        return df, pd.DataFrame(index=df.index)
+
+    b = np.stack([df[c].to_numpy(dtype=float) for c in cols], axis=1)
+    flag = None
+    if all(s+'_flag' in df.columns for s in site):
+        flag = np.stack([df[s+'_flag'].to_numpy() for s in site], axis=1)
+
+    # sentinels replaced value by value
+    by_value = [r for r in rules if r['rule'] == 'sentinel' and r.get('scope') == 'value']
+    mask = check(b, flag=flag, rules=[r for r in rules if r not in by_value], components=comps)
+    drop = np.zeros(b.shape, dtype=bool)
+    drop[(mask & bad) != 0] = True
+    for r in by_value:
+        miss = _missing(b, value=r.get('value'), above=r.get('above'))
+        mask[miss.any(axis=2)] |= SENTINEL
+        if bad & SENTINEL:
+            drop |= miss
+    if drop.any():
+        b[drop] = np.nan
+        for j, s_c in enumerate(cols):
+            for k, c in enumerate(s_c):
+                # float columns keep their precision, others become float64
+                dtype = df[c].dtype if df[c].dtype.kind == 'f' else np.float64
+                df[c] = b[:, j, k].astype(dtype, copy=False)
+
+    return df, pd.DataFrame(mask, index=df.index, columns=site)
+
+
+def clean_frames(frames: dict,
+                 array: str = None,
+                 rules: list = None,
+                 bad: int = BAD):
+    """Clean station DataFrames with their own time indexes.
+
+    Stations are never joined on time. Stations sharing a time index are
+    checked together in one pass, the others one at a time.
+
+    Parameters
+    ----------
+    frames : dict
+        Station: DataFrame with STN_component and optional STN_flag
+        columns
+    array, rules, bad : optional
+        As for clean
+
+    Returns
+    -------
+    frames : dict
+        Station: cleaned DataFrame on its own time index
+    mask : dict
+        Station: bitmask DataFrame on its own time index, as for clean
+    """
+    # stations with the same time index and columns
+    groups = {}
+    for stn, df in frames.items():
+        idx = df.index
+        key = (len(idx), tuple(sorted(c.split('_', 1)[-1] for c in df.columns)))
+        if len(idx):
+            key += (idx[0], idx[-1])
+        for g in groups.setdefault(key, []):
+            if frames[g[0]].index.equals(idx):
+                g.append(stn)
+                break
+        else:
+            groups[key].append([stn])
+
+    out = {}
+    masks = {}
+    for g in (g for key in groups.values() for g in key):
+        df = frames[g[0]].copy() if len(g) == 1 else pd.concat([frames[stn] for stn in g], axis=1)
+        df, mask = clean(df, array=array, rules=rules, bad=bad)
+        for stn in g:
+            out[stn] = df[frames[stn].columns]
+            masks[stn] = mask[[c for c in mask.columns if c == stn]]
+    return {stn: out[stn] for stn in frames}, {stn: masks[stn] for stn in frames}
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+Batched Welch spectra and ULF band power for magnetometer arrays.
+
+Samples are placed on a regular grid aligned to the epoch and cut into
+tapered segments of nperseg samples starting every nperseg - noverlap
+grid points. The periodograms of every segment of every station are
+computed with one rfft per block of segments and averaged within time
+windows, e.g. an hour, so a day of an array is a handful of FFT calls
+rather than a SciPy call per station and window. A segment containing
+missing samples is skipped for that station only.
+
+Stream carries the unfinished segment and open windows between chunks,
+so a long range can be processed a day at a time, e.g. from
+gmag.prefetch.Prefetch, with the same result as a single call to welch.
+
+The taper, frequencies and scaling of each segment length are built
+once and cached, see plan.
+
+Example
+-------
+
+dat, meta = carisma.load(['GILL','ISLL'], '2012-01-01')
+t, bx, site = spectral.components(dat, 'X')
+tw, f, psd, n = spectral.welch(t, bx, nperseg=1800, width=3600)
+pc5 = spectral.band_power(f, psd, 'Pc5')
+
+Years of data, a day at a time
+st = spectral.Stream(nperseg=1800, width=86400)
+with prefetch.Prefetch('carisma', site, '2012-01-01', ndays=365) as days:
+    for date, dat, meta in days:
+        t, bx, _ = spectral.components(dat, 'X', site=site)
+        res = st.update(t, bx)
+res = st.flush()
+
+Notes
+-----
+    PSD are one sided densities (nT^2/Hz) and band power is in nT^2.
+
+Attributes
+----------
+bands : dict
+    Frequency range (Hz) of the ULF bands
+tapers : dict
+    Taper of each window name
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from gmag import cadence
+from gmag import dbdt
+
+bands = {'Pc3': (1/45, 1/10),
+         'Pc4': (1/150, 1/45),
+         'Pc5': (1/600, 1/150)}
+
+tapers = {'hann': lambda k, n: 0.5 - 0.5*np.cos(2*np.pi*k/n),
+          'hamming': lambda k, n: 0.54 - 0.46*np.cos(2*np.pi*k/n),
+          'boxcar': lambda k, n: np.ones(len(k))}
+
+# cached plans, (nperseg, dt, window): Plan
+_plans = {}
+# samples x stations transformed at a time
+_block = 2**22
+
+
+class Plan:
+    """Taper, frequencies and scaling of a segment length.
+
+    Parameters
+    ----------
+    n : int
+        Samples in a segment
+    dt : float
+        Sample spacing (s)
+    window : str, optional
+        Taper, see tapers, by default 'hann'
+    """
+
+    def __init__(self, n, dt, window='hann'):
+        if window not in tapers:
+            raise ValueError('Unknown window {0!r}, use one of {1}'.format(window, list(tapers)))
+        self.n = int(n)
+        self.dt = float(dt)
+        self.window = window
+        # periodic taper, as for spectral estimation
+        self.taper = tapers[window](np.arange(self.n), self.n)
+        self.freqs = np.fft.rfftfreq(self.n, d=self.dt)
+        # one sided density, DC and Nyquist are not doubled
+        self.scale = np.full(len(self.freqs), 2*self.dt/np.sum(self.taper**2))
+        self.scale[0] /= 2
+        if self.n % 2 == 0:
+            self.scale[-1] /= 2
+
+    def __repr__(self):
+        return 'Plan(n={0}, dt={1}s, window={2!r})'.format(self.n, self.dt, self.window)
+
+    def periodograms(self, seg, detrend=True):
+        """Periodograms of segments.
+
+        Parameters
+        ----------
+        seg : np.ndarray
+            ... x n, segments without missing samples
+        detrend : bool, optional
+            Remove the mean of each segment, by default True
+
+        Returns
+        -------
+        np.ndarray
+            ... x freqs
+        """
+        if detrend:
+            seg = seg - seg.mean(axis=-1, keepdims=True)
+        spec = np.fft.rfft(seg*self.taper, axis=-1)
+        return (spec.real**2 + spec.imag**2)*self.scale
+
+
+def plan(n: int,
+         dt: float,
+         window: str = 'hann'):
+    """Cached Plan of a segment length.
+
+    Parameters
+    ----------
+    n : int
+        Samples in a segment
+    dt : float
+        Sample spacing (s)
+    window : str, optional
+        Taper, see tapers, by default 'hann'
+
+    Returns
+    -------
+    Plan
+        Built on first use
+    """
+    key = (int(n), float(dt), window)
+    p = _plans.get(key)
+    if p is None:
+        p = _plans[key] = Plan(n, dt, window=window)
+    return p
+
+
+def grid(t,
+         dat,
+         dt: float):
+    """Place samples on a regular grid aligned to the epoch.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, samples x stations
+    dt : float
+        Grid spacing (s)
+
+    Returns
+    -------
+    tuple
+        Grid index of the first row (multiples of dt from the epoch) and
+        the gridded data, NaN where there is no sample. Samples more than
+        half a step from a grid point are dropped.
+    """
+    t = dbdt.time_ns(t)
+    dat = np.asarray(dat, dtype=float)
+    step = np.int64(round(dt*1e9))
+    g = (t + step//2)//step
+    ok = np.abs(t - g*step) <= step//2
+    if not ok.any():
+        return 0, np.empty((0, dat.shape[1]))
+    g, dat = g[ok], dat[ok]
+    x = np.full((int(g[-1] - g[0]) + 1, dat.shape[1]), np.nan)
+    x[g - g[0]] = dat
+    return int(g[0]), x
+
+
+def components(dat,
+               component: str = 'X',
+               site: list = None):
+    """One component of every station from loader output.
+
+    Parameters
+    ----------
+    dat : DataFrame or dict
+        Output of a load function, wide, long or dict layout
+    component : str, optional
+        Component, e.g. 'X', 'H' or 'Z', by default 'X'
+    site : list, optional
+        Stations, the column order of the returned array, by default
+        None for every station with the component
+
+    Returns
+    -------
+    tuple
+        Times (DatetimeIndex), data (samples x stations, NaN for stations
+        without data) and the stations
+    """
+    component = component.upper()
+    if dat is None:
+        return pd.DatetimeIndex([]), np.empty((0, len(site or []))), list(site or [])
+    if isinstance(dat, dict):
+        df = pd.DataFrame({stn: f[component] for stn, f in dat.items() if component in f.columns})
+    elif isinstance(dat.index, pd.MultiIndex):
+        df = dat[component].unstack('station') if component in dat.columns else pd.DataFrame()
+    else:
+        cols = [c for c in dat.columns if c.endswith('_'+component)]
+        df = dat[cols].rename(columns=lambda c: c.rsplit('_', 1)[0])
+    if site is None:
+        site = list(df.columns)
+    site = [s.upper() for s in site]
+    df = df.reindex(columns=site)
+    return pd.DatetimeIndex(df.index), df.to_numpy(dtype=float), site
+
+
+class Stream:
+    """Incremental Welch spectra over time windows.
+
+    Data is passed in consecutive, time ordered chunks. The samples of
+    the unfinished segment and the windows still receiving segments are
+    carried between chunks, so the results match welch on the full
+    series. Segments crossing the end of a window are not used.
+
+    Parameters
+    ----------
+    nperseg : int
+        Samples in a segment
+    noverlap : int, optional
+        Samples shared by consecutive segments, by default nperseg//2
+    dt : float, optional
+        Sample spacing (s), by default None for the cadence of the first
+        chunk
+    width : float, optional
+        Window length (s), windows are aligned to multiples of width
+        from the epoch, by default None for a single window
+    window : str, optional
+        Taper, see tapers, by default 'hann'
+    detrend : bool, optional
+        Remove the mean of each segment, by default True
+    """
+
+    def __init__(self,
+                 nperseg: int,
+                 noverlap: int = None,
+                 dt: float = None,
+                 width: float = None,
+                 window: str = 'hann',
+                 detrend: bool = True):
+        self.n = int(nperseg)
+        noverlap = self.n//2 if noverlap is None else int(noverlap)
+        self.step = self.n - noverlap
+        if self.step < 1 or noverlap < 0:
+            raise ValueError('noverlap must be between 0 and nperseg-1')
+        if window not in tapers:
+            raise ValueError('Unknown window {0!r}, use one of {1}'.format(window, list(tapers)))
+        self.dt = dt
+        self.width = width
+        self.window = window
+        self.detrend = detrend
+
+        # grid index of the first carried sample and the samples
+        self.g0 = None
+        self.tail = None
+        # grid index after the last sample
+        self.end = None
+        # window index: [sum of periodograms, segments], stations x freqs
+        self.acc = {}
+        # start of the first segment (ns) for a single window
+        self.t0 = None
+        self.ncol = None
+
+    @property
+    def plan(self):
+        """Plan of the segments, None until the cadence is known."""
+        return None if self.dt is None else plan(self.n, self.dt, self.window)
+
+    def _empty(self):
+        ncol = self.ncol or 0
+        nf = self.n//2 + 1
+        f = self.plan.freqs if self.dt is not None else np.empty(0)
+        return (np.empty(0, dtype='datetime64[ns]'), f,
+                np.empty((0, ncol, nf)), np.empty((0, ncol), dtype=np.int64))
+
+    def _segments(self, g0, x):
+        """Accumulate the complete segments of gridded data, return the
+        grid index of the first segment not yet complete."""
+        p = self.plan
+        step_ns = int(round(self.dt*1e9))
+        # segments start at multiples of step from the epoch
+        j0 = (-g0) % self.step
+        starts = np.arange(j0, x.shape[0] - self.n + 1, self.step)
+        if not len(starts):
+            return g0 + j0
+        nxt = g0 + starts[-1] + self.step
+        if self.width is not None:
+            # segments within a single window
+            w_ns = int(round(self.width*1e9))
+            w = (g0 + starts)*step_ns//w_ns
+            starts = starts[w == (g0 + starts + self.n - 1)*step_ns//w_ns]
+            if not len(starts):
+                return nxt
+        if self.t0 is None:
+            self.t0 = (g0 + starts[0])*step_ns
+
+        view = sliding_window_view(x, self.n, axis=0)
+        ncol = x.shape[1]
+        per = max(1, _block//(ncol*self.n))
+        for b0 in range(0, len(starts), per):
+            s = starts[b0:b0+per]
+            seg = view[s]
+            bad = np.isnan(seg).any(axis=-1)
+            if bad.any():
+                seg = np.where(bad[..., None], 0., seg)
+            pxx = p.periodograms(seg, detrend=self.detrend)
+            pxx[bad] = 0.
+            cnt = (~bad).astype(np.int64)
+
+            if self.width is None:
+                w = np.zeros(len(s), dtype=np.int64)
+            else:
+                w = (g0 + s)*step_ns//w_ns
+            first = np.flatnonzero(np.r_[True, w[1:] != w[:-1]])
+            w_sum = np.add.reduceat(pxx, first, axis=0)
+            w_cnt = np.add.reduceat(cnt, first, axis=0)
+            for k, wi in enumerate(w[first]):
+                a = self.acc.get(wi)
+                if a is None:
+                    self.acc[wi] = [w_sum[k], w_cnt[k]]
+                else:
+                    a[0] += w_sum[k]
+                    a[1] += w_cnt[k]
+
+        return nxt
+
+    def _emit(self, before=None):
+        """Windows with index below before, all windows if None."""
+        done = sorted(w for w in self.acc if before is None or w < before)
+        if not done:
+            return self._empty()
+        w_sum = np.stack([self.acc[w][0] for w in done])
+        w_cnt = np.stack([self.acc[w][1] for w in done])
+        for w in done:
+            del self.acc[w]
+        t0, self.t0 = self.t0, None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            psd = np.where(w_cnt[..., None] > 0, w_sum/w_cnt[..., None], np.nan)
+        if self.width is None:
+            tw = np.array([t0]).astype('datetime64[ns]')
+        else:
+            tw = (np.array(done, dtype=np.int64)*int(round(self.width*1e9))).astype('datetime64[ns]')
+        return tw, self.plan.freqs, psd, w_cnt
+
+    def update(self, t, dat):
+        """Add a chunk of data.
+
+        Parameters
+        ----------
+        t : DatetimeIndex, datetime64 or int64 array like
+            Sample times, sorted and after any previous chunk
+        dat : array like
+            Data (nT), samples or samples x stations, the same stations
+            in every chunk
+
+        Returns
+        -------
+        tuple
+            Start times, frequencies (Hz), PSD (windows x stations x
+            freqs, nT^2/Hz) and segments averaged (windows x stations) of
+            the windows completed by this chunk
+        """
+        t = dbdt.time_ns(t)
+        dat = np.asarray(dat, dtype=float)
+        if dat.ndim == 1:
+            dat = dat[:, np.newaxis]
+        if self.ncol is None:
+            self.ncol = dat.shape[1]
+        elif dat.shape[1] != self.ncol:
+            raise ValueError('Expected {0} stations, got {1}'.format(self.ncol, dat.shape[1]))
+        if t.size == 0:
+            return self._empty()
+        if self.dt is None:
+            dt = cadence.step(t)
+            if dt <= 0:
+                raise ValueError('Cannot find the cadence of a single sample, set dt')
+            self.dt = dt/1e9
+
+        g0, x = grid(t, dat, self.dt)
+        if not len(x):
+            return self._empty()
+        if self.tail is not None:
+            if g0 < self.end:
+                raise ValueError('Chunks must be in time order')
+            # the carried samples may be empty and start after end
+            gap = g0 - (self.g0 + self.tail.shape[0])
+            if gap < self.n:
+                x = np.vstack([self.tail, np.full((max(gap, 0), x.shape[1]), np.nan),
+                               x[max(-gap, 0):]])
+                g0 = self.g0
+        self.end = g0 + x.shape[0]
+
+        nxt = self._segments(g0, x)
+        self.g0 = nxt
+        self.tail = x[nxt - g0:].copy()
+
+        if self.width is None:
+            return self._empty()
+        step_ns = int(round(self.dt*1e9))
+        return self._emit(before=nxt*step_ns//int(round(self.width*1e9)))
+
+    def flush(self):
+        """Windows not yet returned, including the last one.
+
+        Returns
+        -------
+        tuple
+            Start times, frequencies, PSD and segments as returned by
+            update
+        """
+        self.tail = None
+        self.g0 = None
+        if self.dt is None:
+            return self._empty()
+        return self._emit()
+
+
+def welch(t,
+          dat,
+          nperseg: int,
+          noverlap: int = None,
+          dt: float = None,
+          width: float = None,
+          window: str = 'hann',
+          detrend: bool = True):
+    """Welch PSD of every station in time windows.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data (nT), samples or samples x stations
+    nperseg : int
+        Samples in a segment
+    noverlap : int, optional
+        Samples shared by consecutive segments, by default nperseg//2
+    dt : float, optional
+        Sample spacing (s), by default None for the cadence of t
+    width : float, optional
+        Window length (s), by default None for one window over all data
+    window : str, optional
+        Taper, see tapers, by default 'hann'
+    detrend : bool, optional
+        Remove the mean of each segment, by default True
+
+    Returns
+    -------
+    tuple
+        Window start times (datetime64[ns], the first segment for a single
+        window), frequencies (Hz), PSD (windows x stations x freqs,
+        nT^2/Hz, NaN without complete segments) and the number of
+        segments averaged (windows x stations)
+    """
+    st = Stream(nperseg, noverlap=noverlap, dt=dt, width=width, window=window, detrend=detrend)
+    a = st.update(t, dat)
+    b = st.flush()
+    return (np.concatenate([a[0], b[0]]), b[1],
+            np.concatenate([a[2], b[2]]), np.concatenate([a[3], b[3]]))
+
+
+def band_power(f,
+               psd,
+               band='Pc5'):
+    """Integrate PSD over a frequency band.
+
+    Parameters
+    ----------
+    f : np.ndarray
+        Frequencies (Hz), evenly spaced
+    psd : np.ndarray
+        PSD, frequencies on the last axis
+    band : str or tuple, optional
+        Name in bands or (low, high) Hz, by default 'Pc5'
+
+    Returns
+    -------
+    np.ndarray
+        Band power (nT^2), the shape of psd without the last axis
+    """
+    lo, hi = bands[band] if isinstance(band, str) else band
+    sel = (f >= lo) & (f <= hi)
+    if len(f) < 2 or not sel.any():
+        return np.full(np.shape(psd)[:-1], np.nan)
+    return np.asarray(psd)[..., sel].sum(axis=-1)*(f[1] - f[0])
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Mirror an array into data_dir.
+
+Every file for a set of stations and a date range is downloaded into the
+list_files layout with several transfers at once. Files already in the
+index are skipped without a request, all transfers share an optional
+bandwidth cap and a summary of the transfers is returned.
+
+Also available from the command line, see gmag.cli
+gmag sync carisma --site GILL ISLL --sdate 2012-01-01 --ndays 31 --workers 8
+
+Example
+-------
+
+res = sync.sync('themis', ['KUUJ','GBAY'], '2012-01-01', ndays=31, rate='2M')
+print(sync.report(res))
+
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from gmag import fetch
+from gmag import index
+from gmag import utils
+
+logger = logging.getLogger(__name__)
+
+# arrays that can be downloaded
+arrays = ['carisma', 'image', 'themis']
+
+
+class RateLimit:
+    """Token bucket shared between transfers.
+
+    Parameters
+    ----------
+    rate : float
+        Bytes per second
+    burst : float, optional
+        Bytes that can be sent at once, by default one second at rate
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else self.rate
+        self.tokens = self.burst
+        self.t0 = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, nbytes):
+        """Wait until nbytes can be sent."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.t0)*self.rate)
+            self.t0 = now
+            self.tokens -= nbytes
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+
+
+def parse_rate(rate):
+    """Bytes per second from a number or a string such as '500k' or '2M'.
+
+    Parameters
+    ----------
+    rate : int, float, str or None
+        Rate, k, M and G are powers of 1024
+
+    Returns
+    -------
+    float or None
+        Bytes per second, None for no cap
+    """
+    return utils.parse_size(rate)
+
+
+def jobs(array: str,
+         site: str | list = None,
+         sdate=None,
+         ndays: int = 1,
+         edate=None,
+         gz: bool = True):
+    """Files to mirror.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'image' or 'themis'
+    site : str | list, optional
+        Station or stations, not used for IMAGE, by default None
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    gz : bool, optional
+        Gzipped files (CARISMA and IMAGE), by default True
+
+    Returns
+    -------
+    DataFrame
+        list_files output with site, url and fn columns
+    """
+    array = array.lower()
+    if array not in arrays:
+        raise ValueError('Cannot download {0} data, use one of {1}'.format(array, arrays))
+    mod = importlib.import_module('gmag.arrays.'+array)
+
+    if array == 'image':
+        f_df = mod.list_files(sdate, ndays=ndays, edate=edate, gz=gz)
+        f_df['site'] = ''
+        f_df['url'] = [mod.http_link(d, gz=gz) for d in f_df['date']]
+    else:
+        if site is None:
+            raise ValueError('site is required for {0}'.format(array))
+        if type(site) is str:
+            site = [site]
+        f_l = []
+        for stn in site:
+            if array == 'carisma':
+                s_df = mod.list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+            else:
+                s_df = mod.list_files(stn.upper(), sdate, ndays=ndays, edate=edate)
+            s_df['site'] = stn.upper()
+            f_l.append(s_df)
+        f_df = pd.concat(f_l, ignore_index=True)
+        f_df['url'] = f_df['hdir'] + f_df['fname']
+
+    f_df['fn'] = [os.path.join(d, f) for d, f in zip(f_df['dir'], f_df['fname'])]
+    return f_df
+
+
+def sync(array: str,
+         site: str | list = None,
+         sdate=None,
+         ndays: int = 1,
+         edate=None,
+         gz: bool = True,
+         workers: int = 4,
+         rate=None,
+         force: bool = False,
+         progress=None):
+    """Download every missing file for stations and a date range.
+
+    Parameters
+    ----------
+    array : str
+        'carisma', 'image' or 'themis'
+    site : str | list, optional
+        Station or stations, not used for IMAGE, by default None
+    sdate : str or datetime-like
+        First day
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    gz : bool, optional
+        Gzipped files (CARISMA and IMAGE), by default True
+    workers : int, optional
+        Concurrent transfers, by default 4
+    rate : float or str, optional
+        Bandwidth cap shared by all transfers in bytes per second, or a
+        string such as '2M', by default None
+    force : bool, optional
+        Revalidate files that are already present, only changed files
+        are downloaded again, by default False
+    progress : callable, optional
+        Called after every file, see gmag.utils.Progress, by default None
+
+    Returns
+    -------
+    DataFrame
+        One row per file with site, date, fn, url, status (see
+        gmag.fetch.fetch, 'skipped' if present), bytes and seconds
+    """
+    array = array.lower()
+    f_df = jobs(array, site, sdate, ndays=ndays, edate=edate, gz=gz)
+    have = index.present(array, f_df)
+
+    rate = parse_rate(rate)
+    limit = RateLimit(rate) if rate else None
+    prog = utils.Progress(progress, total=len(f_df))
+    lock = threading.Lock()
+
+    def get(url, fn, fname):
+        t0 = time.perf_counter()
+        try:
+            status, nbytes = fetch.fetch(url, fn, array=array, force=force, limit=limit)
+        except Exception as e:
+            logger.warning('Error downloading {0}: {1}'.format(url, e))
+            status, nbytes = 'error', 0
+        with lock:
+            prog.update('sync', fname, nbytes=nbytes)
+        return status, nbytes, time.perf_counter() - t0
+
+    res = [('skipped', 0, 0.)]*len(f_df)
+    todo = []
+    for i, exists in enumerate(have):
+        if force or not exists:
+            todo.append(i)
+        else:
+            prog.update('sync', f_df['fname'].iloc[i])
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {i: pool.submit(get, f_df['url'].iloc[i], f_df['fn'].iloc[i],
+                                  f_df['fname'].iloc[i]) for i in todo}
+        for i, fut in futures.items():
+            res[i] = fut.result()
+
+    r_df = f_df[['site', 'date', 'fn', 'url']].copy()
+    r_df['status'] = [r[0] for r in res]
+    r_df['bytes'] = [r[1] for r in res]
+    r_df['seconds'] = [r[2] for r in res]
+    r_df.attrs['array'] = array
+    return r_df
+
+
+def report(r_df: pd.DataFrame,
+           elapsed: float = None):
+    """Summary of a sync.
+
+    Parameters
+    ----------
+    r_df : DataFrame
+        Output of sync
+    elapsed : float, optional
+        Wall time of the sync (s), adds the mean transfer rate, by default None
+
+    Returns
+    -------
+    str
+        Files per status, bytes transferred and failed files
+    """
+    lines = ['{0} files, {1}'.format(len(r_df), r_df.attrs.get('array', '').upper()).rstrip(', ')]
+    for status, n in r_df['status'].value_counts().items():
+        lines.append('  {0:<13}{1:>8d}'.format(status, n))
+    nbytes = r_df['bytes'].sum()
+    lines.append('  {0:<13}{1:>8.1f} MB'.format('transferred', nbytes/2**20))
+    if elapsed:
+        lines.append('  {0:<13}{1:>8.1f} s ({2:.2f} MB/s)'.format('elapsed', elapsed, nbytes/2**20/elapsed))
+
+    failed = r_df[r_df['status'].isin(['missing', 'partial', 'corrupt', 'error'])]
+    if len(failed):
+        lines.append('Failed:')
+        lines += ['  {0} {1}'.format(s, u) for s, u in zip(failed['status'], failed['url'])]
+
+    return '\n'.join(lines)
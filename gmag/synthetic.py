@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic magnetometer archives for testing and benchmarking.
+
+Files are written in the formats and directory layouts the array modules
+expect, so the list_files, download and load routines can be exercised
+without access to the CARISMA, IMAGE or THEMIS servers.
+
+- CARISMA: gzipped 1 Hz F01 files, one line header
+- CANOPUS: gzipped 5 s MAG files, 40 line header
+- IMAGE: gzipped 10 s .col2 files with every station for a day
+- THEMIS: 0.5 s thg_l2_mag_*.cdf files
+
+serve() runs a local HTTP server that serves an archive with the URLs of
+the CARISMA, IMAGE and THEMIS servers, supporting Range, ETag and
+If-Modified-Since, so downloads can be tested.
+
+Example
+-------
+
+Point the array modules at a scratch directory and write two days
+synthetic.set_local_dir('/scratch/gmag')
+synthetic.write_carisma(['GILL','ISLL'], '2012-01-01', ndays=2)
+dat, meta = carisma.load(['GILL','ISLL'], '2012-01-01', ndays=2, dl=False)
+
+Serve the archive and download from it into a second directory
+server, urls = synthetic.serve('/scratch/gmag')
+carisma.http_dir = urls['ca_http']
+synthetic.set_local_dir('/scratch/mirror')
+carisma.download('GILL', '2012-01-01', ndays=2)
+server.shutdown()
+
+Notes
+-----
+    The field is a random walk with a diurnal variation around a
+    realistic baseline. A small fraction of samples are flagged or set
+    to the array's missing value so clean() has work to do.
+
+"""
+
+import email.utils
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# baseline X, Y, Z (nT)
+baseline = (12000., -300., 58000.)
+
+
+def set_local_dir(root: str):
+    """Point every array module at a new data directory.
+
+    Parameters
+    ----------
+    root : str
+        Directory that replaces data_dir from gmagrc; files are written
+        to root/magnetometer/ARRAY and indexed in root/gmag_index.sqlite
+    """
+    from gmag import index
+    from gmag.arrays import canopus, carisma, image, themis
+
+    index.db_file = os.path.join(root, 'gmag_index.sqlite')
+
+    for mod, arr in [(carisma, 'CARISMA'), (canopus, 'CANOPUS'),
+                     (image, 'IMAGE'), (themis, 'THEMIS')]:
+        mod.local_dir = os.path.join(root, 'magnetometer', arr)
+        os.makedirs(mod.local_dir, exist_ok=True)
+
+
+def field(t: pd.DatetimeIndex,
+          seed: int = 0,
+          base=baseline):
+    """Synthetic XYZ magnetic field.
+
+    Parameters
+    ----------
+    t : DatetimeIndex
+        Sample times
+    seed : int, optional
+        Random seed, by default 0
+    base : tuple, optional
+        Baseline X, Y, Z (nT), by default baseline
+
+    Returns
+    -------
+    np.ndarray
+        Magnetic field (nT), samples x 3
+    """
+    rng = np.random.default_rng(seed)
+    n = len(t)
+    hrs = (t.hour + t.minute/60. + t.second/3600.).to_numpy()
+    diurnal = 20.*np.sin(2*np.pi*hrs/24.)
+
+    b = rng.standard_normal((n, 3)).cumsum(axis=0)*0.05
+    b += np.asarray(base)[np.newaxis, :]
+    b[:, 0] += diurnal
+    b[:, 1] += 0.5*diurnal
+
+    return b
+
+
+def day_times(date,
+              cadence: float):
+    """Sample times for one day."""
+    date = pd.to_datetime(date).normalize()
+    return pd.date_range(date, periods=int(round(86400/cadence)),
+                         freq=pd.Timedelta(seconds=cadence))
+
+
+def fwf_lines(t: pd.DatetimeIndex,
+              b: np.ndarray,
+              flag: np.ndarray):
+    """Fixed width CARISMA/CANOPUS data lines."""
+    ts = t.strftime('%Y%m%d%H%M%S')
+    return ''.join(f'{s}{x:10.3f}{y:10.3f}{z:10.3f} {f}\n'
+                   for s, (x, y, z), f in zip(ts, b, flag))
+
+
+def open_out(fn: str,
+             gz: bool):
+    """Open a file for writing text, gzipped or not."""
+    if gz:
+        return gzip.open(fn, mode='wt')
+    return open(fn, mode='w')
+
+
+def write_carisma(site: str | list = ['GILL'],
+                  sdate='2012-01-01',
+                  ndays: int = 1,
+                  edate=None,
+                  gz: bool = True,
+                  bad: float = 0.001,
+                  seed: int = 0):
+    """Write synthetic CARISMA F01 files.
+
+    Parameters
+    ----------
+    site : str | list, optional
+        Station or stations, by default ['GILL']
+    sdate : str or datetime-like, optional
+        First day, by default '2012-01-01'
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    gz : bool, optional
+        Gzip files, by default True
+    bad : float, optional
+        Fraction of samples flagged as bad, by default 0.001
+    seed : int, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    list
+        Files written
+    """
+    from gmag import index
+    from gmag.arrays import carisma
+
+    if type(site) is str:
+        site = [site]
+    files = []
+    for i, stn in enumerate(site):
+        f_df = carisma.list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        for j, row in f_df.iterrows():
+            os.makedirs(row['dir'], exist_ok=True)
+            t = day_times(row['date'], 1.)
+            b = field(t, seed=seed+1000*i+j)
+            rng = np.random.default_rng(seed+1000*i+j)
+            flag = np.where(rng.random(len(t)) < bad, 'x', '.')
+
+            fn = os.path.join(row['dir'], row['fname'])
+            with open_out(fn, gz) as f:
+                f.write(f'{stn.upper()} {row["date"]:%Y %m %d} synthetic 1Hz XYZ nT\n')
+                f.write(fwf_lines(t, b, flag))
+            index.add('carisma', fn)
+            files.append(fn)
+
+    return files
+
+
+def write_canopus(site: str | list = ['GILL'],
+                  sdate='2001-01-01',
+                  ndays: int = 1,
+                  edate=None,
+                  gz: bool = True,
+                  bad: float = 0.001,
+                  seed: int = 0):
+    """Write synthetic CANOPUS MAG files.
+
+    Parameters are the same as write_carisma. A fraction bad of samples
+    are set to the 99999.999 missing value.
+
+    Returns
+    -------
+    list
+        Files written
+    """
+    from gmag import index
+    from gmag.arrays import canopus
+
+    if type(site) is str:
+        site = [site]
+    files = []
+    for i, stn in enumerate(site):
+        f_df = canopus.list_files(stn.upper(), sdate, ndays=ndays, edate=edate, gz=gz)
+        for j, row in f_df.iterrows():
+            os.makedirs(row['dir'], exist_ok=True)
+            t = day_times(row['date'], 5.)
+            b = field(t, seed=seed+1000*i+j)
+            rng = np.random.default_rng(seed+1000*i+j)
+            b[rng.random(len(t)) < bad, :] = 99999.999
+            flag = np.full(len(t), '.')
+
+            header = [f'CANOPUS {stn.upper()} {row["date"]:%Y/%m/%d} synthetic 5 s XYZ nT'] + \
+                     [f'# header line {k:02d}' for k in range(2, 41)]
+            fn = os.path.join(row['dir'], row['fname'])
+            with open_out(fn, gz) as f:
+                f.write('\n'.join(header)+'\n')
+                f.write(fwf_lines(t, b, flag))
+            index.add('canopus', fn)
+            files.append(fn)
+
+    return files
+
+
+def write_image(site: str | list = ['AND', 'KEV', 'SOD', 'TRO'],
+                sdate='2012-01-01',
+                ndays: int = 1,
+                edate=None,
+                gz: bool = True,
+                bad: float = 0.001,
+                seed: int = 0):
+    """Write synthetic IMAGE .col2 files, one file per day with every station.
+
+    Parameters are the same as write_carisma. A fraction bad of samples
+    are set to the 99999.9 missing value.
+
+    Returns
+    -------
+    list
+        Files written
+    """
+    from gmag import index
+    from gmag.arrays import image
+
+    if type(site) is str:
+        site = [site]
+    site = [stn.upper() for stn in site]
+    # files hold every station, none without stations
+    if not site:
+        return []
+    f_df = image.list_files(sdate, ndays=ndays, edate=edate, gz=gz)
+
+    files = []
+    for j, row in f_df.iterrows():
+        os.makedirs(row['dir'], exist_ok=True)
+        t = day_times(row['date'], 10.)
+        dat = []
+        for i, stn in enumerate(site):
+            b = field(t, seed=seed+1000*i+j, base=(11000., 1000., 52000.))
+            rng = np.random.default_rng(seed+1000*i+j)
+            b[rng.random(len(t)) < bad, :] = 99999.9
+            dat.append(b)
+        dat = np.hstack(dat)
+
+        header = 'YYYY MM DD HH MM SS ' + ' '.join(f'{stn} X {stn} Y {stn} Z' for stn in site)
+        ts = t.strftime('%Y %m %d %H %M %S')
+        fmt = ' '.join(['{:.1f}']*dat.shape[1])
+
+        fn = os.path.join(row['dir'], row['fname'])
+        with open_out(fn, gz) as f:
+            f.write(header+'\n')
+            f.write('nT\n')
+            f.write(''.join(s+' '+fmt.format(*d)+'\n' for s, d in zip(ts, dat)))
+        index.add('image', fn)
+        files.append(fn)
+
+    return files
+
+
+def write_themis(site: str | list = ['KUUJ'],
+                 sdate='2012-01-01',
+                 ndays: int = 1,
+                 edate=None,
+                 cadence: float = 0.5,
+                 seed: int = 0):
+    """Write synthetic THEMIS thg_l2_mag_*.cdf files.
+
+    Parameters
+    ----------
+    site : str | list, optional
+        Station or stations, by default ['KUUJ']
+    sdate : str or datetime-like, optional
+        First day, by default '2012-01-01'
+    ndays : int, optional
+        Number of days, by default 1
+    edate : str or datetime-like, optional
+        Last day, overrides ndays, by default None
+    cadence : float, optional
+        Sample spacing (s), by default 0.5
+    seed : int, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    list
+        Files written
+    """
+    from cdflib.cdfwrite import CDF
+
+    from gmag import index
+    from gmag.arrays import themis
+
+    if type(site) is str:
+        site = [site]
+    files = []
+    for i, stn in enumerate(site):
+        f_df = themis.list_files(stn.upper(), sdate, ndays=ndays, edate=edate)
+        for j, row in f_df.iterrows():
+            os.makedirs(row['dir'], exist_ok=True)
+            t = day_times(row['date'], cadence)
+            b = field(t, seed=seed+1000*i+j, base=(13000., 100., 56000.))
+            unix = (t - pd.Timestamp('1970-01-01')).total_seconds().to_numpy()
+
+            fn = os.path.join(row['dir'], row['fname'])
+            if os.path.exists(fn):
+                os.remove(fn)
+            var = 'thg_mag_'+stn.lower()
+            cdf = CDF(fn, cdf_spec={'Majority': 'row_major', 'Compressed': 0})
+            cdf.write_globalattrs({'PI_name': {0: 'Synthetic PI'},
+                                   'PI_affiliation': {0: 'Synthetic Institution'},
+                                   'Time_resolution': {0: f'{cadence:g}s'}})
+            cdf.write_var({'Variable': var+'_time', 'Data_Type': cdf.CDF_DOUBLE,
+                           'Num_Elements': 1, 'Rec_Vary': True, 'Dim_Sizes': []},
+                          var_data=unix)
+            cdf.write_var({'Variable': var, 'Data_Type': cdf.CDF_FLOAT,
+                           'Num_Elements': 1, 'Rec_Vary': True, 'Dim_Sizes': [3]},
+                          var_data=b.astype(np.float32))
+            labl = np.array(['Magnetic North - H', 'Magnetic East - D', 'Vertical Down - Z'])
+            cdf.write_var({'Variable': var+'_labl', 'Data_Type': cdf.CDF_CHAR,
+                           'Num_Elements': 20, 'Rec_Vary': False, 'Dim_Sizes': [3]},
+                          var_data=labl)
+            cdf.close()
+            index.add('themis', fn)
+            files.append(fn)
+
+    return files
+
+
+def archive(root: str,
+            sdate='2012-01-01',
+            ndays: int = 1,
+            carisma_site=['GILL', 'ISLL', 'PINA', 'FCHU', 'RABB'],
+            canopus_site=['GILL', 'ISLL', 'PINA'],
+            canopus_sdate='2001-01-01',
+            image_site=['AND', 'KEV', 'SOD', 'TRO', 'ABK', 'MUO'],
+            themis_site=['KUUJ', 'GBAY']):
+    """Write a synthetic archive for every array.
+
+    Parameters
+    ----------
+    root : str
+        Data directory, see set_local_dir
+    sdate : str or datetime-like, optional
+        First day for CARISMA, IMAGE and THEMIS, by default '2012-01-01'
+    ndays : int, optional
+        Number of days, by default 1
+    carisma_site, canopus_site, image_site, themis_site : list, optional
+        Stations for each array, an empty list writes no files for it
+    canopus_sdate : str or datetime-like, optional
+        First day for CANOPUS, which ends in 2005, by default '2001-01-01'
+
+    Returns
+    -------
+    dict
+        Files written, keyed by array
+    """
+    set_local_dir(root)
+    return {'carisma': write_carisma(carisma_site, sdate, ndays=ndays),
+            'canopus': write_canopus(canopus_site, canopus_sdate, ndays=ndays),
+            'image': write_image(image_site, sdate, ndays=ndays),
+            'themis': write_themis(themis_site, sdate, ndays=ndays)}
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Serve a synthetic archive with the URL layout of each array's server.
+
+    - /carisma/FGM/1Hz/YYYY/MM/DD/file
+    - /image?starttime=YYYYMMDD...[&compress]
+    - /themis/thg/l2/mag/site/YYYY/file
+
+    Supports single Range requests, If-Range, ETag, If-None-Match and
+    If-Modified-Since. The server attributes root (archive directory),
+    truncate (bytes sent before dropping the first response for each
+    file, None to disable) and log (list of (path, status)) control it.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def local_file(self):
+        """Archive file for the request path, None if not recognised."""
+        root = os.path.join(self.server.root, 'magnetometer')
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if len(parts) == 7 and parts[0] == 'carisma':
+            return os.path.join(root, 'CARISMA', *parts[3:])
+        if len(parts) == 7 and parts[0] == 'themis':
+            return os.path.join(root, 'THEMIS', *parts[4:])
+        if parts == ['image']:
+            q = parse_qs(url.query, keep_blank_values=True)
+            m = re.match(r'^(\d{4})(\d{2})(\d{2})', q.get('starttime', [''])[0])
+            if m is None:
+                return None
+            fn = 'image{0}{1}{2}00.col2'.format(*m.groups())
+            if 'compress' in q:
+                fn += '.gz'
+            return os.path.join(root, 'IMAGE', m.group(1), m.group(2), fn)
+        return None
+
+    def send(self, status, headers={}, body=b''):
+        self.server.log.append((self.path, status))
+        self.send_response(status)
+        for key, val in headers.items():
+            self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fn = self.local_file()
+        if fn is None or not os.path.isfile(fn):
+            self.send(404)
+            return
+
+        with open(fn, 'rb') as f:
+            body = f.read()
+        mtime = os.path.getmtime(fn)
+        etag = '"{0}"'.format(hashlib.md5(body).hexdigest())
+        modified = email.utils.formatdate(mtime, usegmt=True)
+        headers = {'ETag': etag, 'Last-Modified': modified,
+                   'Accept-Ranges': 'bytes', 'Content-Type': 'application/octet-stream'}
+
+        # conditional requests
+        inm = self.headers.get('If-None-Match')
+        ims = self.headers.get('If-Modified-Since')
+        if inm is not None:
+            if etag in [t.strip() for t in inm.split(',')]:
+                self.send(304, headers)
+                return
+        elif ims is not None:
+            try:
+                if int(mtime) <= email.utils.parsedate_to_datetime(ims).timestamp():
+                    self.send(304, headers)
+                    return
+            except (TypeError, ValueError):
+                pass
+
+        # range requests
+        status = 200
+        rng = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if rng is not None and (if_range is None or if_range in [etag, modified]):
+            m = re.match(r'^bytes=(\d+)-$', rng)
+            if m is not None:
+                start = int(m.group(1))
+                if start >= len(body):
+                    self.send(416, {'Content-Range': 'bytes */{0}'.format(len(body))})
+                    return
+                headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, len(body)-1, len(body))
+                body = body[start:]
+                status = 206
+
+        # drop the first response for each file part way through
+        n = self.server.truncate
+        if n is not None and fn not in self.server.truncated and len(body) > n:
+            self.server.truncated.add(fn)
+            self.server.log.append((self.path, status))
+            self.send_response(status)
+            for key, val in headers.items():
+                self.send_header(key, val)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:n])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self.send(status, headers, body)
+
+
+def serve(root: str,
+          port: int = 0,
+          truncate: int = None):
+    """Serve an archive over HTTP in a background thread.
+
+    Parameters
+    ----------
+    root : str
+        Archive directory, see archive
+    port : int, optional
+        Port to listen on, by default 0 for any free port
+    truncate : int, optional
+        Drop the first response for each file after this many bytes, to
+        test resuming, by default None
+
+    Returns
+    -------
+    tuple
+        (server, urls), call server.shutdown() to stop. urls holds
+        ca_http, im_http and th_http for the array modules' http_dir.
+        server.log lists the (path, status) of every response.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), ArchiveHandler)
+    server.daemon_threads = True
+    server.root = root
+    server.truncate = truncate
+    server.truncated = set()
+    server.log = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    return server, {'ca_http': url+'/carisma/',
+                    'im_http': url+'/image?',
+                    'th_http': url+'/themis/'}
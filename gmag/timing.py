@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Stage level timing of the loaders and electric field routines.
+
+Every loader wraps its stages (listing files, downloading, reading,
+parsing, cleaning, rotating and joining) and calcE its FFT stages in
+timing.stage(). When timing is disabled, the default, stage() returns a
+shared do-nothing context so the cost is a single function call.
+
+Example
+-------
+
+with timing.profile():
+    dat, meta = carisma.load(site=['GILL','ISLL'],sdate='2012-01-01',ndays=2)
+timing.report()
+
+Send every stage to a callback, e.g. a metrics client
+timing.enable(callback=lambda rec: print(rec))
+
+Notes
+-----
+    Reading includes decompression, pandas decompresses gzip files while
+    parsing. Counts are reported as files, bytes (on disk or transferred)
+    and rows.
+
+"""
+
+import os
+import time
+
+from contextlib import contextmanager
+
+import pandas as pd
+
+# timing is off by default
+enabled = False
+# completed stages and functions called with each
+_records = []
+_callbacks = []
+
+
+class NullStage:
+    """Stand in for Stage when timing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+    def add_file(self, fn):
+        pass
+
+
+_null = NullStage()
+
+
+class Stage:
+    """Time a single stage and record counts.
+
+    Parameters
+    ----------
+    module : str
+        Module the stage belongs to, e.g. 'carisma'
+    name : str
+        Stage name, e.g. 'read'
+    counts : dict
+        Initial counts, e.g. files=1
+    """
+
+    __slots__ = ('module', 'name', 'counts', 'start', 't0')
+
+    def __init__(self, module, name, counts):
+        self.module = module
+        self.name = name
+        self.counts = counts
+        self.start = None
+        self.t0 = None
+
+    def __enter__(self):
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        rec = {'module': self.module,
+               'stage': self.name,
+               'start': self.start,
+               'duration': time.perf_counter() - self.t0,
+               'error': exc_type is not None}
+        rec.update(self.counts)
+        _records.append(rec)
+        for fn in _callbacks:
+            fn(rec)
+        return False
+
+    def add(self, **counts):
+        """Increment counts, e.g. rows=len(df)."""
+        for key, val in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + val
+
+    def add_file(self, fn):
+        """Count a file and its size in bytes."""
+        self.add(files=1)
+        try:
+            self.add(bytes=os.path.getsize(fn))
+        except OSError:
+            pass
+
+
+def stage(module: str,
+          name: str,
+          **counts):
+    """Context manager timing a stage.
+
+    Parameters
+    ----------
+    module : str
+        Module the stage belongs to
+    name : str
+        Stage name
+    counts : int, optional
+        Initial counts for the stage
+
+    Returns
+    -------
+    Stage or NullStage
+        Use .add() and .add_file() to record counts
+    """
+    if not enabled:
+        return _null
+    return Stage(module, name, counts)
+
+
+def enable(callback=None):
+    """Turn on timing.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Function called with the record (dict) of every completed stage,
+        by default None
+    """
+    global enabled
+    enabled = True
+    if callback is not None and callback not in _callbacks:
+        _callbacks.append(callback)
+
+
+def disable():
+    """Turn off timing and remove callbacks."""
+    global enabled
+    enabled = False
+    _callbacks.clear()
+
+
+def reset():
+    """Clear recorded stages."""
+    _records.clear()
+
+
+@contextmanager
+def profile(callback=None,
+            clear: bool = True):
+    """Enable timing within a with block.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Function called with the record of every completed stage, by default None
+    clear : bool, optional
+        Clear previously recorded stages, by default True
+    """
+    global enabled
+    was_enabled = enabled
+    if clear:
+        reset()
+    enable(callback=callback)
+    try:
+        yield
+    finally:
+        enabled = was_enabled
+        if callback is not None and callback in _callbacks:
+            _callbacks.remove(callback)
+
+
+def records():
+    """Every recorded stage.
+
+    Returns
+    -------
+    DataFrame
+        One row per stage with module, stage, start (unix time),
+        duration (s), error and counts
+    """
+    return pd.DataFrame(_records)
+
+
+def report():
+    """Summary of the recorded stages.
+
+    Returns
+    -------
+    DataFrame
+        Indexed by module and stage with the number of calls, total,
+        mean and max duration (s) and summed counts
+    """
+    rec = records()
+    if rec.empty:
+        return pd.DataFrame(columns=['calls', 'total', 'mean', 'max'])
+
+    grp = rec.groupby(['module', 'stage'], sort=False)
+    rep = grp['duration'].agg(['count', 'sum', 'mean', 'max'])
+    rep.columns = ['calls', 'total', 'mean', 'max']
+    counts = [c for c in rec.columns if c not in
+              ['module', 'stage', 'start', 'duration', 'error']]
+    if counts:
+        rep = rep.join(grp[counts].sum(min_count=1))
+
+    return rep
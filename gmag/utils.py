@@ -7,6 +7,7 @@ Simple set of utilites for reading in array locations
 import pandas as pd
 import numpy as np
 import os
+import time
 
 import gmag
 
@@ -94,4 +95,161 @@ def load_station_geo(
         stn_dat = stn_dat[stn_dat[col.lower()] == param.upper()
                         ].reset_index(drop=True)
 
-    return stn_dat
\ No newline at end of file
+    return stn_dat
+
+
+def field_arrays(df: pd.DataFrame,
+                 site: list):
+    """Horizontal magnetic field arrays from a loader DataFrame.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Data returned by a gmag.arrays load function
+    site : list
+        Station codes, the column order of the returned arrays
+
+    Returns
+    -------
+    tuple
+        North-South and East-West field (nT), samples x stations. Stations
+        not in df are NaN.
+    """
+    bx = np.full((df.shape[0], len(site)), np.nan)
+    by = np.full((df.shape[0], len(site)), np.nan)
+    for i, stn in enumerate(site):
+        stn = stn.upper()
+        for cx, cy in [('_X', '_Y'), ('_H', '_D')]:
+            if stn+cx in df.columns and stn+cy in df.columns:
+                bx[:, i] = df[stn+cx].to_numpy(dtype=float)
+                by[:, i] = df[stn+cy].to_numpy(dtype=float)
+                break
+
+    return bx, by
+
+
+# layouts returned by the loaders
+outputs = ['wide', 'long', 'dict', 'dataset']
+
+
+def check_output(output: str):
+    """Raise ValueError if output is not a loader layout."""
+    if output not in outputs:
+        raise ValueError('output must be one of {0}, not {1!r}'.format(outputs, output))
+
+
+def tidy(frames: dict,
+         output: str = 'long'):
+    """Per station frames in the long or dict layout.
+
+    Parameters
+    ----------
+    frames : dict
+        Station: DataFrame with STN_component columns and a time index
+    output : str, optional
+        'long' for one DataFrame indexed by (station, t) with a column
+        per component, 'dict' for a DataFrame per station with a column
+        per component, by default 'long'
+
+    Returns
+    -------
+    DataFrame or dict
+        Data in the requested layout, stations are never joined on time
+    """
+    out = {}
+    for stn, df in frames.items():
+        p = stn.upper()+'_'
+        df.columns = pd.Index([c[len(p):] if c.startswith(p) else c for c in df.columns],
+                              name='component')
+        df.index.name = 't'
+        out[stn.upper()] = df
+    if output == 'dict':
+        return out
+    if not out:
+        return pd.DataFrame()
+    return pd.concat(out, names=['station', 't'])
+
+
+class Progress:
+    """Report progress of downloading or loading files to a callback.
+
+    The callback is called after every file with a dictionary containing
+    stage ('download' or 'load'), file (name), done and total (files),
+    bytes (on disk or transferred so far), elapsed and eta (s, None
+    until it can be estimated).
+
+    Parameters
+    ----------
+    callback : callable or None
+        Function called with the progress dictionary. If None, update()
+        does nothing.
+    total : int, optional
+        Total number of files, by default 0. Can be increased with
+        add_total().
+    """
+
+    def __init__(self, callback, total=0):
+        self.callback = callback
+        self.total = total
+        self.done = 0
+        self.nbytes = 0
+        self.t0 = time.perf_counter()
+
+    @classmethod
+    def wrap(cls, progress, total=0):
+        """progress if it is already a Progress, otherwise a new Progress
+        calling it, so a load can share its Progress with download."""
+        if isinstance(progress, cls):
+            return progress
+        return cls(progress, total=total)
+
+    def add_total(self, n):
+        """Increase the total number of files."""
+        self.total += n
+
+    def update(self, stage, fname=None, nbytes=0, path=None):
+        """Count a completed file and call the callback.
+
+        The size of path is added to the bytes if it is given.
+        """
+        if self.callback is None:
+            return
+        if path is not None and os.path.exists(path):
+            nbytes += os.path.getsize(path)
+        self.done += 1
+        self.nbytes += nbytes
+        elapsed = time.perf_counter() - self.t0
+        eta = None
+        if self.total >= self.done > 0:
+            eta = elapsed / self.done * (self.total - self.done)
+        self.callback({'stage': stage,
+                       'file': fname,
+                       'done': self.done,
+                       'total': self.total,
+                       'bytes': self.nbytes,
+                       'elapsed': elapsed,
+                       'eta': eta})
+
+
+def parse_size(size):
+    """Bytes from a number or a string such as '500k', '2M' or '50G'.
+
+    Parameters
+    ----------
+    size : int, float, str or None
+        Size, k, M, G and T are powers of 1024, a trailing B is ignored
+
+    Returns
+    -------
+    float or None
+        Bytes, None if size is None
+    """
+    if size is None:
+        return None
+    if not isinstance(size, str):
+        return float(size)
+    size = size.strip().rstrip('Bb')
+    mult = {'k': 2**10, 'm': 2**20, 'g': 2**30, 't': 2**40}
+    if size[-1].lower() in mult:
+        return float(size[:-1])*mult[size[-1].lower()]
+    return float(size)
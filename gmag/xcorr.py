@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Pairwise cross-correlation lags between stations for propagation studies.
+
+Samples are placed on a regular grid and cut into sliding windows. For
+every window the cross-correlation of every pair of stations at every
+lag up to max_lag comes from one batch of FFTs, rather than a shift and
+corr per pair and lag. Missing samples are masked: at each lag the
+correlation is normalised by the energy of the samples valid in both
+stations, and lags with too few valid samples in common are NaN.
+
+The lag of the correlation peak of station j relative to station i is
+positive when j sees a signal after i.
+
+Example
+-------
+
+dat, meta = carisma.load(['GILL','ISLL','PINA','FSIM'], '2012-01-01')
+t, bx, site = spectral.components(dat, 'X')
+tw, lag, r = xcorr.lags(t, bx, width=3600, step=1800, max_lag=600)
+# delay (s) of ISLL after GILL in each window
+lag[:, site.index('GILL'), site.index('ISLL')]
+
+"""
+
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from gmag import cadence
+from gmag import dbdt
+from gmag import spectral
+
+# pairs x frequencies transformed at a time
+_block = 2**20
+
+
+def _nfft(n):
+    """Smallest 2^a 3^b 5^c at least n."""
+    best = 2**int(np.ceil(np.log2(max(n, 1))))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def correlate(seg,
+              max_lag: int,
+              min_overlap: float = 0.5):
+    """Masked cross-correlation of every pair of stations.
+
+    Parameters
+    ----------
+    seg : np.ndarray
+        windows x stations x samples, NaN where missing
+    max_lag : int
+        Largest lag (samples)
+    min_overlap : float, optional
+        Fraction of the window that must be valid in both stations at a
+        lag, by default 0.5
+
+    Returns
+    -------
+    tuple
+        Row and column stations of each pair (i < j) and the correlation
+        of x_i(t) and x_j(t+k), windows x pairs x lags -max_lag..max_lag
+    """
+    seg = np.asarray(seg, dtype=float)
+    nw, ns, n = seg.shape
+    max_lag = int(min(max_lag, n-1))
+    i, j = np.triu_indices(ns, 1)
+    lags = np.arange(-max_lag, max_lag+1)
+    out = np.full((nw, len(i), len(lags)), np.nan)
+    if not len(i) or not nw:
+        return i, j, out
+
+    m = np.isfinite(seg)
+    x = np.where(m, seg, 0.)
+    # remove the mean of the valid samples of each window
+    x -= x.sum(axis=-1, keepdims=True)/np.maximum(m.sum(axis=-1, keepdims=True), 1)
+    x[~m] = 0.
+    m = m.astype(float)
+
+    # zero padded so lags do not wrap
+    nfft = _nfft(n + max_lag)
+    fx = np.fft.rfft(x, nfft, axis=-1)
+    fq = np.fft.rfft(x*x, nfft, axis=-1)
+    fm = np.fft.rfft(m, nfft, axis=-1)
+    # lag k is at k, negative lags at the end
+    pick = lags % nfft
+
+    cx, cq, cm = fx.conj(), fq.conj(), fm.conj()
+
+    def xc(a, b, w):
+        return np.fft.irfft(a[w][:, i]*b[w][:, j], nfft, axis=-1)[..., pick]
+
+    per = max(1, _block//(len(i)*fx.shape[-1]))
+    for w0 in range(0, nw, per):
+        w = slice(w0, w0+per)
+        num = xc(cx, fx, w)
+        e_i = xc(cq, fm, w)
+        e_j = xc(cm, fq, w)
+        cnt = xc(cm, fm, w)
+        den = e_i*e_j
+        ok = (np.rint(cnt) >= max(min_overlap*n, 2)) & (den > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[w] = np.where(ok, num/np.sqrt(np.where(ok, den, 1.)), np.nan)
+
+    return i, j, np.clip(out, -1., 1.)
+
+
+def peak(c,
+         refine: bool = True):
+    """Lag and value of the correlation maximum.
+
+    Parameters
+    ----------
+    c : np.ndarray
+        ... x lags -max_lag..max_lag, from correlate
+    refine : bool, optional
+        Interpolate the peak with a parabola through its neighbours, by
+        default True
+
+    Returns
+    -------
+    tuple
+        Lag (samples, float) and correlation at the peak, NaN where every
+        lag is NaN
+    """
+    c = np.asarray(c, dtype=float)
+    max_lag = (c.shape[-1] - 1)//2
+    good = np.isfinite(c).any(axis=-1)
+    k = np.argmax(np.where(np.isfinite(c), c, -np.inf), axis=-1)
+    y0 = np.take_along_axis(c, k[..., None], axis=-1)[..., 0]
+    lag = (k - max_lag).astype(float)
+    if refine:
+        lo = np.take_along_axis(c, np.maximum(k-1, 0)[..., None], axis=-1)[..., 0]
+        hi = np.take_along_axis(c, np.minimum(k+1, c.shape[-1]-1)[..., None], axis=-1)[..., 0]
+        curv = lo - 2*y0 + hi
+        ok = (k > 0) & (k < c.shape[-1]-1) & np.isfinite(lo) & np.isfinite(hi) & (curv < 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            d = np.where(ok, 0.5*(lo - hi)/np.where(ok, curv, 1.), 0.)
+        lag += d
+        y0 = y0 - 0.25*(lo - hi)*d
+    lag[~good] = np.nan
+    y0[~good] = np.nan
+    return lag, y0
+
+
+def windows(t,
+            dat,
+            width: float,
+            step: float = None,
+            dt: float = None):
+    """Cut data into sliding windows on a regular grid.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data, samples x stations
+    width : float
+        Window length (s)
+    step : float, optional
+        Time (s) between window starts, windows start at multiples of
+        step from the epoch, by default None for width
+    dt : float, optional
+        Sample spacing (s), by default None for the cadence of t
+
+    Returns
+    -------
+    tuple
+        Window start times (datetime64[ns]), windows x stations x samples
+        (NaN where missing) and dt, only windows between the first and
+        last sample are returned
+    """
+    t = dbdt.time_ns(t)
+    dat = np.asarray(dat, dtype=float)
+    if dat.ndim == 1:
+        dat = dat[:, np.newaxis]
+    step = width if step is None else step
+    if dt is None:
+        dt = cadence.step(t)/1e9
+    if dt <= 0:
+        raise ValueError('Cannot find the cadence, set dt')
+    dt_ns = int(round(dt*1e9))
+    n = int(round(width/dt))
+    sg = int(round(step/dt))
+    if n < 2 or sg < 1 or not np.isclose(sg*dt, step):
+        raise ValueError('width and step must be multiples of dt')
+
+    g0, x = spectral.grid(t, dat, dt)
+    # windows within the data
+    starts = np.arange(-(-g0//sg)*sg, g0 + len(x) - n + 1, sg)
+    if not len(starts):
+        return np.empty(0, dtype='datetime64[ns]'), np.empty((0, dat.shape[1], n)), dt
+    seg = sliding_window_view(x, n, axis=0)[starts - g0]
+    return (starts*dt_ns).astype('datetime64[ns]'), seg, dt
+
+
+def lags(t,
+         dat,
+         width: float = 3600,
+         step: float = None,
+         max_lag: float = 600,
+         dt: float = None,
+         min_overlap: float = 0.5,
+         refine: bool = True):
+    """Lag matrix of every pair of stations in sliding windows.
+
+    Parameters
+    ----------
+    t : DatetimeIndex, datetime64 or int64 array like
+        Sample times, sorted
+    dat : array like
+        Data (nT), samples x stations, e.g. from gmag.spectral.components
+    width : float, optional
+        Window length (s), by default 3600
+    step : float, optional
+        Time (s) between window starts, by default None for width
+    max_lag : float, optional
+        Largest lag searched (s), by default 600
+    dt : float, optional
+        Sample spacing (s), by default None for the cadence of t
+    min_overlap : float, optional
+        Fraction of the window that must be valid in both stations at a
+        lag, by default 0.5
+    refine : bool, optional
+        Interpolate lags between samples, by default True
+
+    Returns
+    -------
+    tuple
+        Window start times (datetime64[ns]), lag of station j after
+        station i (s) and peak correlation, windows x stations x
+        stations. lag is antisymmetric and r symmetric, NaN for pairs
+        without enough data in common.
+    """
+    tw, seg, dt = windows(t, dat, width, step=step, dt=dt)
+    nw, ns = seg.shape[0], seg.shape[1]
+    lag = np.full((nw, ns, ns), np.nan)
+    r = np.full((nw, ns, ns), np.nan)
+    if not nw:
+        return tw, lag, r
+
+    i, j, c = correlate(seg, int(round(max_lag/dt)), min_overlap=min_overlap)
+    k, p = peak(c, refine=refine)
+    lag[:, i, j] = k*dt
+    lag[:, j, i] = -k*dt
+    r[:, i, j] = p
+    r[:, j, i] = p
+    d = np.arange(ns)
+    valid = (np.isfinite(seg).sum(axis=-1) >= max(min_overlap*seg.shape[-1], 2))
+    lag[:, d, d] = np.where(valid, 0., np.nan)
+    r[:, d, d] = np.where(valid, 1., np.nan)
+    return tw, lag, r
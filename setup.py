@@ -13,10 +13,12 @@ setup(name='gmag',
       license='MIT License',
       license_file = 'LICENSE.md',
       url='https://github.com/kylermurphy/gmag/',
-      install_requires=['pandas>=1.5.3','numpy','wget','requests','cdflib>=1.0.4','chardet'],
+      install_requires=['pandas>=1.5.3','numpy','requests','cdflib>=1.0.4','chardet'],
+      extras_require={'async': ['aiohttp'], 'lazy': ['xarray', 'dask']},
       long_description=long_description,
       long_description_content_type="text/markdown",
       packages=find_packages(),
+      entry_points={'console_scripts': ['gmag=gmag.cli:main']},
       classifiers=['Development Status :: 3 - Alpha',
                    'License :: OSI Approved :: MIT License',
                    'Intended Audience :: Science/Research',
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the test suite.
+
+A gmagrc pointing at a scratch directory is written before gmag is
+imported so the tests never touch an existing data directory, and a
+synthetic archive is generated once per session.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_home = tempfile.mkdtemp(prefix='gmag_test_')
+os.makedirs(os.path.join(_home, '.gmag'), exist_ok=True)
+with open(os.path.join(_home, '.gmag', 'gmagrc'), 'w') as f:
+    f.write('[DEFAULT]\n'
+            f'data_dir = {os.path.join(_home, "data")}\n'
+            'ca_http = http://127.0.0.1:1/\n'
+            'im_http = http://127.0.0.1:1/image?\n'
+            'th_http = http://127.0.0.1:1/themis/\n')
+os.environ['HOME'] = _home
+os.environ['USERPROFILE'] = _home
+
+from gmag import synthetic  # noqa: E402
+from gmag.arrays import carisma, image, themis  # noqa: E402
+
+# days in the synthetic archive
+NDAYS = 2
+SDATE = '2012-01-01'
+# data_dir
+DATA = os.path.join(_home, 'data')
+
+
+@pytest.fixture(scope='session')
+def archive():
+    """Synthetic archive for every array, written once per session."""
+    return synthetic.archive(DATA, sdate=SDATE, ndays=NDAYS)
+
+
+@pytest.fixture(scope='module')
+def remote(tmp_path_factory, archive):
+    """Synthetic archive served over HTTP, downloads go to a mirror.
+
+    The array modules' http_dir point at the server and local_dir at an
+    empty mirror until the end of the module.
+    """
+    root = str(tmp_path_factory.mktemp('remote'))
+    files = synthetic.archive(root, sdate=SDATE, ndays=NDAYS,
+                              carisma_site=['GILL', 'ISLL'], canopus_site=[],
+                              image_site=['AND', 'KEV'], themis_site=['KUUJ'])
+    server, urls = synthetic.serve(root)
+    http = (carisma.http_dir, image.http_dir, themis.http_dir)
+    carisma.http_dir, image.http_dir, themis.http_dir = \
+        urls['ca_http'], urls['im_http'], urls['th_http']
+
+    mirror = str(tmp_path_factory.mktemp('mirror'))
+    synthetic.set_local_dir(mirror)
+    yield server, root, files, mirror
+
+    server.shutdown()
+    carisma.http_dir, image.http_dir, themis.http_dir = http
+    synthetic.set_local_dir(DATA)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the asyncio loaders against a local server.
+"""
+
+import asyncio
+import concurrent.futures
+import filecmp
+import hashlib
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from gmag import aio, fetch, index
+from gmag.arrays import carisma, image, themis
+
+from conftest import NDAYS, SDATE
+
+pytest.importorskip('aiohttp')
+
+
+def test_aload(remote):
+    server, root, files, mirror = remote
+
+    async def main():
+        async with aio.session() as sess:
+            out = await asyncio.gather(
+                carisma.aload(['GILL', 'ISLL'], SDATE, ndays=NDAYS),
+                image.aload(['AND'], SDATE, ndays=NDAYS),
+                themis.aload('KUUJ', SDATE, ndays=NDAYS))
+            # the loads used the client of the block
+            async with aio.session() as inner:
+                assert inner is sess
+        assert sess.closed
+        return out
+
+    (c_dat, c_meta), (i_dat, i_meta), (t_dat, t_meta) = asyncio.run(main())
+    assert c_meta.shape[0] == 2
+    assert i_meta.shape[0] == 1
+    assert len(t_dat) == NDAYS*172800
+
+    # files were committed to the mirror
+    ref, meta = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False)
+    pd.testing.assert_frame_equal(c_dat, ref)
+
+    # present files are not requested again
+    del server.log[:]
+    async def main():
+        status = await aio.adownload('carisma', ['GILL', 'ISLL'], SDATE, ndays=NDAYS)
+        await aio.close()
+        return status
+
+    status = asyncio.run(main())
+    assert status == ['skipped']*2*NDAYS
+    assert server.log == []
+
+
+def clear(f_df):
+    for fn in [os.path.join(d, f) for d, f in zip(f_df['dir'], f_df['fname'])]:
+        if os.path.exists(fn):
+            os.remove(fn)
+            index.remove(fn)
+
+
+def test_shared_client(remote, monkeypatch):
+    import aiohttp
+
+    made = []
+    new = aiohttp.ClientSession
+    monkeypatch.setattr(aiohttp, 'ClientSession',
+                        lambda *a, **k: made.append(new(*a, **k)) or made[-1])
+    for stn in ['GILL', 'ISLL']:
+        clear(carisma.list_files(stn, SDATE, ndays=NDAYS))
+    clear(themis.list_files('KUUJ', SDATE, ndays=NDAYS))
+
+    async def main():
+        # concurrent requests outside a session() block
+        await asyncio.gather(carisma.aload('GILL', SDATE, ndays=NDAYS),
+                             carisma.aload('ISLL', SDATE, ndays=NDAYS),
+                             themis.aload('KUUJ', SDATE, ndays=NDAYS))
+        assert len(made) == 1 and aio.client() is made[0]
+        await aio.close()
+        assert made[0].closed
+
+    asyncio.run(main())
+
+
+def test_process_executor(remote):
+    # parsing in a process pool, file work stays in threads
+    clear(carisma.list_files('GILL', SDATE, ndays=NDAYS))
+    with concurrent.futures.ProcessPoolExecutor(1) as ex:
+        aio.executor = ex
+        try:
+            async def main():
+                out = await carisma.aload('GILL', SDATE, ndays=NDAYS)
+                await aio.close()
+                return out
+
+            dat, meta = asyncio.run(main())
+        finally:
+            aio.executor = None
+    ref, meta = carisma.load('GILL', SDATE, ndays=NDAYS, dl=False)
+    pd.testing.assert_frame_equal(dat, ref)
+
+
+def afetch(url, fn, **kwargs):
+    async def main():
+        try:
+            return await aio.afetch(url, fn, **kwargs)
+        finally:
+            await aio.close()
+    return asyncio.run(main())
+
+
+def themis_file(remote, name):
+    server, root, files, mirror = remote
+    src = files['themis'][0]
+    url = themis.list_files('KUUJ', SDATE)['hdir'].iloc[0] + os.path.basename(src)
+    return server, src, url, os.path.join(mirror, name)
+
+
+def test_resume(remote):
+    server, src, url, fn = themis_file(remote, 'aresume.cdf')
+
+    server.truncate = 10**6
+    try:
+        status, n = afetch(url, fn)
+    finally:
+        server.truncate = None
+    assert status == 'partial'
+    assert not os.path.exists(fn)
+    assert os.path.getsize(fn+'.part') == n > 0
+
+    del server.log[:]
+    status, n = afetch(url, fn)
+    assert status == 'downloaded'
+    assert [s for p, s in server.log] == [206]
+    assert filecmp.cmp(src, fn, shallow=False)
+    assert not os.path.exists(fn+'.part')
+
+
+def test_stale_part(remote):
+    server, src, url, fn = themis_file(remote, 'astale.cdf')
+
+    # partial file longer than the remote file gives 416, then a full download
+    with open(src, 'rb') as f:
+        body = f.read()
+    with open(fn+'.part', 'wb') as f:
+        f.write(body + body)
+    fetch._store(fn+'.part', url, '"{0}"'.format(hashlib.md5(body).hexdigest()), None)
+    del server.log[:]
+    status, n = afetch(url, fn)
+    assert status == 'downloaded'
+    assert [s for p, s in server.log] == [416, 200]
+    assert filecmp.cmp(src, fn, shallow=False)
+
+    # removing a partial file that is already gone
+    fetch._discard(fn+'.part')
+
+
+def test_revalidate_mtime(remote):
+    server, src, url, fn = themis_file(remote, 'amtime.cdf')
+
+    # copied in without stored validators, revalidated by modification time
+    shutil.copy(src, fn)
+    del server.log[:]
+    status, n = afetch(url, fn, force=True)
+    assert status == 'not modified'
+    assert [s for p, s in server.log] == [304]
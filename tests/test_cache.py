@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for size capped eviction of data_dir.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from gmag import cache, efield, hazard, index, synthetic
+from gmag.arrays import carisma
+
+from conftest import DATA
+
+
+@pytest.fixture
+def scratch(tmp_path):
+    """Four days of CARISMA files in an empty data directory."""
+    synthetic.set_local_dir(str(tmp_path))
+    files = synthetic.write_carisma('GILL', '2012-01-01', ndays=4)
+    # oldest first
+    for i, fn in enumerate(files):
+        os.utime(fn, (1e9+i, 1e9+i))
+    index.scan('carisma')
+    yield files
+    cache.cap = None
+    synthetic.set_local_dir(DATA)
+
+
+def test_lru(scratch):
+    files = scratch
+    # reading the oldest file makes it the most recent
+    carisma.load('GILL', '2012-01-01', dl=False)
+
+    total = cache.usage().loc['total', 'bytes']
+    removed = cache.evict(size=total*0.6, keep=1.)
+    assert removed == [os.path.normpath(f) for f in files[1:3]]
+    assert os.path.exists(files[0]) and os.path.exists(files[3])
+    assert not index.availability('carisma', 'GILL', '2012-01-01', ndays=4)['GILL'].iloc[1]
+
+
+def test_pin(scratch):
+    files = scratch
+    with cache.scope():
+        cache.pin(files[:2])
+        assert set(map(os.path.normpath, files[:2])) <= cache.pinned()
+        cache.evict(size=1)
+        assert [os.path.exists(f) for f in files] == [True, True, False, False]
+    assert not cache.pinned()
+    cache.evict(size=1)
+    assert not any(os.path.exists(f) for f in files)
+
+
+def test_parsed_and_enforce(scratch, tmp_path):
+    fn = str(tmp_path / 'parsed.npy')
+    np.save(fn, np.zeros(2**16))
+    cache.register(fn)
+    assert cache.usage().loc['parsed', 'files'] == 1
+
+    cache.cap = cache.usage().loc['total', 'bytes'] - 1
+    removed = cache.enforce()
+    assert removed
+    assert cache.usage().loc['total', 'bytes'] <= cache.target*cache.cap
+
+
+def test_pin_missing(scratch, tmp_path, monkeypatch):
+    missing = str(tmp_path / 'missing.F01.gz')
+    with cache.scope():
+        # presence comes from the index, not the disk
+        with monkeypatch.context() as m:
+            m.setattr(os.path, 'exists', lambda p: pytest.fail('stat '+p))
+            cache.pin([scratch[0], missing])
+        assert os.path.normpath(scratch[0]) in cache.pinned()
+        assert os.path.normpath(missing) not in cache.pinned()
+    n = cache.connect().execute('SELECT COUNT(*) FROM access WHERE path = ?',
+                                (os.path.normpath(missing),)).fetchone()[0]
+    assert n == 0
+
+
+def test_derived(scratch, tmp_path, tmp_path_factory):
+    # calcE_chunk output and hazard checkpoints are tracked
+    bx = np.zeros(1000)
+    fn = str(tmp_path / 'e.npy')
+    efield.calcE_chunk(bx, bx, np.array([100., 10.]), np.array([1e4]), dt=1, out=fn)
+    stats = hazard.new_stats(['GILL'], np.logspace(-2, 4, 61), [10])
+    ckpt = str(tmp_path / 'hazard.npz')
+    hazard.save(stats, ckpt)
+
+    f_df = cache.files()
+    parsed = set(f_df.loc[f_df['kind'] == 'parsed', 'path'])
+    assert {os.path.normpath(fn), os.path.normpath(ckpt)} <= parsed
+
+    # files outside data_dir are never tracked or evicted
+    user = str(tmp_path_factory.mktemp('results') / 'hazard.npz')
+    hazard.save(stats, user)
+    assert not cache.register(user)
+    assert os.path.normpath(user) not in set(cache.files()['path'])
+    cache.evict(size=1)
+    assert os.path.exists(user)
+    assert not os.path.exists(ckpt)
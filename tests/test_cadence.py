@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for cadence detection and regular grids.
+"""
+
+import numpy as np
+import pandas as pd
+
+from gmag import cadence
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+def test_stats():
+    t = pd.date_range('2012-01-01', periods=1000, freq='500ms')
+    assert cadence.stats(t) == {'cadence': 0.5, 'jitter': 0., 'gaps': 0}
+    assert cadence.is_regular(t)
+
+    ns = t.asi8.copy()
+    ns[10] += 10**7
+    ns = np.delete(ns, np.r_[100:110, 500:503])
+    s = cadence.stats(ns)
+    assert s['cadence'] == 0.5
+    assert s['gaps'] == 2
+    assert 0 < s['jitter'] < 0.01
+    assert not cadence.is_regular(ns)
+    assert np.isnan(cadence.stats(t[:1])['cadence'])
+
+
+def test_regular():
+    t = pd.date_range('2012-01-01', periods=100, freq='10s', name='t')
+    df = pd.DataFrame({'X': np.arange(100.), 'Y': np.arange(100.)}, index=t)
+    g = cadence.regular(df)
+    assert g.step == 10*10**9 and len(g) == 100
+    assert g.start == np.datetime64('2012-01-01T00:00:00')
+    pd.testing.assert_frame_equal(g.to_frame(), df, check_freq=False)
+    assert g.locate(t[[0, 42]]).tolist() == [0, 42]
+    assert g.time(42) == t[42]
+    assert cadence.regular(df.drop(t[50])) is None
+
+
+def test_meta(archive):
+    dat, meta = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False)
+    assert meta['Time Resolution'].tolist() == [1., 1.]
+    assert meta['Gaps'].tolist() == [0, 0]
+    assert meta['Jitter'].tolist() == [0., 0.]
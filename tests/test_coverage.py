@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for coverage recorded at load time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from gmag import coverage, index, synthetic
+from gmag.arrays import carisma, image
+
+from conftest import DATA, NDAYS, SDATE
+
+
+def test_stats():
+    t = pd.date_range('2012-01-01', periods=86400//10, freq='10s')
+    dat = pd.DataFrame({'ABC_X': 1., 'ABC_Y': 1., 'ABC_Z': 1.}, index=t)
+    dat.iloc[100:110, 1] = np.nan
+    dat = dat.drop(t[-30:])
+
+    s_df = coverage.stats(dat, 'ABC')
+    assert s_df['expected'].iloc[0] == 8640
+    assert s_df['valid'].iloc[0] == 8640 - 40
+    assert s_df['gaps'].iloc[0] == [[1000., 1100.], [86100., 86400.]]
+
+
+def test_record_and_query(archive):
+    site = ['GILL', 'ISLL']
+    cov = coverage.build('carisma', site, SDATE, ndays=NDAYS+1)
+    assert cov.shape == (NDAYS+1, 2)
+    assert (cov.iloc[:NDAYS] > 0.99).all().all()
+    # no file
+    assert (cov.iloc[NDAYS] == 0).all()
+
+    dat, meta = carisma.load('GILL', SDATE, ndays=NDAYS, dl=False)
+    valid = coverage.query('carisma', 'GILL', SDATE, ndays=NDAYS, value='valid')
+    n = dat[['GILL_X', 'GILL_Y', 'GILL_Z']].notna().all(axis=1).groupby(dat.index.date).sum()
+    assert valid['GILL'].tolist() == n.tolist()
+
+    g_df = coverage.gaps('carisma', 'GILL', SDATE, ndays=NDAYS)
+    assert len(g_df) > 0
+    assert (g_df['end'] > g_df['start']).all()
+
+
+def test_index_disabled(tmp_path):
+    # without the index the files table is empty,
+    # the days of the loaded data are recorded
+    synthetic.set_local_dir(str(tmp_path))
+    for fn in synthetic.write_carisma('GILL', SDATE, ndays=NDAYS):
+        index.remove(fn)
+    index.enabled = False
+    try:
+        dat, meta = carisma.load('GILL', SDATE, ndays=NDAYS, dl=False)
+        assert not dat.empty
+        assert index.connect().execute('SELECT COUNT(*) FROM files').fetchone()[0] == 0
+        valid = coverage.query('carisma', 'GILL', SDATE, ndays=NDAYS, value='valid')
+    finally:
+        index.enabled = True
+        synthetic.set_local_dir(DATA)
+    n = dat[['GILL_X', 'GILL_Y', 'GILL_Z']].notna().all(axis=1).groupby(dat.index.date).sum()
+    assert valid['GILL'].tolist() == n.tolist()
+
+
+def test_image_negative_z(tmp_path, monkeypatch):
+    # rotate blanks H and D of stations with Z < 0,
+    # coverage counts the XYZ data
+    field = synthetic.field
+    monkeypatch.setattr(synthetic, 'field', lambda *a, **k: field(*a, **k)*[1., 1., -1.])
+    synthetic.set_local_dir(str(tmp_path))
+    try:
+        synthetic.write_image('KEV', SDATE, ndays=NDAYS)
+        dat, meta = image.load('KEV', SDATE, ndays=NDAYS, dl=False)
+        valid = coverage.query('image', 'KEV', SDATE, ndays=NDAYS, value='valid')
+    finally:
+        synthetic.set_local_dir(DATA)
+    assert dat['KEV_H'].isna().all()
+    n = dat[['KEV_X', 'KEV_Y', 'KEV_Z']].notna().all(axis=1).groupby(dat.index.date).sum()
+    assert (n > 0).all()
+    assert valid['KEV'].tolist() == n.tolist()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for dB/dt, rolling windows and the streaming form.
+"""
+
+import numpy as np
+import pandas as pd
+
+from gmag import dbdt
+
+
+def field(n=3600, seed=0):
+    """1 s data for three stations with gaps, one station starts late."""
+    rng = np.random.default_rng(seed)
+    t = pd.date_range('2012-01-01', periods=n, freq='1s')
+    bx = np.cumsum(rng.normal(size=(n, 3)), axis=0)
+    by = np.cumsum(rng.normal(size=(n, 3)), axis=0)
+    # single missing samples, a gap longer than max_dt across
+    # a chunk boundary and a station without data in the first chunk
+    bx[[100, 101, 2000], 0] = np.nan
+    by[[500], 1] = np.nan
+    bx[890:1210, 1] = np.nan
+    by[890:1210, 1] = np.nan
+    bx[:1500, 2] = np.nan
+    by[:1500, 2] = np.nan
+    return t, bx, by
+
+
+def test_deriv():
+    t = pd.date_range('2012-01-01', periods=6, freq='1s')
+    x = np.array([0., 1., np.nan, 5., np.nan, np.nan])
+    d = dbdt.deriv(t, x)
+    # across the missing sample using the actual time between samples
+    np.testing.assert_array_equal(d, [np.nan, 1., np.nan, 2., np.nan, np.nan])
+    # longer then max_dt
+    np.testing.assert_array_equal(dbdt.deriv(t, x, max_dt=1.5), [np.nan, 1., np.nan, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(dbdt.spacing(t, np.c_[x, np.full(6, np.nan)]), [3., np.nan])
+
+
+def test_empty():
+    # a day without samples
+    t = pd.DatetimeIndex([])
+    b_idx, b_max, b_ssq, b_cnt = dbdt.blocks(t, np.empty((0, 2)), 60)
+    assert b_idx.size == 0 and b_max.shape == b_cnt.shape == (0, 2)
+    tw, w_max, w_rms, w_cnt = dbdt.window(t, dbdt.dbh_dt(t, np.empty(0), np.empty(0)))
+    assert tw.size == w_max.size == w_rms.size == w_cnt.size == 0
+    tw, w_max, w_rms, w_cnt = dbdt.window(t, np.empty((0, 3)), width=60, step=20)
+    assert w_max.shape == (0, 3)
+
+
+def test_stream():
+    t, bx, by = field()
+    dbh = dbdt.dbh_dt(t, bx, by)
+    ref = dbdt.window(t, dbh, width=60, step=30)
+
+    st = dbdt.Stream(width=60, step=30)
+    out = [st.update(t[a:a+700], bx[a:a+700], by[a:a+700]) for a in range(0, len(t), 700)]
+    out.append(st.flush())
+    tw, w_max, w_rms, w_cnt = [np.concatenate([o[i] for o in out]) for i in range(4)]
+    np.testing.assert_array_equal(tw, ref[0])
+    np.testing.assert_allclose(w_max, ref[1], rtol=1e-12)
+    np.testing.assert_allclose(w_rms, ref[2], rtol=1e-12)
+    np.testing.assert_array_equal(w_cnt, ref[3])
+    # the gap is not differenced across, the late station is
+    assert np.isnan(dbh[890:1211, 1]).all()
+    assert np.isfinite(dbh[1501:, 2]).all()
+
+
+def test_stream_max_dt():
+    t, bx, by = field()
+    bx, by = bx[:2000, :1], by[:2000, :1]
+    # every 10th sample in the second chunk
+    keep = np.r_[np.arange(1000), np.arange(1000, 2000, 10)]
+    t, bx, by = t[keep], bx[keep], by[keep]
+
+    # max_dt is fixed by the first chunk, the sparse
+    # chunk is not differenced with its own spacing
+    st = dbdt.Stream(width=60)
+    st.update(t[:1000], bx[:1000], by[:1000])
+    tw, w_max, w_rms, w_cnt = st.update(t[1000:], bx[1000:], by[1000:])
+    np.testing.assert_array_equal(st.dt_x, [2.])
+    assert w_cnt[0, 0] > 0 and (w_cnt[1:] == 0).all()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for electric field derivation.
+"""
+
+import numpy as np
+
+from gmag import efield
+
+RES = np.array([1000., 100., 10.])
+THICK = np.array([10e3, 50e3])
+
+
+def walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.normal(size=n)), np.cumsum(rng.normal(size=n))
+
+
+def test_calcE_odd():
+    # rfft/irfft match the full complex transform for odd lengths too
+    for n in [100, 101]:
+        bx, by = walk(n)
+        ex, ey = efield.calcE(bx, by, RES, THICK, dt=1)
+        assert len(ex) == len(ey) == n
+
+        freqs = np.fft.fftfreq(n, d=1)
+        Z = efield.calcZ(RES, THICK, np.abs(freqs))
+        Z[:, freqs < 0] = np.conj(Z[:, freqs < 0])
+        fx, fy = np.fft.fft(bx), np.fft.fft(by)
+        np.testing.assert_allclose(ex, np.real(np.fft.ifft(Z[0]*fx + Z[1]*fy)), atol=1e-9)
+        np.testing.assert_allclose(ey, np.real(np.fft.ifft(Z[2]*fx + Z[3]*fy)), atol=1e-9)
+
+
+def test_calcE_chunk(tmp_path):
+    n = 200001
+    bx, by = walk(n)
+    ex, ey = efield.calcE(bx, by, RES, THICK, dt=1)
+    scale = max(np.abs(ex).max(), np.abs(ey).max())
+
+    # 20000 sample segments, away from the ends where calcE wraps around
+    cx, cy = efield.calcE_chunk(bx, by, RES, THICK, dt=1, mem=20000*112)
+    keep = slice(5000, n-5000)
+    assert np.abs(cx - ex)[keep].max() < 0.01*scale
+    assert np.abs(cy - ey)[keep].max() < 0.01*scale
+
+    # memmap output gives the same values
+    fn = tmp_path / 'e.npy'
+    efield.calcE_chunk(bx, by, RES, THICK, dt=1, mem=20000*112, out=fn)
+    e = np.load(fn)
+    np.testing.assert_array_equal(e[0], cx)
+    np.testing.assert_array_equal(e[1], cy)
+
+    # short series are done in one go
+    sx, sy = efield.calcE_chunk(bx[:1001], by[:1001], RES, THICK, dt=1)
+    np.testing.assert_array_equal(sx, efield.calcE(bx[:1001], by[:1001], RES, THICK, dt=1)[0])
+
+
+def test_fill_gaps():
+    x = np.array([np.nan, 1., np.nan, np.nan, 4., np.nan, np.nan, np.nan, 8., np.nan])
+    f, mask = efield.fill_gaps(x)
+    np.testing.assert_allclose(f[1:9], np.arange(1., 9.))
+    # gaps at the edges are not extrapolated
+    assert np.isnan(f[[0, 9]]).all()
+    np.testing.assert_array_equal(mask, np.isnan(f))
+
+    # longer gaps are left, columns are filled independently
+    f, mask = efield.fill_gaps(np.c_[x, np.arange(10.)], max_gap=2)
+    np.testing.assert_allclose(f[1:5, 0], [1., 2., 3., 4.])
+    assert np.isnan(f[5:8, 0]).all()
+    np.testing.assert_array_equal(mask[:, 0], [1, 0, 0, 0, 0, 1, 1, 1, 0, 1])
+    assert not mask[:, 1].any()
+
+    # all NaN
+    f, mask = efield.fill_gaps(np.full(7, np.nan))
+    assert np.isnan(f).all() and mask.all()
+
+
+def test_detrend():
+    t = np.arange(101.)
+    x = 3. + 0.5*t + np.sin(t)
+    d = efield.detrend(x)
+    ref = x - np.polyval(np.polyfit(t, x, 1), t)
+    np.testing.assert_allclose(d, ref, atol=1e-9)
+    np.testing.assert_allclose(efield.detrend(x, kind='mean'), x - x.mean())
+    np.testing.assert_array_equal(efield.detrend(x, kind=None), x)
+
+    # NaNs are ignored in the fit and left in place
+    y = x.copy()
+    y[[0, 50, 100]] = np.nan
+    ok = np.isfinite(y)
+    d = efield.detrend(np.c_[y, x])
+    ref = y - np.polyval(np.polyfit(t[ok], y[ok], 1), t)
+    np.testing.assert_allclose(d[ok, 0], ref[ok], atol=1e-9)
+    assert np.isnan(d[~ok, 0]).all()
+    np.testing.assert_allclose(d[:, 1], efield.detrend(x), atol=1e-9)
+
+    # all NaN stays NaN without warnings
+    assert np.isnan(efield.detrend(np.full(5, np.nan))).all()
+
+
+def test_taper():
+    for n in [10, 11]:
+        w = efield.taper(n, alpha=0.5)
+        assert len(w) == n
+        np.testing.assert_allclose(w, w[::-1])
+        assert w[0] == 0. and w[n//2] == 1.
+        assert (np.diff(w[:n//2+1]) >= 0).all()
+    np.testing.assert_array_equal(efield.taper(11, alpha=0.), np.ones(11))
+    np.testing.assert_array_equal(efield.taper(1), [1.])
+
+
+def test_prep_mag():
+    n = 101
+    bx, by = walk(n)
+    bx[[0, 1, 40, 41, 42, 100]] = np.nan
+    by[70] = np.nan
+    x, y, mask = efield.prep_mag(bx, by, max_gap=2)
+    # edge gaps stay masked, interior gaps within max_gap are filled
+    np.testing.assert_array_equal(np.flatnonzero(mask), [0, 1, 40, 41, 42, 100])
+    assert np.isfinite(x).all() and np.isfinite(y).all()
+    assert (x[mask] == 0.).all() and (y[mask] == 0.).all()
+    ex, ey = efield.calcE(x, y, RES, THICK, dt=1)
+    assert np.isfinite(ex).all() and np.isfinite(ey).all()
+
+    # taper and 2-D input
+    x2, y2, mask2 = efield.prep_mag(np.c_[bx, bx], np.c_[by, by], max_gap=2, alpha=0.2)
+    np.testing.assert_allclose(x2[:, 0], x2[:, 1])
+    np.testing.assert_allclose(x2[:, 0], x*efield.taper(n, alpha=0.2))
+    assert x2[0, 0] == 0. and x2[-1, 0] == 0.
+
+    # all NaN input is zeroed and masked
+    x, y, mask = efield.prep_mag(np.full(n, np.nan), np.full(n, np.nan))
+    assert mask.all() and (x == 0.).all() and (y == 0.).all()
+
+
+def test_res_models(tmp_path, monkeypatch):
+    models = efield.res_models(reload=True)
+    assert {'GILL', 'ISLL', 'PINA', 'FCHU'} <= set(models)
+    res, thick = efield.get_res('gill')
+    assert len(res) == len(thick) == 11
+    np.testing.assert_array_equal(res[:4], [30., 10000., 15000., 9000.])
+    np.testing.assert_array_equal(thick[:4], [10., 13000., 15000., 12000.])
+    assert efield.get_res('XXXX') is None
+    # column names are stripped of the spaces after the commas
+    assert list(efield.read_res('GILL').columns) == ['layer', 'thickness (m)', 'resistivity (Ohm-m)']
+    assert efield.read_res('XXXX') == -1
+
+    # a model in ~/.gmag/Stations takes precedence, invalid models are skipped
+    user = tmp_path / 'user'
+    user.mkdir()
+    (user / 'res_model_gill.txt').write_text('layer,thickness,resistivity\n1, 10, 50\n2, 0, 60\n')
+    (user / 'res_model_bad.txt').write_text('layer,thickness,resistivity\n1, 10, -5\n')
+    calls = []
+    monkeypatch.setattr(efield, 'res_dirs', lambda: calls.append(1) or [user])
+    try:
+        models = efield.res_models(reload=True)
+        assert set(models) == {'GILL'}
+        np.testing.assert_array_equal(efield.get_res('GILL')[0], [50., 60.])
+
+        # an empty search is cached
+        monkeypatch.setattr(efield, 'res_dirs', lambda: calls.append(1) or [tmp_path / 'none'])
+        del calls[:]
+        assert efield.res_models(reload=True) == {}
+        assert efield.res_models() == {}
+        assert efield.get_res('GILL') is None
+        assert len(calls) == 1
+    finally:
+        monkeypatch.undo()
+        efield.res_models(reload=True)
+
+
+def test_nearest_res():
+    stn_map = efield.nearest_res(['GILL', 'fsim', 'XXXX'])
+    assert stn_map == {'GILL': 'GILL', 'FSIM': 'FCHU', 'XXXX': None}
+    assert efield.nearest_res('FSIM', max_dist=100) == {'FSIM': None}
+
+
+def test_calcE_array():
+    n = 1001
+    bx = np.c_[walk(n, 1)[0], walk(n, 2)[0], walk(n, 3)[0]]
+    by = np.c_[walk(n, 1)[1], walk(n, 2)[1], walk(n, 3)[1]]
+    site = ['GILL', 'FSIM', 'XXXX']
+    ex, ey = efield.calcE_array(bx, by, site, dt=1)
+    assert ex.shape == ey.shape == (n, 3)
+    for i, mod in enumerate(['GILL', 'FCHU']):
+        res, thick = efield.get_res(mod)
+        rx, ry = efield.calcE(bx[:, i], by[:, i], res, thick, dt=1)
+        np.testing.assert_allclose(ex[:, i], rx, atol=1e-9)
+        np.testing.assert_allclose(ey[:, i], ry, atol=1e-9)
+    # no model
+    assert np.isnan(ex[:, 2]).all() and np.isnan(ey[:, 2]).all()
+
+    # explicit map
+    ex, ey = efield.calcE_array(bx, by, site, dt=1, stn_map={'XXXX': 'GILL'})
+    rx, ry = efield.calcE(bx[:, 2], by[:, 2], *efield.get_res('GILL'), dt=1)
+    np.testing.assert_allclose(ex[:, 2], rx, atol=1e-9)
+    assert np.isnan(ex[:, :2]).all()
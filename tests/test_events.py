@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for batch event window extraction.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import events
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+def test_table():
+    e_df = events.table(['2012-01-01 06:00'], site='gill', pre=60, post='2min')
+    assert e_df['stations'].iloc[0] == ['GILL']
+    assert e_df['pre'].iloc[0] == 60*10**9
+    assert e_df['post'].iloc[0] == 120*10**9
+    with pytest.raises(ValueError):
+        events.table(['2012-01-01 06:00'])
+
+
+def test_windows(archive):
+    ev = pd.DataFrame({'epoch': pd.to_datetime(['2012-01-01 06:00', '2012-01-01 23:30',
+                                                '2012-01-02 12:00']),
+                       'stations': [['GILL', 'ISLL'], ['GILL'], 'ISLL'],
+                       'pre': ['1h', '1h', '10min'],
+                       'post': [3600, 3600, 600]})
+    ep, t, meta = events.windows('carisma', ev, dl=False)
+    assert ep.shape == (3, 2, 7201)
+    assert t[0] == pd.Timedelta('-1h') and t[-1] == pd.Timedelta('1h')
+    assert meta['code'].tolist() == ['GILL', 'ISLL']
+
+    dat, _ = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False)
+    # window across midnight
+    ref = dat['GILL_X'].reindex(pd.Timestamp('2012-01-01 23:30') + t).to_numpy()
+    np.testing.assert_allclose(ep[1, 0], ref)
+    # station not requested
+    assert np.isnan(ep[1, 1]).all()
+    assert np.isnan(ep[2, 0]).all()
+    # shorter window of its own
+    inside = np.abs(t) <= pd.Timedelta('10min')
+    ref = dat['ISLL_X'].reindex(pd.Timestamp('2012-01-02 12:00') + t[inside]).to_numpy()
+    np.testing.assert_allclose(ep[2, 1, inside], ref)
+    assert np.isnan(ep[2, 1, ~inside]).all()
+
+
+def test_no_data(archive):
+    ev = pd.DataFrame({'epoch': pd.to_datetime(['2012-01-01 06:00', '2012-01-05 06:00']),
+                       'stations': [['GILL'], ['GILL']]})
+    ep, t, meta = events.windows('carisma', ev, pre='10min', post='10min', dl=False)
+    assert ep.shape == (2, 1, 1201)
+    assert np.isfinite(ep[0]).any() and np.isnan(ep[1]).all()
+
+    # no event has data
+    ep, t, meta = events.windows('carisma', ev.iloc[1:], pre='10min', post='10min',
+                                 cadence=1., dl=False)
+    assert ep.shape == (1, 1, 1201) and np.isnan(ep).all()
+    assert meta['code'].tolist() == ['GILL']
+
+
+def test_sparse_day(archive, monkeypatch):
+    # the first day read has a single sample
+    load = carisma.load
+
+    def sparse(site, sdate, **kwargs):
+        dat, meta = load(site, sdate, **kwargs)
+        if pd.Timestamp(sdate) == pd.Timestamp(SDATE):
+            dat = dat.loc[['2012-01-01 06:00:00']]
+            meta['Time Resolution'] = np.nan
+        return dat, meta
+
+    monkeypatch.setattr(carisma, 'load', sparse)
+    ev = pd.DataFrame({'epoch': pd.to_datetime(['2012-01-01 06:00', '2012-01-02 12:00']),
+                       'stations': [['GILL'], ['GILL']]})
+    ep, t, meta = events.windows('carisma', ev, pre='10min', post='10min', dl=False)
+    assert ep.shape == (2, 1, 1201)
+    # the held day is extracted once the cadence is known
+    dat, _ = load('GILL', SDATE, ndays=NDAYS, dl=False)
+    zero = np.flatnonzero(t == pd.Timedelta(0))[0]
+    assert ep[0, 0, zero] == dat.loc['2012-01-01 06:00:00', 'GILL_X']
+    assert np.isfinite(ep[0, 0]).sum() == 1
+    ref = dat['GILL_X'].reindex(pd.Timestamp('2012-01-02 12:00') + t).to_numpy()
+    np.testing.assert_allclose(ep[1, 0], ref)
+
+    # only sparse days, the cadence can't be measured
+    ep, t, meta = events.windows('carisma', ev.iloc[:1], pre='10min', post='10min', dl=False)
+    assert ep.shape == (1, 1, 0)
+    # or comes from the station metadata
+    monkeypatch.setattr(carisma, 'load', lambda *a, **k: (sparse(*a, **k)[0], load(*a, **k)[1]))
+    ep, t, meta = events.windows('carisma', ev.iloc[:1], pre='10min', post='10min', dl=False)
+    assert ep.shape == (1, 1, 1201) and ep[0, 0, zero] == dat.loc['2012-01-01 06:00:00', 'GILL_X']
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for resumable, conditional downloads against a local server.
+"""
+
+import filecmp
+import os
+
+import pandas as pd
+
+from gmag import cache, fetch, index
+from gmag.arrays import carisma, image, themis
+
+from conftest import NDAYS, SDATE
+
+
+def local(fn, root, mirror):
+    return os.path.join(mirror, os.path.relpath(fn, root))
+
+
+def test_download(remote):
+    server, root, files, mirror = remote
+    carisma.download('GILL', SDATE, ndays=NDAYS)
+    for fn in [f for f in files['carisma'] if 'GILL' in f]:
+        assert filecmp.cmp(fn, local(fn, root, mirror), shallow=False)
+    assert index.availability('carisma', 'GILL', SDATE, ndays=NDAYS)['GILL'].all()
+
+    # loaders download through the server
+    dat, meta = themis.load('KUUJ', SDATE, ndays=NDAYS)
+    assert len(dat) == NDAYS*172800
+    dat, meta = image.load(['AND', 'KEV'], SDATE, ndays=NDAYS)
+    assert meta.shape[0] == 2
+
+
+def test_not_modified(remote):
+    server, root, files, mirror = remote
+    fn = local(files['carisma'][0], root, mirror)
+    carisma.download('GILL', SDATE, ndays=1)
+    mtime = os.path.getmtime(fn)
+
+    del server.log[:]
+    carisma.download('GILL', SDATE, ndays=1, force=True)
+    assert [s for p, s in server.log] == [304]
+    assert os.path.getmtime(fn) == mtime
+
+
+def test_resume(remote):
+    server, root, files, mirror = remote
+    src = files['themis'][0]
+    fn = os.path.join(mirror, 'resume.cdf')
+    url = themis.list_files('KUUJ', SDATE)['hdir'].iloc[0] + os.path.basename(src)
+
+    server.truncate = 10000
+    try:
+        status, n = fetch.fetch(url, fn)
+    finally:
+        server.truncate = None
+    assert status == 'partial'
+    assert not os.path.exists(fn)
+    assert os.path.getsize(fn+'.part') == 10000
+
+    del server.log[:]
+    status, n = fetch.fetch(url, fn)
+    assert status == 'downloaded'
+    assert [s for p, s in server.log] == [206]
+    assert n == os.path.getsize(src) - 10000
+    assert filecmp.cmp(src, fn, shallow=False)
+    assert not os.path.exists(fn+'.part')
+
+
+def test_corrupt(remote):
+    server, root, files, mirror = remote
+    src = files['carisma'][-1]
+    with open(src, 'rb') as f:
+        good = f.read()
+    with open(src, 'wb') as f:
+        f.write(good[:len(good)//2])
+    try:
+        url = carisma.list_files('GILL', SDATE, ndays=NDAYS)['hdir'].iloc[-1] + os.path.basename(src)
+        fn = os.path.join(mirror, 'corrupt.F01.gz')
+        status, n = fetch.fetch(url, fn)
+    finally:
+        with open(src, 'wb') as f:
+            f.write(good)
+    assert status == 'corrupt'
+    assert not os.path.exists(fn)
+    assert not os.path.exists(fn+'.part')
+
+
+def test_pinned(remote):
+    server, root, files, mirror = remote
+    src = files['themis'][-1]
+    fn = os.path.join(mirror, 'pinned', os.path.basename(src))
+    url = themis.list_files('KUUJ', SDATE)['hdir'].iloc[0] + os.path.basename(src)
+    # a file downloaded by a load is kept until the load is done
+    with cache.scope():
+        status, n = fetch.fetch(url, fn, array='themis')
+        assert status == 'downloaded'
+        assert os.path.normpath(fn) in cache.pinned()
+    assert os.path.normpath(fn) not in cache.pinned()
+
+
+def test_trange(remote):
+    server, root, files, mirror = remote
+    f_df = themis.list_files('KUUJ', SDATE, ndays=NDAYS)
+    for fn in [os.path.join(d, f) for d, f in zip(f_df['dir'], f_df['fname'])]:
+        if os.path.exists(fn):
+            os.remove(fn)
+            index.remove(fn)
+
+    # only the days overlapping trange are requested
+    del server.log[:]
+    trange = ('2012-01-02 03:00', '2012-01-02 05:00')
+    dat, meta = themis.load('KUUJ', SDATE, ndays=NDAYS, trange=trange)
+    assert dat.index[0] == pd.Timestamp(trange[0])
+    assert dat.index[-1] == pd.Timestamp(trange[1])
+    assert [os.path.basename(p) for p, s in server.log] == [f_df['fname'].iloc[1]]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for hazard statistics, checkpointing and parallel years.
+"""
+
+import numpy as np
+import pytest
+
+from gmag import hazard, synthetic
+
+from conftest import DATA
+
+SITE = ['GILL', 'ISLL']
+YEARS = [2011, 2012]
+KW = dict(block=100, load_kw={'dl': False})
+
+
+@pytest.fixture(scope='module')
+def years(tmp_path_factory):
+    """A day of CARISMA data at the end of 2011 and the start of 2012."""
+    root = str(tmp_path_factory.mktemp('hazard'))
+    synthetic.set_local_dir(root)
+    synthetic.write_carisma(SITE, '2011-12-31', ndays=2)
+    yield root
+    synthetic.set_local_dir(DATA)
+
+
+@pytest.fixture(scope='module')
+def ref(years):
+    """Statistics of an uninterrupted run."""
+    return hazard.run('carisma', site=SITE, years=YEARS, **KW)
+
+
+def assert_stats_equal(a, b):
+    assert a['site'] == b['site']
+    assert a['years'] == b['years']
+    for k in ['count', 'max', 'hist', 'exceed']:
+        np.testing.assert_array_equal(a[k], b[k])
+    assert sorted(a['annual_max']) == sorted(b['annual_max'])
+    for yr in a['annual_max']:
+        np.testing.assert_array_equal(a['annual_max'][yr], b['annual_max'][yr])
+
+
+def test_run(ref):
+    stats = ref
+    assert stats['years'] == YEARS
+    assert (stats['count'] > 0).all()
+    # one daily peak for each year
+    np.testing.assert_array_equal(stats['hist'].sum(axis=1), [2, 2])
+    assert np.isfinite(stats['annual_max'][2011]).all()
+    s_df = hazard.summary(stats)
+    assert list(s_df.index) == SITE
+
+    # years in parallel give the same statistics
+    assert_stats_equal(hazard.run('carisma', site=SITE, years=YEARS, workers=2, **KW), stats)
+
+
+def test_resume(ref, tmp_path, monkeypatch):
+    fn = str(tmp_path / 'hazard.npz')
+
+    # interrupted after the first year
+    year_stats = hazard.year_stats
+
+    def interrupt(array, site, year, *args):
+        if year != YEARS[0]:
+            raise KeyboardInterrupt
+        return year_stats(array, site, year, *args)
+
+    monkeypatch.setattr(hazard, 'year_stats', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        hazard.run('carisma', site=SITE, years=YEARS, checkpoint=fn, **KW)
+    assert hazard.read(fn)['years'] == YEARS[:1]
+    monkeypatch.undo()
+
+    # resumed, only the remaining year is processed
+    done = []
+
+    def count(array, site, year, *args):
+        done.append(year)
+        return year_stats(array, site, year, *args)
+
+    monkeypatch.setattr(hazard, 'year_stats', count)
+    stats = hazard.run('carisma', site=SITE, years=YEARS, checkpoint=fn, **KW)
+    assert done == YEARS[1:]
+    assert_stats_equal(stats, ref)
+    assert_stats_equal(hazard.read(fn), ref)
+
+    # a checkpoint for other statistics is refused
+    with pytest.raises(ValueError):
+        hazard.run('carisma', site=SITE, years=YEARS, checkpoint=fn,
+                   thresholds=(1, 2), **KW)
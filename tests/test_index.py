@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the on-disk availability index.
+"""
+
+import os
+import shutil
+
+import pandas as pd
+
+from gmag import index
+from gmag import synthetic
+from gmag.arrays import canopus, carisma, image, themis
+
+from conftest import DATA, NDAYS, SDATE
+
+
+def test_availability(archive):
+    avail = index.availability('carisma', ['GILL', 'ISLL', 'XXXX'], SDATE, ndays=NDAYS+1)
+    assert avail.shape == (NDAYS+1, 3)
+    assert avail['GILL'].tolist() == [True]*NDAYS + [False]
+    assert not avail['XXXX'].any()
+
+    avail = index.availability('image', ['AND', 'KEV'], SDATE, ndays=NDAYS)
+    assert avail.all().all()
+
+
+def test_files(archive):
+    f_df = index.files('themis', 'KUUJ', SDATE, ndays=NDAYS)
+    assert len(f_df) == NDAYS
+    assert (f_df['size'] > 0).all()
+    assert f_df['checksum'].str.len().eq(64).all()
+    fn = archive['themis'][0]
+    assert index.checksum(fn) == f_df.loc[f_df['path'] == os.path.normpath(fn), 'checksum'].iloc[0]
+
+
+def test_present(archive):
+    f_df = carisma.list_files('GILL', SDATE, ndays=NDAYS+1)
+    assert index.present('carisma', f_df).tolist() == [True]*NDAYS + [False]
+
+    # no file system checks when listing
+    f_df = themis.list_files('ZZZZ', '1990-01-01', ndays=3)
+    assert not os.path.exists(f_df['dir'].iloc[0])
+
+
+def test_stale_and_scan(archive):
+    fn = archive['image'][-1]
+    tmp = fn + '.bak'
+    shutil.move(fn, tmp)
+    try:
+        # indexed but removed, the loader drops the entry
+        dat, meta = image.load(['AND'], SDATE, ndays=NDAYS, dl=False)
+        assert not index.availability('image', 'AND', SDATE, ndays=NDAYS)['AND'].iloc[-1]
+    finally:
+        shutil.move(tmp, fn)
+
+    # restored files are found by a scan
+    assert index.scan('image') == NDAYS
+    assert index.availability('image', 'AND', SDATE, ndays=NDAYS)['AND'].all()
+
+
+def test_copied_in(archive, tmp_path, monkeypatch):
+    # the day after the archive, written elsewhere
+    synthetic.set_local_dir(str(tmp_path))
+    try:
+        src = (synthetic.write_canopus('GILL', '2001-01-01', ndays=NDAYS+1)[-1:]
+               + synthetic.write_carisma('GILL', SDATE, ndays=NDAYS+1)[-1:])
+    finally:
+        synthetic.set_local_dir(DATA)
+    day = {canopus: '2001-01-03', carisma: '2012-01-03'}
+    # missing files rescan the array at most once per rescan seconds
+    scans = []
+    scan = index.scan
+    monkeypatch.setattr(index, 'scan', lambda *a, **k: scans.append(a) or scan(*a, **k))
+    for mod in (canopus, carisma):
+        assert mod.load('GILL', day[mod], dl=False) is None
+        n = len(scans)
+        assert mod.load('GILL', day[mod], dl=False) is None
+        assert len(scans) == n
+
+    # copied into data_dir by hand, not through index.add
+    dst = [os.path.join(DATA, os.path.relpath(fn, str(tmp_path))) for fn in src]
+    try:
+        for fn, d in zip(src, dst):
+            os.makedirs(os.path.dirname(d), exist_ok=True)
+            shutil.copy(fn, d)
+        # not until the next rescan is due
+        for mod in (canopus, carisma):
+            assert mod.load('GILL', day[mod], dl=False) is None
+        monkeypatch.setattr(index, 'rescan', 0.)
+        for mod in (canopus, carisma):
+            dat, meta = mod.load('GILL', day[mod], dl=False)
+            assert len(dat) and dat.index[0] == pd.Timestamp(day[mod])
+        assert index.availability('canopus', 'GILL', '2001-01-01', ndays=NDAYS+1)['GILL'].all()
+    finally:
+        for d in dst:
+            os.remove(d)
+            index.remove(d)
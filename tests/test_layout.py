@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the long and dict loader layouts.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import prefetch
+from gmag.arrays import carisma, themis
+
+from conftest import NDAYS, SDATE
+
+
+@pytest.mark.parametrize('mod, site', [
+    (carisma, ['GILL', 'ISLL']),
+    (themis, ['KUUJ'])],
+    ids=['carisma', 'themis'])
+def test_layouts(archive, mod, site):
+    wide, w_meta = mod.load(site, SDATE, ndays=NDAYS, dl=False)
+    long, l_meta = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='long')
+    dic, d_meta = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='dict')
+
+    assert long.index.names == ['station', 't']
+    assert list(dic) == site
+    assert 'flag' not in long.columns
+    pd.testing.assert_frame_equal(l_meta, d_meta)
+    assert l_meta['code'].tolist() == site
+    for stn in site:
+        # the station's own samples, without the other stations' times
+        w = wide[[c for c in wide.columns if c.startswith(stn+'_')]].reindex(dic[stn].index)
+        w.columns = [c[len(stn)+1:] for c in w.columns]
+        assert list(dic[stn].columns) == list(w.columns)
+        np.testing.assert_allclose(dic[stn].to_numpy(float), w.to_numpy(float))
+        np.testing.assert_allclose(long.loc[stn].to_numpy(float), w.to_numpy(float))
+    assert prefetch.nbytes((dic, d_meta)) > 0
+
+
+def test_bad_output(archive):
+    with pytest.raises(ValueError):
+        carisma.load('GILL', SDATE, dl=False, output='tall')
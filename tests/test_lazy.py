@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for lazy xarray dataset output.
+"""
+
+import numpy as np
+import pytest
+
+from gmag import lazy
+from gmag.arrays import carisma, image, themis
+
+from conftest import NDAYS, SDATE
+
+pytest.importorskip('xarray')
+pytest.importorskip('dask')
+
+
+@pytest.mark.parametrize('mod, site', [
+    (carisma, ['GILL', 'ISLL']),
+    (image, ['AND', 'KEV']),
+    (themis, ['KUUJ'])],
+    ids=['carisma', 'image', 'themis'])
+def test_dataset(archive, monkeypatch, mod, site):
+    reads = []
+    read = lazy._read
+    monkeypatch.setattr(lazy, '_read', lambda *args: reads.append(args[1:3]) or read(*args))
+
+    ds, meta = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='dataset')
+    assert ds['B'].dims == ('time', 'station', 'component')
+    assert ds['station'].values.tolist() == site
+    assert meta['code'].tolist() == site
+    assert 'cgm_latitude' in ds.coords
+    assert ds.sizes['time'] == NDAYS*86400/lazy.layouts[mod.__name__.split('.')[-1]][0]
+    # nothing read until computed
+    assert reads == []
+
+    dic, _ = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='dict')
+    stn = site[-1]
+    comp = ds['component'].values[0]
+    b = ds['B'].sel(station=stn, component=comp).to_series()
+    np.testing.assert_allclose(b.to_numpy(), dic[stn][comp].reindex(b.index).to_numpy())
+    # only the selected station's days are read
+    assert len(reads) == NDAYS
+
+
+def test_daily_dbdt(archive):
+    ds, meta = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False, output='dataset')
+    dbdt = abs(ds['B'].sel(component='X').diff('time')).resample(time='1D').max()
+    assert dbdt.shape == (NDAYS, 2)
+    assert np.isfinite(dbdt.compute().values).all()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for per sample MLT and CGM coordinates.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import lazy
+from gmag import magcoords
+from gmag import utils
+from gmag.arrays import carisma, themis
+
+from conftest import NDAYS, SDATE
+
+
+def _mlt_ut(stn, year):
+    return utils.load_station_coor(param='ALL', year=year).set_index('code').loc[stn, 'mlt_ut']
+
+
+def test_mlt_years():
+    t = pd.date_range('2011-12-31 23:00', '2012-01-01 01:00', freq='30min')
+    m = magcoords.mlt(t, ['GILL', 'ISLL'], cgm=True)
+    assert m['MLT'].shape == (len(t), 2) and m['MLT'].dtype == np.float32
+    # each sample uses the table of its year
+    assert np.allclose(m['MLT'][:2, 0], np.mod(_mlt_ut('GILL', 2011) + [23., 23.5], 24), atol=1e-4)
+    assert np.allclose(m['MLT'][2:, 0], _mlt_ut('GILL', 2012) + [0., 0.5, 1.], atol=1e-4)
+    assert set(m) == {'MLT'} | set(magcoords.cgm_columns)
+
+
+@pytest.mark.parametrize('mod, site', [(carisma, ['GILL', 'ISLL']), (themis, ['KUUJ', 'GBAY'])])
+def test_layouts(archive, mod, site):
+    w, meta = mod.load(site, SDATE, ndays=NDAYS, dl=False, mlt=True, cgm=True)
+    hour = (w.index - w.index.normalize()).total_seconds()/3600
+    for stn in site:
+        exp = np.mod(_mlt_ut(stn, 2012) + hour, 24)
+        assert np.allclose(w[stn+'_MLT'], exp, atol=1e-4)
+        assert np.allclose(w[stn+'_lshell'], meta.set_index('code').loc[stn, 'lshell'])
+
+    d, _ = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='dict', mlt=True)
+    l, _ = mod.load(site, SDATE, ndays=NDAYS, dl=False, output='long', mlt=True)
+    for stn in site:
+        assert 'lshell' not in d[stn].columns
+        np.testing.assert_allclose(d[stn]['MLT'], w[stn+'_MLT'].reindex(d[stn].index))
+        np.testing.assert_allclose(l.loc[stn]['MLT'], d[stn]['MLT'])
+
+
+@pytest.mark.skipif(not lazy.has_xarray(), reason='xarray and dask not installed')
+def test_dataset(archive):
+    ds, _ = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False, output='dataset', mlt=True)
+    assert ds['mlt'].dims == ('time', 'station')
+    assert ds['mlt'].chunks[0] == ds['B'].chunks[0]
+    w, _ = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False, mlt=True)
+    sel = ds['mlt'].sel(time=w.index[:100]).values
+    np.testing.assert_allclose(sel, w[['GILL_MLT', 'ISLL_MLT']].to_numpy()[:100], atol=1e-4)
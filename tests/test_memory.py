@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory regression tests for the loaders and calcE.
+
+Peak memory is measured with tracemalloc, which numpy and pandas report
+their buffers to, and normalised by the number of station samples loaded.
+A test fails when the peak exceeds its budget; budgets are roughly twice
+the peak measured when they were set, lower them as memory use improves.
+"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from gmag import efield
+from gmag.arrays import canopus, carisma, image, themis
+
+from conftest import NDAYS, SDATE
+
+# peak bytes per station sample
+budget = {'carisma': 300,
+          'canopus': 300,
+          # every station in the daily file is parsed
+          'image': 700,
+          'themis': 100,
+          'calcE': 650,
+          'calcE_chunk': 320}
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Call fn and return its output and peak traced memory (bytes)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        out = fn(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return out, peak
+
+
+@pytest.mark.parametrize('mod, site, sdate', [
+    (carisma, ['GILL', 'ISLL'], SDATE),
+    (canopus, ['GILL', 'ISLL'], '2001-01-01'),
+    (image, ['AND', 'KEV'], SDATE),
+    (themis, ['KUUJ', 'GBAY'], SDATE)],
+    ids=['carisma', 'canopus', 'image', 'themis'])
+def test_load_memory(archive, mod, site, sdate):
+    (dat, meta), peak = peak_memory(mod.load, site, sdate, ndays=NDAYS, dl=False)
+    n = dat.shape[0]*len(site)
+    assert n > 0
+
+    name = mod.__name__.split('.')[-1]
+    assert peak/n < budget[name], \
+        f'{name}.load peak {peak/n:.0f} B/sample exceeds {budget[name]}'
+
+
+@pytest.fixture(scope='module')
+def mag():
+    """Four days of 1 s synthetic field."""
+    rng = np.random.default_rng(0)
+    n = 4*86400
+    return rng.standard_normal(n).cumsum(), rng.standard_normal(n).cumsum()
+
+
+def test_calcE_memory(mag):
+    res, thick = efield.get_res('GILL')
+    _, peak = peak_memory(efield.calcE, *mag, res, thick, dt=1)
+    n = len(mag[0])
+    assert peak/n < budget['calcE'], \
+        f'calcE peak {peak/n:.0f} B/sample exceeds {budget["calcE"]}'
+
+
+def test_calcE_chunk_memory(mag):
+    res, thick = efield.get_res('GILL')
+    _, peak = peak_memory(efield.calcE_chunk, *mag, res, thick, dt=1, mem=2**24)
+    n = len(mag[0])
+    assert peak/n < budget['calcE_chunk'], \
+        f'calcE_chunk peak {peak/n:.0f} B/sample exceeds {budget["calcE_chunk"]}'
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the prefetching day by day loader.
+"""
+
+import pandas as pd
+
+from gmag import prefetch
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+def test_prefetch(archive):
+    site = ['GILL', 'ISLL']
+    with prefetch.Prefetch('carisma', site, SDATE, ndays=NDAYS+1, ahead=2,
+                           workers=2, dl=False) as days:
+        out = list(days)
+
+    assert [d for d, dat, meta in out] == list(pd.date_range(SDATE, periods=NDAYS+1))
+    # no file for the last day
+    assert out[-1][1] is None
+    dat = pd.concat([dat for d, dat, meta in out[:-1]])
+    ref, meta = carisma.load(site, SDATE, ndays=NDAYS, dl=False)
+    pd.testing.assert_frame_equal(dat, ref, check_freq=False)
+
+
+def test_memory_cap(archive):
+    days = prefetch.Prefetch('themis', 'KUUJ', SDATE, ndays=NDAYS, ahead=4,
+                             max_bytes=1, dl=False)
+    # a single day is buffered when over the cap
+    assert len(days.pending) == 1
+    date, dat, meta = next(days)
+    assert len(dat) == 172800
+    days.close()
+    assert list(days) == []
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the progress callback of the loaders.
+"""
+
+from gmag import utils
+from gmag.arrays import carisma, image
+
+from conftest import NDAYS, SDATE
+
+
+def test_wrap():
+    calls = []
+    prog = utils.Progress(calls.append, total=3)
+    assert utils.Progress.wrap(prog) is prog
+    new = utils.Progress.wrap(calls.append, total=2)
+    assert new is not prog and new.total == 2
+    prog.update('load', 'a', nbytes=10)
+    assert calls == [{'stage': 'load', 'file': 'a', 'done': 1, 'total': 3, 'bytes': 10,
+                      'elapsed': calls[0]['elapsed'], 'eta': calls[0]['eta']}]
+    assert calls[0]['eta'] is not None
+
+
+def test_load(archive):
+    # files are counted once by download and once by load,
+    # the total is known from the first call
+    site = ['GILL', 'ISLL']
+    calls = []
+    carisma.load(site, SDATE, ndays=NDAYS, progress=calls.append)
+    n = len(site)*NDAYS
+    assert [c['total'] for c in calls] == [2*n]*2*n
+    assert [c['done'] for c in calls] == list(range(1, 2*n+1))
+    assert [c['stage'] for c in calls] == (['download']*NDAYS + ['load']*NDAYS)*len(site)
+    loads = [c['bytes'] for c in calls if c['stage'] == 'load']
+    assert all(b > 0 for b in loads) and loads == sorted(loads)
+    assert calls[-1]['eta'] == 0
+
+    # without downloading only loads are counted
+    calls = []
+    image.load(['AND'], SDATE, ndays=NDAYS, dl=False, progress=calls.append)
+    assert [(c['stage'], c['done'], c['total']) for c in calls] == \
+        [('load', i, NDAYS) for i in range(1, NDAYS+1)]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for rule based quality control.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import qc
+
+
+@pytest.fixture
+def field():
+    rng = np.random.default_rng(1)
+    b = np.cumsum(rng.normal(0, 0.3, (20000, 3, 3)), axis=0) + np.array([13000., 100., 56000.])
+    b[5000, 1, 1] += 200.
+    b[12000:, 2, 2] += 80.
+    return b
+
+
+def test_rules(field):
+    b = field.copy()
+    b[100, 0, :] = 99999.9
+    b[200, 0, 2] = -1.
+    flag = np.full(b.shape[:2], '.')
+    flag[300, 2] = 'x'
+    mask = qc.check(b, flag=flag, rules=[{'rule': 'sentinel', 'value': 99999.9},
+                                         {'rule': 'flag'},
+                                         {'rule': 'range', 'component': 'Z', 'min': 0},
+                                         {'rule': 'spike'},
+                                         {'rule': 'step'}])
+    assert mask.dtype == np.uint8 and mask.shape == (20000, 3)
+    assert mask[100, 0] & qc.SENTINEL
+    assert mask[200, 0] & qc.RANGE
+    assert mask[300, 2] == qc.FLAG
+    assert mask[5000, 1] == qc.SPIKE
+    assert mask[12000, 2] == qc.STEP
+    # nothing else in the random walk
+    assert np.count_nonzero(mask) == 5
+
+    # a single station
+    m1 = qc.check(b[:, 1], rules=[{'rule': 'spike'}])
+    assert m1.shape == (20000,) and np.flatnonzero(m1).tolist() == [5000]
+
+    with pytest.raises(ValueError):
+        qc.check(b, rules=[{'rule': 'wobble'}])
+
+
+def test_clean(field):
+    t = pd.date_range('2012-01-01', periods=len(field), freq='s')
+    df = pd.DataFrame({s+'_'+c: field[:, j, k] for j, s in enumerate(['ABC', 'DEF', 'GHI'])
+                       for k, c in enumerate('XYZ')}, index=t)
+    df['ABC_flag'] = '.'
+    df['DEF_flag'] = '.'
+    df['GHI_flag'] = '.'
+    df.iloc[10, df.columns.get_loc('DEF_flag')] = 'x'
+
+    c_df, mask = qc.clean(df.copy(), rules=[{'rule': 'flag'}, {'rule': 'spike'}, {'rule': 'step'}])
+    assert list(mask.columns) == ['ABC', 'DEF', 'GHI']
+    assert c_df.iloc[10][['DEF_X', 'DEF_Y', 'DEF_Z']].isna().all()
+    assert c_df.iloc[5000][['DEF_X', 'DEF_Y', 'DEF_Z']].isna().all()
+    # steps are marked but kept
+    assert mask['GHI'].iloc[12000] == qc.STEP
+    assert c_df.iloc[12000].notna().all()
+    assert c_df.notna().all(axis=1).sum() == len(df) - 2
+
+    # default rules of an array
+    c_df, mask = qc.clean(df.copy(), 'carisma')
+    assert mask['DEF'].iloc[10] == qc.FLAG
+
+
+def test_dtypes():
+    t = pd.date_range('2012-01-01', periods=4, freq='1s')
+    df = pd.DataFrame({'GILL_X': np.array([1, 2, 3, 4], dtype=np.int64),
+                       'GILL_Y': np.array([1., 2., 3., 4.], dtype=np.float32),
+                       'GILL_Z': np.array([5., -1., 5., 5.]),
+                       'GILL_flag': ['.', '.', 'x', '.']}, index=t)
+    c_df, mask = qc.clean(df, 'carisma')
+    assert c_df['GILL_X'].dtype == np.float64 and c_df['GILL_Y'].dtype == np.float32
+    assert c_df['GILL_X'].isna().tolist() == [False, True, True, False]
+    assert c_df['GILL_Y'].isna().tolist() == [False, True, True, False]
+
+
+def test_sentinel_scope():
+    t = pd.date_range('2012-01-01', periods=3, freq='10s')
+    df = pd.DataFrame({'AND_X': [1., 99999.9, 3.], 'AND_Y': [1., 2., 3.],
+                       'AND_Z': [1., 2., 99999.9]}, index=t)
+    # IMAGE replaces the missing values only
+    c_df, mask = qc.clean(df.copy(), 'image')
+    assert c_df.isna().sum().tolist() == [1, 0, 1]
+    assert mask['AND'].tolist() == [0, qc.SENTINEL, qc.SENTINEL]
+    # by default the whole sample
+    c_df, mask = qc.clean(df.copy(), rules=[{'rule': 'sentinel', 'value': 99999.9}])
+    assert c_df.isna().sum().tolist() == [2, 2, 2]
+
+
+def test_clean_frames():
+    rng = np.random.default_rng(3)
+    frames = {}
+    for stn, n in [('GILL', 100), ('ISLL', 60), ('FSIM', 60), ('RABB', 60)]:
+        t = pd.date_range('2012-01-01', periods=n, freq='1s')
+        if stn == 'RABB':
+            # duplicate time stamps
+            t = t[[0] + list(range(n-1))]
+        df = pd.DataFrame(rng.normal(100, 1, (n, 3)), index=t,
+                          columns=[stn+'_'+c for c in 'XYZ'])
+        df[stn+'_flag'] = np.where(rng.random(n) < 0.1, 'x', '.')
+        frames[stn] = df
+    ref = {stn: qc.clean(df.copy(), 'carisma')[0] for stn, df in frames.items()}
+    ref_mask = {stn: qc.clean(df.copy(), 'carisma')[1] for stn, df in frames.items()}
+    out, mask = qc.clean_frames(frames, 'carisma')
+    assert list(mask) == list(out) == ['GILL', 'ISLL', 'FSIM', 'RABB']
+    for stn in frames:
+        pd.testing.assert_frame_equal(out[stn], ref[stn])
+        pd.testing.assert_frame_equal(mask[stn], ref_mask[stn])
+
+    # rolling rules only see the station's own samples
+    rules = qc.array_rules('carisma') + [{'rule': 'spike', 'window': 11, 'nmad': 2}]
+    out, mask = qc.clean_frames(frames, rules=rules)
+    for stn, df in frames.items():
+        pd.testing.assert_frame_equal(out[stn], qc.clean(df.copy(), rules=rules)[0])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for batched Welch spectra and band power.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import spectral
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+@pytest.fixture(scope='module')
+def day():
+    rng = np.random.default_rng(1)
+    t = pd.date_range('2012-01-01', periods=86400, freq='1s')
+    # 300 s wave, amplitude increasing with station
+    wave = np.sin(2*np.pi*np.arange(86400)/300.)[:, None]*np.arange(1, 5)
+    return t, rng.normal(size=(86400, 4)) + wave
+
+
+def test_welch(day):
+    t, x = day
+    tw, f, psd, n = spectral.welch(t, x, nperseg=1800)
+    assert psd.shape == (1, 4, 901) and n.tolist() == [[95]*4]
+    assert f[1] == pytest.approx(1/1800.)
+    # a sine of amplitude a has power a^2/2
+    pc5 = spectral.band_power(f, psd, 'Pc5')[0] - spectral.band_power(f, psd, (1/150., 1/100.))[0]
+    assert pc5 == pytest.approx(np.arange(1, 5)**2/2, rel=0.1)
+
+    signal = pytest.importorskip('scipy.signal')
+    fs, ps = signal.welch(x, fs=1., nperseg=1800, axis=0)
+    np.testing.assert_allclose(psd[0], ps.T, rtol=1e-10, atol=1e-12)
+    # each window is the Welch PSD of its samples
+    tw, f, psd, n = spectral.welch(t, x, nperseg=600, width=3600)
+    assert len(tw) == 24 and tw[1] == np.datetime64('2012-01-01T01:00')
+    fs, ps = signal.welch(x[3600:7200], fs=1., nperseg=600, axis=0)
+    np.testing.assert_allclose(psd[1], ps.T, rtol=1e-10, atol=1e-12)
+
+
+def test_stream(day):
+    t, x = day
+    tw, f, psd, n = spectral.welch(t, x, nperseg=600, width=3600)
+    st = spectral.Stream(nperseg=600, width=3600)
+    parts = [st.update(t[i:i+7000], x[i:i+7000]) for i in range(0, len(t), 7000)]
+    parts.append(st.flush())
+    np.testing.assert_array_equal(np.concatenate([p[0] for p in parts]), tw)
+    np.testing.assert_allclose(np.concatenate([p[2] for p in parts]), psd)
+    np.testing.assert_array_equal(np.concatenate([p[3] for p in parts]), n)
+    with pytest.raises(ValueError):
+        st.update(t[:10], x[:10, :3])
+
+
+def test_missing(day):
+    t, x = day
+    x = x.copy()
+    x[5000, 2] = np.nan
+    keep = np.ones(len(t), dtype=bool)
+    keep[40000:41000] = False
+    tw, f, psd, n = spectral.welch(t[keep], x[keep], nperseg=600, width=3600)
+    # only the station with the missing sample loses its segments
+    assert n[1].tolist() == [11, 11, 9, 11]
+    assert n[11].tolist() == [6]*4
+    tw, f, psd, n = spectral.welch(t, np.full((len(t), 1), np.nan), nperseg=600, width=3600)
+    assert np.isnan(psd).all() and (n == 0).all()
+
+
+def test_loader(archive):
+    dat, meta = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False)
+    t, bx, site = spectral.components(dat, 'X')
+    assert site == ['GILL', 'ISLL'] and bx.shape == (len(dat), 2)
+    d, _ = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False, output='dict')
+    t2, bx2, _ = spectral.components(d, 'X', site=site)
+    np.testing.assert_array_equal(bx2, pd.DataFrame(bx, index=t).reindex(t2).to_numpy())
+
+    tw, f, psd, n = spectral.welch(t, bx, nperseg=1800, width=86400)
+    assert psd.shape == (NDAYS, 2, 901)
+    assert np.isfinite(spectral.band_power(f, psd, 'Pc4')).all()
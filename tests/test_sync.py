@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for mirroring an array from a local server.
+"""
+
+import os
+import time
+
+import pytest
+
+from gmag import cli, sync
+
+from conftest import NDAYS, SDATE
+
+
+def test_sync(remote):
+    server, root, files, mirror = remote
+    r_df = sync.sync('carisma', ['GILL', 'ISLL'], SDATE, ndays=NDAYS, workers=2)
+    assert (r_df['status'] == 'downloaded').all()
+    assert len(r_df) == 2*NDAYS
+    assert all(os.path.exists(fn) for fn in r_df['fn'])
+    assert r_df['fn'].iloc[0].startswith(mirror)
+
+    # present files are skipped without a request
+    del server.log[:]
+    r_df = sync.sync('carisma', ['GILL', 'ISLL'], SDATE, ndays=NDAYS, workers=2)
+    assert (r_df['status'] == 'skipped').all()
+    assert server.log == []
+
+    rep = sync.report(r_df)
+    assert 'skipped' in rep
+
+
+def test_sync_missing(remote):
+    r_df = sync.sync('themis', ['KUUJ'], SDATE, ndays=NDAYS+1)
+    assert r_df['status'].tolist() == ['downloaded']*NDAYS + ['missing']
+    assert 'Failed' in sync.report(r_df)
+
+    with pytest.raises(ValueError):
+        sync.sync('canopus', ['GILL'], SDATE)
+
+
+def test_rate_limit():
+    limit = sync.RateLimit(2**20, burst=2**16)
+    t0 = time.perf_counter()
+    for i in range(8):
+        limit(2**16)
+    # 7 chunks over the burst at 1 MB/s
+    assert time.perf_counter() - t0 > 0.35
+
+    assert sync.parse_rate('2M') == 2*2**20
+    assert sync.parse_rate('500k') == 500*2**10
+
+
+def test_cli(remote, capsys):
+    code = cli.main(['sync', 'image', '--sdate', SDATE, '--ndays', str(NDAYS),
+                     '--rate', '10M', '-q'])
+    assert code == 0
+    out = capsys.readouterr().out
+    assert 'IMAGE' in out
+    assert 'downloaded' in out
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the synthetic archive.
+"""
+
+import os
+
+from gmag import synthetic
+
+from conftest import DATA, SDATE
+
+
+def test_empty_arrays(tmp_path):
+    try:
+        files = synthetic.archive(str(tmp_path), sdate=SDATE, ndays=1,
+                                  carisma_site=['GILL'], canopus_site=[],
+                                  image_site=[], themis_site=[])
+    finally:
+        synthetic.set_local_dir(DATA)
+    assert files['image'] == files['canopus'] == files['themis'] == []
+    assert len(files['carisma']) == 1 and os.path.exists(files['carisma'][0])
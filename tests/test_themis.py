@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for reading THEMIS CDF files.
+"""
+
+import numpy as np
+import pandas as pd
+
+from gmag.arrays import themis
+
+from conftest import NDAYS, SDATE
+
+
+def test_load(archive):
+    dat, meta = themis.load('KUUJ', SDATE, ndays=NDAYS, dl=False)
+    assert list(dat.columns) == ['KUUJ_H', 'KUUJ_D', 'KUUJ_Z']
+    assert dat.index.name == 't'
+    assert dat.index.is_monotonic_increasing
+    assert (dat.dtypes == np.float32).all()
+    assert len(dat) == NDAYS*86400*2
+    assert meta['Time Resolution'].iloc[0] == 0.5
+    assert meta['PI'].iloc[0] == 'Synthetic PI'
+    assert ('KUUJ', 'v01') in themis._attrs
+
+
+def test_load_trange(archive):
+    dat, meta = themis.load('KUUJ', SDATE, ndays=NDAYS, dl=False)
+    trange = ('2012-01-01 23:30', '2012-01-02 00:30')
+    sub, s_meta = themis.load('KUUJ', SDATE, ndays=NDAYS, dl=False, trange=trange)
+    assert sub.index[0] == pd.Timestamp(trange[0])
+    assert sub.index[-1] == pd.Timestamp(trange[1])
+    t0, t1 = pd.to_datetime(list(trange))
+    pd.testing.assert_frame_equal(sub, dat.loc[t0:t1])
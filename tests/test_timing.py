@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for stage timing, the report and callbacks.
+"""
+
+import numpy as np
+import pytest
+
+from gmag import timing
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+def test_stage():
+    # disabled by default, stages do nothing
+    assert not timing.enabled
+    assert timing.stage('m', 's') is timing._null
+
+    recs = []
+    with timing.profile(callback=recs.append):
+        with timing.stage('m', 'a', files=1) as st:
+            st.add(rows=10)
+            st.add(rows=5)
+        with pytest.raises(ValueError):
+            with timing.stage('m', 'b'):
+                raise ValueError
+        with timing.stage('m', 'a', files=1):
+            pass
+    assert not timing.enabled
+    assert timing._callbacks == []
+
+    # the callback receives every completed stage
+    assert [(r['module'], r['stage'], r['error']) for r in recs] == \
+        [('m', 'a', False), ('m', 'b', True), ('m', 'a', False)]
+    assert recs[0]['rows'] == 15 and recs[0]['files'] == 1
+    assert all(r['duration'] >= 0 for r in recs)
+
+    rep = timing.report()
+    assert list(rep.index) == [('m', 'a'), ('m', 'b')]
+    assert list(rep['calls']) == [2, 1]
+    assert rep.loc[('m', 'a'), 'files'] == 2
+    # counts a stage never recorded are NaN
+    assert np.isnan(rep.loc[('m', 'b'), 'files'])
+    assert rep.loc[('m', 'a'), 'rows'] == 15
+    assert rep.loc[('m', 'a'), 'total'] == pytest.approx(recs[0]['duration'] + recs[2]['duration'])
+
+    timing.reset()
+    assert timing.report().empty
+
+
+def test_load(archive):
+    with timing.profile():
+        carisma.load('GILL', SDATE, ndays=NDAYS, dl=False)
+    rep = timing.report()
+    assert rep.loc[('carisma', 'read'), 'calls'] == NDAYS
+    assert rep.loc[('carisma', 'read'), 'files'] == NDAYS
+    assert rep.loc[('carisma', 'read'), 'bytes'] > 0
+    assert rep.loc[('carisma', 'read'), 'rows'] == NDAYS*86400
+    timing.reset()
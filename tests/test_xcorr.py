@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for pairwise cross-correlation lags.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gmag import spectral
+from gmag import xcorr
+from gmag.arrays import carisma
+
+from conftest import NDAYS, SDATE
+
+
+@pytest.fixture(scope='module')
+def delayed():
+    rng = np.random.default_rng(2)
+    n = 4*3600
+    t = pd.date_range('2012-01-01', periods=n, freq='1s')
+    base = np.convolve(rng.normal(size=n+1000), np.ones(30)/30, 'same')
+    delay = np.array([0, 12, 45, 100])
+    x = np.stack([base[500-d:500-d+n] for d in delay], axis=1) + 0.05*rng.normal(size=(n, 4))
+    x[rng.random(x.shape) < 0.05] = np.nan
+    return t, x, delay
+
+
+def _brute(a, b, k):
+    """Correlation of a(t) and b(t+k) over samples valid in both."""
+    a = a - np.nanmean(a)
+    b = b - np.nanmean(b)
+    u, v = (a[:len(a)-k], b[k:]) if k >= 0 else (a[-k:], b[:len(b)+k])
+    ok = np.isfinite(u) & np.isfinite(v)
+    return (u[ok]*v[ok]).sum()/np.sqrt((u[ok]**2).sum()*(v[ok]**2).sum())
+
+
+def test_correlate(delayed):
+    t, x, delay = delayed
+    seg = x[:3600].T[None]
+    i, j, c = xcorr.correlate(seg, 120)
+    assert c.shape == (1, 6, 241)
+    p = list(zip(i, j)).index((0, 2))
+    ref = [_brute(x[:3600, 0], x[:3600, 2], k) for k in range(-120, 121)]
+    np.testing.assert_allclose(c[0, p], ref, atol=1e-12)
+
+
+def test_lags(delayed):
+    t, x, delay = delayed
+    tw, lag, r = xcorr.lags(t, x, width=3600, step=1800, max_lag=300)
+    assert lag.shape == (7, 4, 4) and tw[1] == np.datetime64('2012-01-01T00:30')
+    np.testing.assert_allclose(lag[:, 0, :], np.broadcast_to(delay, (7, 4)), atol=0.2)
+    np.testing.assert_allclose(lag, -lag.transpose(0, 2, 1))
+    np.testing.assert_allclose(r, r.transpose(0, 2, 1))
+    assert (r[:, 0, 1] > 0.9).all()
+
+    # a station without data
+    x = x.copy()
+    x[:, 3] = np.nan
+    tw, lag, r = xcorr.lags(t, x, width=3600, max_lag=300)
+    assert np.isnan(lag[:, 3]).all() and np.isnan(r[:, :, 3]).all()
+    assert np.isfinite(lag[:, :3, :3]).all()
+
+
+def test_loader(archive):
+    dat, meta = carisma.load(['GILL', 'ISLL'], SDATE, ndays=NDAYS, dl=False)
+    t, bx, site = spectral.components(dat, 'X')
+    tw, lag, r = xcorr.lags(t, bx, width=3600, max_lag=600)
+    assert lag.shape == (24*NDAYS, 2, 2)
+    assert (lag[:, [0, 1], [0, 1]] == 0).all()